@@ -0,0 +1,66 @@
+"""
+Compara dois resultados de `benchmarks/rotas.py` (por exemplo, main x branch).
+
+Um cenário regride quando a mediana cresce acima da tolerância ou quando
+passa a executar mais instruções SQL por requisição (contagem determinística,
+que não depende do ruído da máquina). Sai com código 1 se houver regressão.
+
+Uso:
+    python benchmarks/comparar.py base.json novo.json [--tolerancia 1.25]
+"""
+
+import argparse
+import json
+import sys
+
+
+def carregar(caminho):
+    with open(caminho, encoding='utf-8') as arquivo:
+        return json.load(arquivo)
+
+
+def comparar(base, novo, tolerancia):
+    """Retorna [(cenário, mediana base, mediana nova, razão, SQL base, SQL novo, regrediu)]."""
+    linhas = []
+    cenarios_base = dict(base['cenarios'])
+    cenarios_novo = dict(novo['cenarios'])
+    cenarios_base['concorrencia'] = base['concorrencia']
+    cenarios_novo['concorrencia'] = novo['concorrencia']
+    for nome, antes in cenarios_base.items():
+        depois = cenarios_novo.get(nome)
+        if depois is None:
+            continue
+        razao = depois['mediana_ms'] / antes['mediana_ms'] if antes['mediana_ms'] else float('inf')
+        sql_antes, sql_depois = antes.get('instrucoes_sql'), depois.get('instrucoes_sql')
+        regrediu = razao > tolerancia or (sql_antes is not None and sql_depois > sql_antes)
+        if nome == 'concorrencia':
+            regrediu = regrediu or not depois['consistente']
+        linhas.append((nome, antes['mediana_ms'], depois['mediana_ms'], razao, sql_antes, sql_depois, regrediu))
+    return linhas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('base')
+    parser.add_argument('novo')
+    parser.add_argument('--tolerancia', type=float, default=1.25,
+                        help='razão máxima aceita entre as medianas (novo / base)')
+    args = parser.parse_args()
+
+    base, novo = carregar(args.base), carregar(args.novo)
+    if base['meta']['parametros'] != novo['meta']['parametros']:
+        print('Aviso: os resultados foram gerados com parâmetros diferentes.')
+    print(f"base: {base['meta']['commit']}  novo: {novo['meta']['commit']}")
+    print(f"{'cenário':32} {'base':>10} {'novo':>10} {'razão':>7} {'SQL':>11}")
+
+    regressoes = 0
+    for nome, antes, depois, razao, sql_antes, sql_depois, regrediu in comparar(base, novo, args.tolerancia):
+        sql = f'{sql_antes:g}→{sql_depois:g}' if sql_antes is not None else '-'
+        marca = '  REGRESSÃO' if regrediu else ''
+        print(f'{nome:32} {antes:8.2f}ms {depois:8.2f}ms {razao:6.2f}x {sql:>11}{marca}')
+        regressoes += regrediu
+    return 1 if regressoes else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,183 @@
+"""
+Gerador determinístico de um armazém sintético para benchmarks.
+
+Cria N produtos, M usuários e K movimentações com distribuição realista: a
+popularidade dos produtos segue uma lei de Zipf (poucos itens concentram a
+maior parte das movimentações), o movimento cai nos fins de semana e fica no
+horário comercial, entradas chegam em lotes maiores que as saídas e nenhum
+produto fica com saldo negativo em momento algum do histórico. A mesma
+semente gera sempre os mesmos dados.
+
+Uso (grava no banco de LOGIFLOW_DATABASE_URL, que deve estar vazio):
+    python benchmarks/gerar_dados.py [--produtos 5000] [--usuarios 25]
+                                     [--movimentacoes 100000] [--semente 42]
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from sqlalchemy import insert  # noqa: E402
+from app import (  # noqa: E402
+    ARMAZEM_PRINCIPAL_ID, Base, EstoqueArmazem, Movimentacao, Produto, SessionLocal, Usuario, hash_password,
+    obter_engine, reconstruir_resumo,
+)
+
+SENHA_USUARIOS = 'bench123'
+TAMANHO_LOTE = 10000
+CATEGORIAS = ('Parafuso', 'Porca', 'Arruela', 'Cabo', 'Conector', 'Rolamento', 'Correia', 'Filtro',
+              'Válvula', 'Sensor', 'Fusível', 'Luva', 'Caixa', 'Etiqueta', 'Fita', 'Palete')
+ACABAMENTOS = ('Inox', 'Galvanizado', 'Nylon', 'Cobre', 'Alumínio', 'Aço', 'PVC', 'Borracha')
+# Peso relativo de cada dia da semana (segunda a domingo).
+PESOS_DIA_SEMANA = np.array([1.0, 1.0, 1.0, 1.0, 0.9, 0.35, 0.1])
+
+
+def _em_lotes(registros, tamanho=TAMANHO_LOTE):
+    for inicio in range(0, len(registros), tamanho):
+        yield registros[inicio:inicio + tamanho]
+
+
+def _tempos(rng, quantidade, dias, agora):
+    """Instantes nos últimos `dias` dias, ponderados por dia da semana e em horário comercial."""
+    inicio = (agora - timedelta(days=dias)).replace(hour=0, minute=0, second=0, microsecond=0)
+    dias_semana = (np.arange(dias) + inicio.weekday()) % 7
+    pesos = PESOS_DIA_SEMANA[dias_semana]
+    dia = rng.choice(dias, size=quantidade, p=pesos / pesos.sum())
+    segundos = rng.integers(8 * 3600, 18 * 3600, size=quantidade)
+    base = np.datetime64(inicio, 'us')
+    instantes = base + dia.astype('timedelta64[D]') + segundos.astype('timedelta64[s]')
+    return np.minimum(instantes, np.datetime64(agora, 'us'))
+
+
+def gerar(produtos=5000, usuarios=25, movimentacoes=100000, dias=365, semente=42, agora=None):
+    """
+    Popula o banco configurado e retorna um dict com o que foi criado.
+    Os ids começam em 1, então o banco deve estar vazio.
+    """
+    rng = np.random.default_rng(semente)
+    agora = agora or datetime.now()
+    Base.metadata.create_all(bind=obter_engine())
+
+    # Popularidade Zipf (s = 1.1), com a ordem dos produtos embaralhada para
+    # que os mais movimentados não sejam os primeiros ids.
+    popularidade = 1.0 / np.arange(1, produtos + 1) ** 1.1
+    popularidade = rng.permutation(popularidade / popularidade.sum())
+
+    produto_mov = rng.choice(produtos, size=movimentacoes, p=popularidade)
+    tempos = _tempos(rng, movimentacoes, dias, agora)
+    # Reposições menos frequentes e em lotes maiores; o volume total de
+    # entradas e saídas fica próximo, como em um estoque em regime.
+    eh_entrada = rng.random(movimentacoes) < 0.3
+    quantidades = np.where(
+        eh_entrada,
+        np.ceil(rng.lognormal(2.2, 0.6, movimentacoes)),
+        np.ceil(rng.lognormal(1.0, 0.8, movimentacoes)),
+    ).astype(np.int64)
+    usuario_mov = rng.integers(0, usuarios, size=movimentacoes)
+
+    # Estoque inicial suficiente para que o saldo de cada produto nunca fique
+    # negativo: o menor saldo acumulado, em ordem cronológica, define o piso.
+    ordem = np.lexsort((tempos, produto_mov))
+    deltas = np.where(eh_entrada, quantidades, -quantidades)[ordem]
+    acumulado = np.cumsum(deltas)
+    produtos_ordenados = produto_mov[ordem]
+    inicios = np.flatnonzero(np.r_[True, produtos_ordenados[1:] != produtos_ordenados[:-1]])
+    deslocamento = np.r_[0, acumulado[:-1]][inicios]
+    saldo = acumulado - np.repeat(deslocamento, np.diff(np.r_[inicios, len(ordem)]))
+    piso = np.zeros(produtos, dtype=np.int64)
+    piso[produtos_ordenados[inicios]] = np.minimum.reduceat(saldo, inicios)
+    estoque_inicial = np.maximum(-piso, 0) + rng.integers(0, 30, size=produtos)
+    saldo_final = estoque_inicial + np.bincount(
+        produto_mov, weights=np.where(eh_entrada, quantidades, -quantidades), minlength=produtos,
+    ).astype(np.int64)
+
+    precos = np.round(rng.lognormal(3.0, 1.1, produtos), 2) + 0.5
+    minimos = rng.integers(2, 40, size=produtos)
+    criado_em = agora - timedelta(days=dias + 1)
+
+    senha_hash = hash_password(SENHA_USUARIOS)
+    db = SessionLocal()
+    try:
+        db.execute(insert(Usuario), [
+            {
+                'nome': f'Operador {i + 1}', 'email': f'operador{i + 1}@bench.local', 'senha_hash': senha_hash,
+                'eh_administrador': i == 0, 'ativo': True, 'criado_em': criado_em,
+            }
+            for i in range(usuarios)
+        ])
+        registros_produtos = [
+            {
+                'nome': f'{CATEGORIAS[i % len(CATEGORIAS)]} {ACABAMENTOS[(i // len(CATEGORIAS)) % len(ACABAMENTOS)]} {i + 1:05d}',
+                'preco': float(precos[i]), 'quantidade': int(saldo_final[i]), 'quantidade_minima': int(minimos[i]),
+                'criado_em': criado_em, 'atualizado_em': agora,
+            }
+            for i in range(produtos)
+        ]
+        for lote in _em_lotes(registros_produtos):
+            db.execute(insert(Produto), lote)
+        # A inserção em massa não dispara os eventos do ORM: o saldo de cada
+        # produto no armazém principal é gravado aqui, junto com o produto.
+        registros_saldos = [
+            {'armazem_id': ARMAZEM_PRINCIPAL_ID, 'produto_id': i + 1, 'quantidade': int(saldo_final[i]),
+             'atualizado_em': agora}
+            for i in range(produtos)
+        ]
+        for lote in _em_lotes(registros_saldos):
+            db.execute(insert(EstoqueArmazem), lote)
+
+        # Inseridas em ordem cronológica, como na operação real (ids crescem com o tempo).
+        cronologica = np.argsort(tempos, kind='stable')
+        instantes = tempos[cronologica].astype('datetime64[us]').tolist()
+        registros_movimentacoes = [
+            {
+                'produto_id': int(produto_mov[j]) + 1, 'usuario_id': int(usuario_mov[j]) + 1,
+                'tipo_movimentacao': 'entrada' if eh_entrada[j] else 'saida',
+                'quantidade': int(quantidades[j]), 'observacoes': '', 'data_movimentacao': instante,
+                'armazem_id': ARMAZEM_PRINCIPAL_ID,
+            }
+            for j, instante in zip(cronologica.tolist(), instantes)
+        ]
+        for lote in _em_lotes(registros_movimentacoes):
+            db.execute(insert(Movimentacao), lote)
+
+        reconstruir_resumo(db)
+        db.commit()
+    finally:
+        db.close()
+
+    return {
+        'produtos': produtos,
+        'usuarios': usuarios,
+        'movimentacoes': movimentacoes,
+        'dias': dias,
+        'semente': semente,
+        'estoque_baixo': int(np.count_nonzero(saldo_final <= minimos)),
+        'produtos_mais_movimentados': (np.argsort(-popularidade, kind='stable')[:20] + 1).tolist(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--produtos', type=int, default=5000)
+    parser.add_argument('--usuarios', type=int, default=25)
+    parser.add_argument('--movimentacoes', type=int, default=100000)
+    parser.add_argument('--dias', type=int, default=365)
+    parser.add_argument('--semente', type=int, default=42)
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    dados = gerar(args.produtos, args.usuarios, args.movimentacoes, args.dias, args.semente)
+    print(f"{dados['produtos']} produtos, {dados['usuarios']} usuários e {dados['movimentacoes']} movimentações "
+          f"gerados em {time.perf_counter() - inicio:.1f} s ({dados['estoque_baixo']} com estoque baixo).")
+    print(f'Usuários: operador1@bench.local (administrador) a operador{dados["usuarios"]}@bench.local, '
+          f'senha {SENHA_USUARIOS}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+"""
+Benchmark das rotas principais sobre um armazém sintético.
+
+Gera os dados com `gerar_dados.gerar` (mesma semente, mesmos dados) em um
+banco temporário e mede cada rota pelo test client do Flask: dashboard,
+relatórios, movimentações (também por armazém), API e os formulários de entrada, saída e lote.
+Depois dispara clientes simultâneos fazendo entradas e saídas nos produtos
+mais movimentados e confere que o estoque continua consistente.
+
+Os resultados vão para um JSON que pode ser comparado entre commits com
+`benchmarks/comparar.py`. Roda offline, sem servidor.
+
+Uso:
+    python benchmarks/rotas.py [--produtos 5000] [--movimentacoes 100000]
+        [--repeticoes 30] [--clientes 8] [--operacoes 100]
+        [--cache frio|quente] [--saida resultados.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+DIRETORIO_TEMP = tempfile.mkdtemp(prefix='logiflow-bench-')
+os.environ['LOGIFLOW_DATABASE_URL'] = f"sqlite:///{os.path.join(DIRETORIO_TEMP, 'bench.db')}"
+os.environ.setdefault('LOGIFLOW_ALERTA_TRANSPORTE', f"arquivo:{os.path.join(DIRETORIO_TEMP, 'alertas.log')}")
+# O log de requisições lentas atrapalharia a leitura da saída.
+os.environ.setdefault('LOGIFLOW_METRICAS_LENTA_MS', '0')
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+import sqlalchemy  # noqa: E402
+from gerar_dados import gerar  # noqa: E402
+from app import (  # noqa: E402
+    create_app, Movimentacao, Produto, SessionLocal, cache_analises, cache_consultas, registro_metricas,
+    verificar_resumo,
+)
+from sqlalchemy import func, select  # noqa: E402
+
+app = create_app()
+
+
+def percentil(valores, fracao):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(fracao * (len(ordenados) - 1))))]
+
+
+def resumir(tempos):
+    return {
+        'repeticoes': len(tempos),
+        'mediana_ms': round(statistics.median(tempos), 3),
+        'p95_ms': round(percentil(tempos, 0.95), 3),
+        'media_ms': round(statistics.mean(tempos), 3),
+        'min_ms': round(min(tempos), 3),
+    }
+
+
+def novo_cliente(usuario_id=1):
+    cliente = app.test_client()
+    with cliente.session_transaction() as sessao:
+        sessao['user_id'] = usuario_id
+        sessao['user_name'] = 'Benchmark'
+    return cliente
+
+
+def cenarios(dados, rng):
+    """(nome, endpoint, função que faz a requisição) de cada rota medida."""
+    quentes = dados['produtos_mais_movimentados']
+    meio = dados['produtos'] // 2
+
+    def get(url):
+        return lambda cliente: cliente.get(url)
+
+    def movimentar(tipo):
+        return lambda cliente: cliente.post(f'/{tipo}/{rng.choice(quentes)}', data={'quantidade': '1'})
+
+    def lote(cliente):
+        itens = '\n'.join(f'{produto_id};entrada;1' for produto_id in rng.sample(quentes, 10))
+        return cliente.post('/movimentacao/lote', data={'itens': itens})
+
+    return [
+        ('dashboard', 'principal.dashboard', get('/dashboard')),
+        ('dashboard_pagina_intermediaria', 'principal.dashboard', get(f'/dashboard?apos={meio}')),
+        ('dashboard_estoque_baixo', 'principal.dashboard', get('/dashboard?baixo=1')),
+        ('dashboard_busca', 'principal.dashboard', get('/dashboard?busca=rolamento+inox')),
+        ('dashboard_armazem', 'principal.dashboard', get('/dashboard?armazem=1')),
+        ('relatorio', 'principal.relatorio', get('/relatorio')),
+        ('relatorio_armazem', 'principal.relatorio', get('/relatorio?armazem=1')),
+        ('relatorio_estoque', 'principal.relatorio_estoque', get('/relatorio/estoque')),
+        ('movimentacoes', 'principal.movimentacoes', get('/movimentacoes')),
+        ('movimentacoes_armazem', 'principal.movimentacoes', get('/movimentacoes?armazem=1')),
+        ('armazens', 'principal.armazens', get('/armazens')),
+        ('api_produtos', 'principal.api_produtos', get('/api/v1/produtos?limite=100')),
+        ('api_movimentacoes', 'principal.api_movimentacoes', get('/api/v1/movimentacoes?limite=100')),
+        ('api_relatorio', 'principal.api_relatorio', get('/api/v1/relatorio')),
+        ('entrada', 'principal.entrada_estoque', movimentar('entrada')),
+        ('saida', 'principal.saida_estoque', movimentar('saida')),
+        ('movimentacao_lote', 'principal.movimentacao_lote', lote),
+    ]
+
+
+def medir_cenario(cliente, endpoint, requisicao, repeticoes, aquecimento, cache):
+    for _ in range(aquecimento):
+        requisicao(cliente)
+    registro_metricas.limpar()
+    tempos, status = [], {}
+    for _ in range(repeticoes):
+        if cache == 'frio':
+            cache_consultas.limpar()
+            cache_analises.limpar()
+        inicio = time.perf_counter()
+        resposta = requisicao(cliente)
+        tempos.append((time.perf_counter() - inicio) * 1000)
+        status[str(resposta.status_code)] = status.get(str(resposta.status_code), 0) + 1
+
+    resultado = resumir(tempos)
+    instrucoes, tempo_sql, linhas = registro_metricas.totais_sql().get(endpoint, (0, 0.0, 0))
+    resultado.update({
+        'instrucoes_sql': round(instrucoes / repeticoes, 2),
+        'tempo_sql_ms': round(tempo_sql * 1000 / repeticoes, 3),
+        'linhas_sql': round(linhas / repeticoes, 2),
+        'status': status,
+    })
+    return resultado
+
+
+def totais_estoque():
+    db = SessionLocal()
+    try:
+        quantidade = db.execute(select(func.coalesce(func.sum(Produto.quantidade), 0))).scalar()
+        movimentado = db.execute(select(func.coalesce(func.sum(
+            sqlalchemy.case((Movimentacao.tipo_movimentacao == 'entrada', Movimentacao.quantidade),
+                            else_=-Movimentacao.quantidade)
+        ), 0))).scalar()
+        return quantidade, movimentado
+    finally:
+        db.close()
+
+
+def medir_concorrencia(dados, clientes, operacoes, semente):
+    """
+    `clientes` threads, cada uma com o próprio test client, alternando
+    entradas e saídas de 1 a 3 unidades nos produtos mais movimentados.
+    Ao final, a variação do estoque deve bater com a das movimentações.
+    """
+    quentes = dados['produtos_mais_movimentados'][:5]
+    quantidade_antes, movimentado_antes = totais_estoque()
+    tempos, status, trava = [], {}, threading.Lock()
+    largada = threading.Barrier(clientes + 1)
+
+    def trabalhar(indice):
+        rng = random.Random(semente + indice)
+        cliente = novo_cliente()
+        locais, status_locais = [], {}
+        largada.wait()
+        for operacao in range(operacoes):
+            tipo = 'entrada' if operacao % 2 == 0 else 'saida'
+            inicio = time.perf_counter()
+            resposta = cliente.post(f'/{tipo}/{rng.choice(quentes)}', data={'quantidade': str(rng.randint(1, 3))})
+            locais.append((time.perf_counter() - inicio) * 1000)
+            status_locais[str(resposta.status_code)] = status_locais.get(str(resposta.status_code), 0) + 1
+        with trava:
+            tempos.extend(locais)
+            for codigo, total in status_locais.items():
+                status[codigo] = status.get(codigo, 0) + total
+
+    threads = [threading.Thread(target=trabalhar, args=(i,)) for i in range(clientes)]
+    for thread in threads:
+        thread.start()
+    largada.wait()
+    inicio = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    duracao = time.perf_counter() - inicio
+
+    quantidade_depois, movimentado_depois = totais_estoque()
+    db = SessionLocal()
+    try:
+        divergencias = verificar_resumo(db)
+    finally:
+        db.close()
+
+    resultado = resumir(tempos)
+    resultado.update({
+        'clientes': clientes,
+        'operacoes_por_cliente': operacoes,
+        'duracao_s': round(duracao, 3),
+        'operacoes_por_segundo': round(len(tempos) / duracao, 1),
+        'status': status,
+        'consistente': (quantidade_depois - quantidade_antes == movimentado_depois - movimentado_antes
+                        and not divergencias),
+    })
+    return resultado
+
+
+def commit_atual():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--produtos', type=int, default=5000)
+    parser.add_argument('--usuarios', type=int, default=25)
+    parser.add_argument('--movimentacoes', type=int, default=100000)
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--repeticoes', type=int, default=30)
+    parser.add_argument('--aquecimento', type=int, default=3)
+    parser.add_argument('--clientes', type=int, default=8)
+    parser.add_argument('--operacoes', type=int, default=100)
+    parser.add_argument('--cache', choices=('frio', 'quente'), default='frio',
+                        help='frio limpa os caches de leitura antes de cada requisição')
+    parser.add_argument('--saida', default='resultados.json')
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    dados = gerar(args.produtos, args.usuarios, args.movimentacoes, semente=args.semente)
+    print(f'Dados gerados em {time.perf_counter() - inicio:.1f} s '
+          f'({args.produtos} produtos, {args.movimentacoes} movimentações) em {DIRETORIO_TEMP}')
+
+    rng = random.Random(args.semente)
+    cliente = novo_cliente()
+    resultados = {}
+    print(f"{'cenário':32} {'mediana':>10} {'p95':>10} {'SQL/req':>8} {'linhas/req':>11}")
+    for nome, endpoint, requisicao in cenarios(dados, rng):
+        resultado = medir_cenario(cliente, endpoint, requisicao, args.repeticoes, args.aquecimento, args.cache)
+        resultados[nome] = resultado
+        print(f"{nome:32} {resultado['mediana_ms']:8.2f}ms {resultado['p95_ms']:8.2f}ms "
+              f"{resultado['instrucoes_sql']:8.1f} {resultado['linhas_sql']:11.1f}")
+
+    concorrencia = medir_concorrencia(dados, args.clientes, args.operacoes, args.semente)
+    print(f"concorrência: {concorrencia['clientes']} clientes, {concorrencia['operacoes_por_segundo']} op/s, "
+          f"mediana {concorrencia['mediana_ms']:.2f} ms, p95 {concorrencia['p95_ms']:.2f} ms, "
+          f"{'consistente' if concorrencia['consistente'] else 'INCONSISTENTE'}")
+
+    relatorio = {
+        'meta': {
+            'commit': commit_atual(),
+            'executado_em': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlalchemy': sqlalchemy.__version__,
+            'plataforma': platform.platform(),
+            'cpus': os.cpu_count(),
+            'banco': 'sqlite',
+            'parametros': vars(args),
+        },
+        'cenarios': resultados,
+        'concorrencia': concorrencia,
+    }
+    with open(args.saida, 'w', encoding='utf-8') as arquivo:
+        json.dump(relatorio, arquivo, ensure_ascii=False, indent=2)
+    print(f'Resultados gravados em {args.saida}')
+    return 0 if concorrencia['consistente'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
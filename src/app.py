@@ -1,19 +1,210 @@
-from datetime import datetime
-from flask import Flask, render_template_string, request, redirect, url_for, flash, session, get_flashed_messages
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, create_engine, Float
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+import csv
+import gzip
+import hashlib
+import hmac
+import io
+import json
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from itertools import groupby
+from datetime import datetime, date, timedelta
+import click
+from flask import Blueprint, Flask, Response, g, jsonify, make_response, render_template, request, redirect, url_for, flash, session
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Index, create_engine, event, Float, Date, text, select, insert, func, case, update, delete, and_, or_, bindparam, literal
+from sqlalchemy import inspect, table, column
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
+from sqlalchemy.orm import Session, declarative_base, sessionmaker, relationship
 from passlib.context import CryptContext
+from cache import CacheTTL
+from senhas import PoolHash, PoolSaturado
+from alertas import criar_transporte, montar_resumo
+from metricas import RegistroMetricas, instrumentar_engine, iniciar_coleta, encerrar_coleta
+from eventos import CentralEventos, LimiteAssinantes
+
+# Rotas, ganchos e comandos da CLI; a aplicação é montada por `create_app`.
+principal = Blueprint('principal', __name__, cli_group=None)
+
+URL_BANCO_DADOS = os.environ.get('LOGIFLOW_DATABASE_URL', 'sqlite:///estoque.db')
+CHAVE_SECRETA = os.environ.get('LOGIFLOW_SECRET_KEY', 'chave_secreta_estoque_sistema_2024')
+
+# Perfil SQLite: WAL permite leitores simultâneos a um escritor e
+# synchronous=NORMAL é seguro em WAL, sincronizando só nos checkpoints.
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('LOGIFLOW_SQLITE_BUSY_TIMEOUT_MS', 5000))
+SQLITE_MMAP_BYTES = int(os.environ.get('LOGIFLOW_SQLITE_MMAP_BYTES', 256 * 1024 * 1024))
+SQLITE_CACHE_KB = int(os.environ.get('LOGIFLOW_SQLITE_CACHE_KB', 64 * 1024))
+
+# Perfil de servidor (PostgreSQL e afins): pool por processo.
+DB_POOL_SIZE = int(os.environ.get('LOGIFLOW_DB_POOL_SIZE', 10))
+DB_MAX_OVERFLOW = int(os.environ.get('LOGIFLOW_DB_MAX_OVERFLOW', 20))
+DB_POOL_RECYCLE = int(os.environ.get('LOGIFLOW_DB_POOL_RECYCLE', 1800))
+
+# Cache de leituras por processo. Escritas feitas neste processo invalidam as
+# entradas afetadas; as feitas em outros processos aparecem após o TTL.
+CACHE_CAPACIDADE = int(os.environ.get('LOGIFLOW_CACHE_CAPACIDADE', 2048))
+CACHE_TTL_SEGUNDOS = float(os.environ.get('LOGIFLOW_CACHE_TTL_SEGUNDOS', 10))
+
+# Custo do bcrypt (2^rounds iterações). Hashes com custo menor são refeitos
+# no próximo login bem-sucedido.
+BCRYPT_ROUNDS = int(os.environ.get('LOGIFLOW_BCRYPT_ROUNDS', 12))
+HASH_TRABALHADORES = int(os.environ.get('LOGIFLOW_HASH_TRABALHADORES', os.cpu_count() or 2))
+HASH_FILA_MAXIMA = int(os.environ.get('LOGIFLOW_HASH_FILA_MAXIMA', 32))
+HASH_RETRY_AFTER = int(os.environ.get('LOGIFLOW_HASH_RETRY_AFTER', 2))
+
+# Alertas de estoque baixo, entregues pelo worker `flask alertas processar`.
+ALERTA_TRANSPORTE = os.environ.get('LOGIFLOW_ALERTA_TRANSPORTE', 'arquivo:alertas.log')
+ALERTA_DESTINATARIOS = [
+    email.strip() for email in os.environ.get('LOGIFLOW_ALERTA_DESTINATARIOS', '').split(',') if email.strip()
+]
+ALERTA_REMETENTE = os.environ.get('LOGIFLOW_ALERTA_REMETENTE', 'logiflow@localhost')
+ALERTA_JANELA_MINUTOS = int(os.environ.get('LOGIFLOW_ALERTA_JANELA_MINUTOS', 60))
+
+# Arquivamento de movimentações antigas (`flask arquivo executar`).
+ARQUIVO_HORIZONTE_DIAS = int(os.environ.get('LOGIFLOW_ARQUIVO_HORIZONTE_DIAS', 365))
+ARQUIVO_DIRETORIO = os.environ.get('LOGIFLOW_ARQUIVO_DIRETORIO', 'arquivo')
+
+# Análise de demanda (ver src/analise_demanda.py). A janela deve caber no
+# horizonte de arquivamento: saídas arquivadas não entram no cálculo.
+DEMANDA_JANELA_DIAS = int(os.environ.get('LOGIFLOW_DEMANDA_JANELA_DIAS', 180))
+DEMANDA_PRAZO_REPOSICAO_DIAS = int(os.environ.get('LOGIFLOW_DEMANDA_PRAZO_REPOSICAO_DIAS', 7))
+DEMANDA_FATOR_SEGURANCA = float(os.environ.get('LOGIFLOW_DEMANDA_FATOR_SEGURANCA', 1.65))
+DEMANDA_CACHE_SEGUNDOS = float(os.environ.get('LOGIFLOW_DEMANDA_CACHE_SEGUNDOS', 300))
+
+# Métricas em /metrics (formato Prometheus). Sem token, só administradores
+# logados acessam. Requisições acima do limite (0 desativa) vão para o log
+# `logiflow.lentas` com as instruções SQL que executaram.
+METRICAS_TOKEN = os.environ.get('LOGIFLOW_METRICAS_TOKEN', '')
+METRICAS_LENTA_MS = float(os.environ.get('LOGIFLOW_METRICAS_LENTA_MS', 500))
+METRICAS_INSTRUCOES_LENTA = int(os.environ.get('LOGIFLOW_METRICAS_INSTRUCOES_LENTA', 50))
+
+# Dashboard ao vivo (Server-Sent Events). Cada conexão aberta ocupa uma
+# thread do worker; ela é encerrada após a duração máxima e o navegador
+# reconecta sozinho. Escritas de outros processos chegam pelo vigia.
+EVENTOS_MAX_ASSINANTES = int(os.environ.get('LOGIFLOW_EVENTOS_MAX_ASSINANTES', 200))
+EVENTOS_INTERVALO_SEGUNDOS = float(os.environ.get('LOGIFLOW_EVENTOS_INTERVALO_SEGUNDOS', 2))
+EVENTOS_DURACAO_SEGUNDOS = float(os.environ.get('LOGIFLOW_EVENTOS_DURACAO_SEGUNDOS', 300))
+# Comentário enviado em conexões ociosas, para proxies não as derrubarem.
+EVENTOS_PING_SEGUNDOS = 15
+
+
+def _configurar_conexao_sqlite(conexao_dbapi, _registro):
+    cursor = conexao_dbapi.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}')
+    cursor.execute(f'PRAGMA mmap_size={SQLITE_MMAP_BYTES}')
+    # Valor negativo indica o tamanho em KiB, e não em páginas.
+    cursor.execute(f'PRAGMA cache_size=-{SQLITE_CACHE_KB}')
+    cursor.close()
+
+
+def criar_engine(url):
+    """
+    Cria a engine conforme o banco da URL: SQLite recebe os PRAGMAs de
+    desempenho em cada conexão; os demais bancos usam um pool dimensionado
+    com pre-ping para descartar conexões derrubadas pelo servidor. Em ambos
+    os casos a engine alimenta as métricas de SQL por requisição.
+    """
+    if url.startswith('sqlite'):
+        engine_criada = create_engine(
+            url,
+            connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+        )
+        event.listen(engine_criada, 'connect', _configurar_conexao_sqlite)
+    else:
+        engine_criada = create_engine(
+            url,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_pre_ping=True,
+            pool_recycle=DB_POOL_RECYCLE,
+        )
+    instrumentar_engine(engine_criada)
+    return engine_criada
+
+
+# A engine do processo é criada no primeiro acesso ao banco (ver
+# `obter_engine`), e não na importação do módulo.
+_engine = None
+_url_engine = URL_BANCO_DADOS
+_migrar_engine = True
+_trava_engine = threading.Lock()
+
+
+def configurar_banco(url, migrar=True):
+    """
+    Define o banco do processo. A engine só é criada (e, com `migrar`, o
+    schema só é migrado) quando o banco for usado pela primeira vez; uma
+    engine já criada para outra URL é descartada.
+    """
+    global _engine, _url_engine, _migrar_engine
+    with _trava_engine:
+        if _engine is not None and url != _url_engine:
+            _engine.dispose()
+            _engine = None
+        _url_engine, _migrar_engine = url, migrar
+
+
+def obter_engine():
+    global _engine
+    if _engine is None:
+        with _trava_engine:
+            if _engine is None:
+                nova = criar_engine(_url_engine)
+                if _migrar_engine:
+                    migrar_banco(nova)
+                _engine = nova
+    return _engine
+
+
+def _descartar_conexoes_herdadas():
+    """
+    Roda no processo filho logo após um fork: as conexões do pool pertencem
+    ao processo pai e não podem ser usadas aqui. `close=False` as abandona
+    sem fechá-las, para não derrubar as do pai; o filho abre as próprias.
+    """
+    if _engine is not None:
+        _engine.dispose(close=False)
 
-app = Flask(__name__)
-app.secret_key = 'chave_secreta_estoque_sistema_2024'
 
-URL_BANCO_DADOS = "sqlite:///estoque.db"
-engine = create_engine(URL_BANCO_DADOS, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_descartar_conexoes_herdadas)
+
+
+class SessaoBanco(Session):
+    """Sessão ligada à engine do processo, resolvida só quando o banco é usado."""
+
+    def get_bind(self, mapper=None, **kwargs):
+        if self.bind is None:
+            return obter_engine()
+        return super().get_bind(mapper, **kwargs)
+
+
+SessionLocal = sessionmaker(class_=SessaoBanco, autocommit=False, autoflush=False)
 Base = declarative_base()
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+_contexto_senhas = None
+
+
+def obter_contexto_senhas():
+    """CryptContext do bcrypt, montado no primeiro hash ou verificação."""
+    global _contexto_senhas
+    if _contexto_senhas is None:
+        _contexto_senhas = CryptContext(
+            schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS, bcrypt__min_rounds=BCRYPT_ROUNDS,
+        )
+    return _contexto_senhas
+
+
+pool_hash = PoolHash(HASH_TRABALHADORES, HASH_FILA_MAXIMA, HASH_RETRY_AFTER)
+cache_consultas = CacheTTL(CACHE_CAPACIDADE, CACHE_TTL_SEGUNDOS)
+# Resultados caros e tolerantes a atraso, com validade própria.
+cache_analises = CacheTTL(capacidade=8, ttl=DEMANDA_CACHE_SEGUNDOS)
+registro_metricas = RegistroMetricas()
+log_lentas = logging.getLogger('logiflow.lentas')
 
 
 class Produto(Base):
@@ -26,6 +217,50 @@ class Produto(Base):
     criado_em = Column(DateTime, default=datetime.now)
     atualizado_em = Column(DateTime, default=datetime.now, onupdate=datetime.now)
 
+    __table_args__ = (
+        # Índice parcial: só contém os produtos com estoque baixo, usado pelo
+        # relatório e pelo filtro "somente estoque baixo" do dashboard.
+        Index(
+            'ix_produtos_estoque_baixo', 'id',
+            sqlite_where=text('quantidade <= quantidade_minima'),
+            postgresql_where=text('quantidade <= quantidade_minima'),
+        ),
+        Index('ix_produtos_atualizado_em', 'atualizado_em'),
+    )
+
+
+# Armazém criado junto com a tabela; recebe o estoque anterior à divisão por
+# armazéns, o estoque inicial dos produtos cadastrados e as movimentações que
+# não informam armazém.
+ARMAZEM_PRINCIPAL_ID = 1
+
+
+class Armazem(Base):
+    """Centro de distribuição. Estoque e movimentações são registrados por armazém."""
+    __tablename__ = 'armazens'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    codigo = Column(String(20), nullable=False, unique=True)
+    nome = Column(String(100), nullable=False)
+    ativo = Column(Boolean, nullable=False, default=True)
+    criado_em = Column(DateTime, default=datetime.now)
+
+
+class EstoqueArmazem(Base):
+    """
+    Saldo de um produto em um armazém; `Produto.quantidade` é a soma dos
+    saldos (o total consolidado), mantida na mesma transação. A chave começa
+    pelo armazém, então as consultas de um armazém percorrem só a faixa dele.
+    """
+    __tablename__ = 'estoque_armazens'
+    armazem_id = Column(Integer, ForeignKey('armazens.id'), primary_key=True)
+    produto_id = Column(Integer, ForeignKey('produtos.id'), primary_key=True)
+    quantidade = Column(Integer, nullable=False, default=0)
+    atualizado_em = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+    __table_args__ = (
+        Index('ix_estoque_armazens_produto', 'produto_id'),
+    )
+
 
 class Usuario(Base):
     __tablename__ = 'usuarios'
@@ -36,6 +271,13 @@ class Usuario(Base):
     eh_administrador = Column(Boolean, default=False)
     ativo = Column(Boolean, default=True)
     criado_em = Column(DateTime, default=datetime.now)
+    # Incrementada sempre que eh_administrador ou ativo mudam; sessões e o
+    # cache de permissões comparam com ela para detectar revogações.
+    versao_permissao = Column(Integer, nullable=False, default=0, server_default=text('0'))
+
+    __table_args__ = (
+        Index('ix_usuarios_ativo', 'ativo'),
+    )
 
 
 class Movimentacao(Base):
@@ -43,6 +285,10 @@ class Movimentacao(Base):
     id = Column(Integer, primary_key=True, autoincrement=True)
     produto_id = Column(Integer, ForeignKey('produtos.id'), nullable=False)
     usuario_id = Column(Integer, ForeignKey('usuarios.id'), nullable=False)
+    armazem_id = Column(
+        Integer, ForeignKey('armazens.id'), nullable=False,
+        default=ARMAZEM_PRINCIPAL_ID, server_default=text(str(ARMAZEM_PRINCIPAL_ID)),
+    )
     tipo_movimentacao = Column(String(20), nullable=False)
     quantidade = Column(Integer, nullable=False)
     observacoes = Column(String(255))
@@ -51,16 +297,311 @@ class Movimentacao(Base):
     produto = relationship("Produto")
     usuario = relationship("Usuario")
 
+    __table_args__ = (
+        Index('ix_movimentacoes_data_id', 'data_movimentacao', 'id'),
+        Index('ix_movimentacoes_produto_data', 'produto_id', 'data_movimentacao'),
+        Index('ix_movimentacoes_usuario', 'usuario_id'),
+        Index('ix_movimentacoes_armazem_data', 'armazem_id', 'data_movimentacao', 'id'),
+    )
+
+
+class ResumoEstoque(Base):
+    """
+    Totais do estoque mantidos incrementalmente (linha única, id = 1).
+    Atualizado na mesma transação de cada cadastro, edição e movimentação.
+    """
+    __tablename__ = 'resumo_estoque'
+    id = Column(Integer, primary_key=True)
+    total_produtos = Column(Integer, nullable=False, default=0)
+    valor_estoque = Column(Float, nullable=False, default=0.0)
+    estoque_baixo = Column(Integer, nullable=False, default=0)
+    # Contador global de alterações; compõe os ETags da API.
+    versao = Column(Integer, nullable=False, default=0, server_default=text('0'))
+    atualizado_em = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
 
-Base.metadata.create_all(bind=engine)
+class MovimentacaoDiaria(Base):
+    """Contadores de movimentações por dia, mantidos junto com cada movimentação."""
+    __tablename__ = 'movimentacoes_diarias'
+    dia = Column(Date, primary_key=True)
+    entradas = Column(Integer, nullable=False, default=0)
+    saidas = Column(Integer, nullable=False, default=0)
 
 
+class MovimentacaoMensal(Base):
+    """
+    Totais mensais por produto das movimentações já arquivadas, para que o
+    histórico continue consultável depois que as linhas saem da tabela.
+    """
+    __tablename__ = 'movimentacoes_mensais'
+    produto_id = Column(Integer, ForeignKey('produtos.id'), primary_key=True)
+    mes = Column(Date, primary_key=True)
+    entradas = Column(Integer, nullable=False, default=0)
+    saidas = Column(Integer, nullable=False, default=0)
+    quantidade_entrada = Column(Integer, nullable=False, default=0)
+    quantidade_saida = Column(Integer, nullable=False, default=0)
+
+
+class ArquivoMovimentacoes(Base):
+    """Arquivos JSONL compactados gerados pelo arquivamento, um por lote e mês."""
+    __tablename__ = 'arquivos_movimentacoes'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    caminho = Column(String(255), nullable=False, unique=True)
+    mes = Column(Date, nullable=False)
+    primeiro_id = Column(Integer, nullable=False)
+    ultimo_id = Column(Integer, nullable=False)
+    linhas = Column(Integer, nullable=False)
+    # Tudo antes deste instante pode estar arquivado.
+    corte = Column(DateTime, nullable=False)
+    criado_em = Column(DateTime, default=datetime.now)
+
+
+class SnapshotEstoque(Base):
+    """
+    Fotografia periódica do estoque (ver `flask snapshot registrar`).
+    `ultima_movimentacao_id` é a última movimentação refletida nas
+    quantidades, o que torna exato o ponto de partida das consultas
+    históricas mesmo com movimentações simultâneas à fotografia.
+    """
+    __tablename__ = 'snapshots_estoque'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    momento = Column(DateTime, nullable=False, index=True)
+    ultima_movimentacao_id = Column(Integer, nullable=False, default=0)
+
+
+class SnapshotProduto(Base):
+    __tablename__ = 'snapshots_produtos'
+    snapshot_id = Column(Integer, ForeignKey('snapshots_estoque.id'), primary_key=True)
+    produto_id = Column(Integer, ForeignKey('produtos.id'), primary_key=True)
+    quantidade = Column(Integer, nullable=False)
+    preco = Column(Float, nullable=False)
+
+
+class EventoAlerta(Base):
+    """
+    Fila durável de alertas de estoque baixo. O evento é gravado na mesma
+    transação da movimentação que levou o produto ao mínimo e entregue
+    depois pelo worker, fora do caminho da requisição.
+    """
+    __tablename__ = 'eventos_alerta'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    produto_id = Column(Integer, ForeignKey('produtos.id'), nullable=False)
+    quantidade = Column(Integer, nullable=False)
+    quantidade_minima = Column(Integer, nullable=False)
+    criado_em = Column(DateTime, default=datetime.now)
+    # pendente -> enviado | duplicado
+    situacao = Column(String(20), nullable=False, default='pendente')
+    processado_em = Column(DateTime)
+
+    __table_args__ = (
+        Index(
+            'ix_eventos_alerta_pendentes', 'id',
+            sqlite_where=text("situacao = 'pendente'"),
+            postgresql_where=text("situacao = 'pendente'"),
+        ),
+        Index('ix_eventos_alerta_produto_processado', 'produto_id', 'processado_em'),
+    )
+
+
+class VersaoSchema(Base):
+    """Migrações já aplicadas ao banco (ver `migrar_banco`)."""
+    __tablename__ = 'versao_schema'
+    versao = Column(Integer, primary_key=True)
+    descricao = Column(String(200), nullable=False)
+    aplicada_em = Column(DateTime, default=datetime.now)
+
+
+MIGRACOES = []
+
+
+def migracao(versao, descricao):
+    """Registra uma função de migração; as migrações rodam em ordem de versão."""
+    def registrar(funcao):
+        MIGRACOES.append((versao, descricao, funcao))
+        MIGRACOES.sort(key=lambda item: item[0])
+        return funcao
+    return registrar
+
+
+def _criar_indices(conexao, *nomes):
+    indices = {indice.name: indice for tabela in Base.metadata.sorted_tables for indice in tabela.indexes}
+    for nome in nomes:
+        indices[nome].create(conexao, checkfirst=True)
+
+
+@migracao(1, 'Índices para as consultas de dashboard, relatório e movimentações')
+def _migracao_indices_consultas(conexao):
+    _criar_indices(
+        conexao,
+        'ix_produtos_estoque_baixo',
+        'ix_usuarios_ativo',
+        'ix_movimentacoes_data_id',
+        'ix_movimentacoes_produto_data',
+        'ix_movimentacoes_usuario',
+    )
+
+
+# Busca textual em produtos.nome. No SQLite, tabela FTS5 de conteúdo externo
+# mantida por triggers (sem acentos, com índices de prefixo de 2 e 3 letras);
+# no PostgreSQL, índice de trigramas sobre o nome normalizado.
+DDL_BUSCA_SQLITE = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS produtos_busca USING fts5("
+    "nome, content='produtos', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "CREATE TRIGGER IF NOT EXISTS produtos_busca_ai AFTER INSERT ON produtos BEGIN "
+    "INSERT INTO produtos_busca(rowid, nome) VALUES (new.id, new.nome); END",
+    "CREATE TRIGGER IF NOT EXISTS produtos_busca_ad AFTER DELETE ON produtos BEGIN "
+    "INSERT INTO produtos_busca(produtos_busca, rowid, nome) VALUES ('delete', old.id, old.nome); END",
+    "CREATE TRIGGER IF NOT EXISTS produtos_busca_au AFTER UPDATE OF nome ON produtos BEGIN "
+    "INSERT INTO produtos_busca(produtos_busca, rowid, nome) VALUES ('delete', old.id, old.nome); "
+    "INSERT INTO produtos_busca(rowid, nome) VALUES (new.id, new.nome); END",
+)
+DDL_BUSCA_POSTGRESQL = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE EXTENSION IF NOT EXISTS unaccent",
+    # unaccent() não é IMMUTABLE; o invólucro permite usá-la em um índice.
+    "CREATE OR REPLACE FUNCTION logiflow_normalizar(texto text) RETURNS text AS "
+    "$$ SELECT lower(public.unaccent('public.unaccent'::regdictionary, texto)) $$ "
+    "LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT",
+    "CREATE INDEX IF NOT EXISTS ix_produtos_nome_trgm ON produtos "
+    "USING gin (logiflow_normalizar(nome) gin_trgm_ops)",
+)
+
+
+def criar_busca_produtos(conexao):
+    """Cria (se preciso) a estrutura de busca do dialeto e indexa os produtos existentes."""
+    if conexao.dialect.name == 'sqlite':
+        for comando in DDL_BUSCA_SQLITE:
+            conexao.exec_driver_sql(comando)
+        conexao.exec_driver_sql("INSERT INTO produtos_busca(produtos_busca) VALUES ('rebuild')")
+    elif conexao.dialect.name == 'postgresql':
+        for comando in DDL_BUSCA_POSTGRESQL:
+            conexao.exec_driver_sql(comando)
+
+
+def remover_busca_produtos(conexao):
+    if conexao.dialect.name == 'sqlite':
+        for gatilho in ('produtos_busca_ai', 'produtos_busca_ad', 'produtos_busca_au'):
+            conexao.exec_driver_sql(f'DROP TRIGGER IF EXISTS {gatilho}')
+        conexao.exec_driver_sql('DROP TABLE IF EXISTS produtos_busca')
+
+
+# Bancos novos ganham a busca junto com a tabela; os existentes, pela migração 4.
+event.listen(Produto.__table__, 'after_create', lambda alvo, conexao, **_: criar_busca_produtos(conexao))
+event.listen(Produto.__table__, 'before_drop', lambda alvo, conexao, **_: remover_busca_produtos(conexao))
+
+
+def criar_armazem_principal(conexao):
+    conexao.execute(Armazem.__table__.insert().values(
+        id=ARMAZEM_PRINCIPAL_ID, codigo='PRINCIPAL', nome='Principal', ativo=True, criado_em=datetime.now(),
+    ))
+
+
+def _estoque_inicial_no_principal(_mapper, conexao, produto):
+    """Produtos criados pelo ORM começam com o estoque no armazém principal."""
+    conexao.execute(EstoqueArmazem.__table__.insert().values(
+        armazem_id=ARMAZEM_PRINCIPAL_ID, produto_id=produto.id,
+        quantidade=produto.quantidade, atualizado_em=datetime.now(),
+    ))
+
+
+event.listen(Armazem.__table__, 'after_create', lambda alvo, conexao, **_: criar_armazem_principal(conexao))
+event.listen(Produto, 'after_insert', _estoque_inicial_no_principal)
+
+
+def _adicionar_coluna(conexao, tabela, nome):
+    """ALTER TABLE ... ADD COLUMN a partir da definição do modelo, se a coluna ainda não existir."""
+    if nome in {coluna['name'] for coluna in inspect(conexao).get_columns(tabela)}:
+        return
+    coluna = Base.metadata.tables[tabela].c[nome]
+    ddl = f'ALTER TABLE {tabela} ADD COLUMN {nome} {coluna.type.compile(dialect=conexao.dialect)}'
+    if coluna.server_default is not None:
+        ddl += f' DEFAULT {coluna.server_default.arg.text}'
+    if not coluna.nullable:
+        ddl += ' NOT NULL'
+    conexao.execute(text(ddl))
+
+
+@migracao(2, 'Contador de versão no resumo do estoque')
+def _migracao_versao_resumo(conexao):
+    _adicionar_coluna(conexao, 'resumo_estoque', 'versao')
+
+
+@migracao(3, 'Versão de permissão dos usuários')
+def _migracao_versao_permissao(conexao):
+    _adicionar_coluna(conexao, 'usuarios', 'versao_permissao')
+
+
+@migracao(4, 'Busca textual de produtos (FTS5 no SQLite, trigramas no PostgreSQL)')
+def _migracao_busca_produtos(conexao):
+    criar_busca_produtos(conexao)
+
+
+@migracao(5, 'Índice de produtos por data de atualização (eventos do dashboard)')
+def _migracao_produtos_atualizados(conexao):
+    _criar_indices(conexao, 'ix_produtos_atualizado_em')
+
+
+@migracao(6, 'Armazéns: saldo por armazém e movimentações por armazém')
+def _migracao_armazens(conexao):
+    # As tabelas novas (e o armazém principal) já vêm do create_all; o
+    # estoque e o histórico existentes passam a ser do armazém principal.
+    _adicionar_coluna(conexao, 'movimentacoes', 'armazem_id')
+    _criar_indices(conexao, 'ix_movimentacoes_armazem_data')
+    tabela = EstoqueArmazem.__table__
+    if conexao.execute(select(func.count()).select_from(tabela)).scalar() == 0:
+        conexao.execute(tabela.insert().from_select(
+            ['armazem_id', 'produto_id', 'quantidade', 'atualizado_em'],
+            select(literal(ARMAZEM_PRINCIPAL_ID), Produto.id, Produto.quantidade, Produto.atualizado_em),
+        ))
+
+
+def migrar_banco(engine_alvo):
+    """
+    Aplica as migrações pendentes, cada uma em sua própria transação.
+    O `create_all` cria apenas tabelas inexistentes; índices e colunas novas
+    em tabelas já existentes chegam aos bancos antigos por aqui.
+    Retorna as versões aplicadas.
+    """
+    Base.metadata.create_all(bind=engine_alvo)
+    with engine_alvo.connect() as conexao:
+        aplicadas = set(conexao.execute(select(VersaoSchema.versao)).scalars())
+
+    novas = []
+    for versao, descricao, funcao in MIGRACOES:
+        if versao in aplicadas:
+            continue
+        with engine_alvo.begin() as conexao:
+            funcao(conexao)
+            conexao.execute(VersaoSchema.__table__.insert().values(versao=versao, descricao=descricao))
+        novas.append(versao)
+    return novas
+
+
+# As funções de senha rodam no pool_hash e levantam PoolSaturado quando ele está cheio.
 def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+    return pool_hash.executar(obter_contexto_senhas().hash, password)
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return pool_hash.executar(obter_contexto_senhas().verify, plain_password, hashed_password)
+
+
+def verify_and_update_password(plain_password: str, hashed_password: str):
+    """
+    Verifica a senha e, se o hash usa parâmetros desatualizados (ver
+    `CryptContext.needs_update`), devolve também o hash novo.
+    Retorna (valida, novo_hash_ou_None).
+    """
+    return pool_hash.executar(obter_contexto_senhas().verify_and_update, plain_password, hashed_password)
+
+
+def resposta_pool_saturado(erro, template, **contexto):
+    """Página do formulário com status 503 e Retry-After, para o cliente tentar de novo."""
+    flash('Muitas solicitações simultâneas. Aguarde alguns segundos e tente novamente.', 'error')
+    resposta = make_response((render_template(template, **contexto), 503))
+    resposta.headers['Retry-After'] = str(erro.retry_after)
+    return resposta
 
 
 def create_admin_user():
@@ -76,35 +617,2004 @@ def create_admin_user():
             )
             db.add(admin)
             db.commit()
-            print("Usuário admin criado: admin@sistema.com / admin123")
+            print("Usuário admin criado: admin@sistema.com / admin123")
+    finally:
+        db.close()
+
+
+
+
+
+
+def enviar_notificacao_estoque_baixo(produto):
+    """
+    Simula o envio de e-mail para o administrador quando o estoque está baixo.
+    Os alertas reais passam pela fila `eventos_alerta` (ver `processar_alertas`).
+    """
+    if produto.quantidade <= produto.quantidade_minima:
+        print(f"ALERTA [EMAIL]: O produto '{produto.nome}' está com estoque CRÍTICO!")
+        print(f"Estoque Atual: {produto.quantidade} | Mínimo: {produto.quantidade_minima}")
+        # Simulação de envio SMTP
+        # server = smtplib.SMTP('smtp.gmail.com', 587)
+        # server.sendmail(...)
+        return True
+    return False
+
+
+TAMANHO_PAGINA_PADRAO = 50
+TAMANHO_PAGINA_MAXIMO = 500
+# Maior valor das colunas Integer em todos os bancos suportados (32 bits no
+# PostgreSQL); ids e quantidades acima dele nem chegam a ser consultados.
+MAIOR_INTEIRO_BANCO = 2 ** 31 - 1
+
+COLUNAS_PRODUTO = (
+    Produto.id, Produto.nome, Produto.preco, Produto.quantidade, Produto.quantidade_minima, Produto.atualizado_em,
+)
+
+
+def ler_tamanho_pagina(args):
+    """Lê o parâmetro `limite` da query string, restrito a [1, TAMANHO_PAGINA_MAXIMO]."""
+    limite = args.get('limite', TAMANHO_PAGINA_PADRAO, type=int)
+    return max(1, min(limite, TAMANHO_PAGINA_MAXIMO))
+
+
+def ler_cursor_id(args, nome='apos'):
+    """
+    Lê um cursor de id da query string. Valores que não são inteiros ou que
+    não cabem no banco são tratados como ausentes (primeira página).
+    """
+    valor = args.get(nome, type=int)
+    return valor if valor is not None and abs(valor) <= MAIOR_INTEIRO_BANCO else None
+
+
+def ler_filtros_produtos(args):
+    """
+    Extrai os filtros de produtos da query string.
+    Valores inválidos são ignorados em vez de gerar erro.
+    """
+    preco_min = args.get('preco_min', type=float)
+    preco_max = args.get('preco_max', type=float)
+    return {
+        'armazem': args.get('armazem', type=int),
+        'busca': normalizar_busca(args.get('busca', '')),
+        'nome': args.get('nome', '').strip() or None,
+        'baixo': args.get('baixo') in ('1', 'on', 'true'),
+        'preco_min': preco_min if preco_min is not None and preco_min >= 0 else None,
+        'preco_max': preco_max if preco_max is not None and preco_max >= 0 else None,
+    }
+
+
+def normalizar_busca(texto):
+    """Reduz o texto buscado às suas palavras, separadas por espaço (ou None)."""
+    return ' '.join(re.findall(r'\w+', texto or '')) or None
+
+
+def _sem_acentos(texto):
+    return ''.join(c for c in unicodedata.normalize('NFKD', texto) if not unicodedata.combining(c)).lower()
+
+
+PRODUTOS_BUSCA = table('produtos_busca', column('rowid'), column('nome'))
+
+
+def _aplicar_busca(db, consulta, termo):
+    """
+    Restringe `consulta` aos produtos cujo nome contém todas as palavras de
+    `termo` (como prefixo no SQLite, como trecho nos demais), sem diferenciar
+    acentos nem maiúsculas. Retorna a consulta e a coluna de ordenação/cursor.
+
+    No SQLite a consulta parte do índice FTS5 e pagina pelo seu rowid, que
+    o FTS5 percorre em ordem: o custo depende do tamanho da página, não de
+    quantos produtos casam com o termo.
+    """
+    palavras = termo.split()
+    dialeto = db.get_bind().dialect.name
+    if dialeto == 'sqlite':
+        expressao = ' '.join(f'"{palavra}"*' for palavra in palavras)
+        consulta = (
+            consulta
+            .select_from(PRODUTOS_BUSCA.join(Produto, Produto.id == PRODUTOS_BUSCA.c.rowid))
+            .where(PRODUTOS_BUSCA.c.nome.op('MATCH')(expressao))
+        )
+        return consulta, PRODUTOS_BUSCA.c.rowid
+    for palavra in palavras:
+        padrao = '%' + _escapar_like(_sem_acentos(palavra)) + '%'
+        if dialeto == 'postgresql':
+            consulta = consulta.where(func.logiflow_normalizar(Produto.nome).like(padrao, escape='\\'))
+        else:
+            consulta = consulta.where(Produto.nome.ilike(padrao, escape='\\'))
+    return consulta, Produto.id
+
+
+def _escapar_like(texto):
+    return texto.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def paginar_produtos(db, filtros, apos=None, limite=TAMANHO_PAGINA_PADRAO):
+    """
+    Paginação por cursor (keyset) sobre Produto.id.
+    Retorna a página de produtos e o cursor da próxima página (ou None).
+    O custo da consulta depende apenas de `limite`, não do tamanho do catálogo.
+    As linhas são imutáveis e independentes da sessão, podendo ir para o cache.
+
+    Com o filtro `armazem`, lista só os produtos com saldo naquele armazém e
+    `quantidade` é o saldo dele; sem busca, a página é uma faixa da chave
+    (armazem_id, produto_id) de `estoque_armazens`.
+    """
+    armazem_id = filtros.get('armazem')
+    quantidade = EstoqueArmazem.quantidade if armazem_id else Produto.quantidade
+    consulta = select(
+        Produto.id, Produto.nome, Produto.preco, quantidade.label('quantidade'), Produto.quantidade_minima,
+        Produto.atualizado_em,
+    )
+    ordem = Produto.id
+    if filtros.get('busca'):
+        consulta, ordem = _aplicar_busca(db, consulta, filtros['busca'])
+    if armazem_id:
+        consulta = consulta.where(EstoqueArmazem.armazem_id == armazem_id, EstoqueArmazem.produto_id == Produto.id)
+        if ordem is Produto.id:
+            ordem = EstoqueArmazem.produto_id
+    if filtros.get('nome'):
+        consulta = consulta.where(Produto.nome.like(_escapar_like(filtros['nome']) + '%', escape='\\'))
+    if filtros.get('baixo'):
+        consulta = consulta.where(quantidade <= Produto.quantidade_minima)
+    if filtros.get('preco_min') is not None:
+        consulta = consulta.where(Produto.preco >= filtros['preco_min'])
+    if filtros.get('preco_max') is not None:
+        consulta = consulta.where(Produto.preco <= filtros['preco_max'])
+    if apos:
+        consulta = consulta.where(ordem > apos)
+
+    # Busca um item a mais apenas para saber se existe próxima página.
+    produtos = db.execute(consulta.order_by(ordem).limit(limite + 1)).all()
+    proximo_cursor = produtos[limite - 1].id if len(produtos) > limite else None
+    return produtos[:limite], proximo_cursor
+
+
+def paginar_produtos_em_cache(db, filtros, apos=None, limite=TAMANHO_PAGINA_PADRAO, versao=None):
+    """
+    `paginar_produtos` através do cache. A página cobre os ids em
+    (apos, proximo_cursor], faixa usada por `invalidar_cache_produtos`.
+    Com `versao` (de `obter_versao_dados`), a página fica presa a essa versão
+    dos dados, então o corpo nunca é mais antigo que o ETag calculado com ela.
+    """
+    chave = ('pagina_produtos', tuple(sorted(filtros.items())), apos or None, limite, versao)
+    return cache_consultas.obter(
+        chave,
+        lambda: paginar_produtos(db, filtros, apos=apos, limite=limite),
+        faixa=lambda pagina: (apos or None, pagina[1]),
+    )
+
+
+def buscar_produto(db, produto_id):
+    """Produto por id (linha imutável, ou None), através do cache."""
+    return cache_consultas.obter(
+        ('produto', produto_id),
+        lambda: db.execute(select(*COLUNAS_PRODUTO).where(Produto.id == produto_id)).first(),
+    )
+
+
+def invalidar_cache_produtos(*produto_ids):
+    """
+    Descarta as leituras em cache afetadas por escritas nos produtos:
+    o próprio produto, as páginas cuja faixa de ids o contém e os
+    agregados do relatório. Deve ser chamada depois do commit.
+    """
+    for produto_id in produto_ids:
+        cache_consultas.invalidar(('produto', produto_id))
+        cache_consultas.invalidar_faixa('pagina_produtos', produto_id)
+    cache_consultas.invalidar_grupo('indicadores')
+    cache_consultas.invalidar_grupo('estoque_baixo')
+
+
+# O vigia relê com essa folga para trás, porque `atualizado_em` vem do relógio
+# de quem escreveu e um commit pode chegar depois de outro com hora maior.
+FOLGA_VIGIA_EVENTOS = timedelta(seconds=5)
+LIMITE_ALTERACOES_VIGIA = 5000
+
+
+def delta_estoque(produto_id, quantidade, quantidade_minima):
+    """Evento compacto enviado ao dashboard ao vivo."""
+    return {
+        'id': produto_id,
+        'quantidade': quantidade,
+        'minimo': quantidade_minima,
+        'baixo': quantidade <= quantidade_minima,
+    }
+
+
+def consultar_alteracoes_estoque(marca):
+    """
+    Produtos alterados desde `marca` (por qualquer processo), para o vigia da
+    central de eventos. Retorna (deltas, nova marca); na primeira chamada só
+    estabelece a marca. Usa o índice de `atualizado_em`.
+    """
+    if marca is None:
+        return [], datetime.now()
+    db = SessionLocal()
+    try:
+        linhas = db.execute(
+            select(Produto.id, Produto.quantidade, Produto.quantidade_minima, Produto.atualizado_em)
+            .where(Produto.atualizado_em > marca - FOLGA_VIGIA_EVENTOS)
+            .order_by(Produto.atualizado_em)
+            .limit(LIMITE_ALTERACOES_VIGIA)
+        ).all()
+    finally:
+        db.close()
+    deltas = [delta_estoque(linha.id, linha.quantidade, linha.quantidade_minima) for linha in linhas]
+    return deltas, max([marca] + [linha.atualizado_em for linha in linhas])
+
+
+def publicar_estoque(produtos):
+    """
+    Publica no dashboard ao vivo as linhas (id, quantidade, quantidade_minima)
+    alteradas. Deve ser chamada depois do commit.
+    """
+    central_eventos.publicar([
+        delta_estoque(produto.id, produto.quantidade, produto.quantidade_minima) for produto in produtos
+    ])
+
+
+central_eventos = CentralEventos(EVENTOS_MAX_ASSINANTES, consultar_alteracoes_estoque, EVENTOS_INTERVALO_SEGUNDOS)
+
+
+LIMITE_ESTOQUE_BAIXO_RELATORIO = 100
+
+
+def inicio_do_dia(momento=None):
+    momento = momento or datetime.now()
+    return momento.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def calcular_indicadores(db):
+    """
+    Calcula os indicadores do relatório em uma única consulta agregada:
+    total de produtos, valor do estoque, produtos com estoque baixo e
+    movimentações do dia.
+    """
+    movimentacoes_hoje = (
+        select(func.count(Movimentacao.id))
+        .where(Movimentacao.data_movimentacao >= inicio_do_dia())
+        .scalar_subquery()
+    )
+    consulta = select(
+        func.count(Produto.id).label('total_produtos'),
+        func.coalesce(func.sum(Produto.preco * Produto.quantidade), 0.0).label('valor_estoque'),
+        func.count(case((Produto.quantidade <= Produto.quantidade_minima, 1))).label('estoque_baixo'),
+        movimentacoes_hoje.label('movimentacoes_hoje'),
+    )
+    return dict(db.execute(consulta).one()._mapping)
+
+
+def listar_estoque_baixo(db, limite=LIMITE_ESTOQUE_BAIXO_RELATORIO, armazem_id=None):
+    """
+    Lista os produtos com estoque baixo, dos mais críticos para os menos
+    críticos, trazendo só as colunas exibidas e no máximo `limite` linhas.
+    Com `armazem_id`, compara o saldo daquele armazém com o mínimo do produto.
+    """
+    quantidade = EstoqueArmazem.quantidade if armazem_id else Produto.quantidade
+    consulta = (
+        select(Produto.id, Produto.nome, quantidade.label('quantidade'), Produto.quantidade_minima)
+        .where(quantidade <= Produto.quantidade_minima)
+        .order_by((Produto.quantidade_minima - quantidade).desc(), Produto.id)
+        .limit(limite)
+    )
+    if armazem_id:
+        consulta = consulta.where(EstoqueArmazem.armazem_id == armazem_id, EstoqueArmazem.produto_id == Produto.id)
+    return [linha for linha in db.execute(consulta)]
+
+
+def listar_estoque_baixo_em_cache(db, limite=LIMITE_ESTOQUE_BAIXO_RELATORIO, armazem_id=None):
+    return cache_consultas.obter(
+        ('estoque_baixo', limite, armazem_id), lambda: listar_estoque_baixo(db, limite, armazem_id),
+    )
+
+
+def listar_armazens(db):
+    """Armazéns ativos (linhas imutáveis), por código, através do cache."""
+    return cache_consultas.obter(('armazens',), lambda: db.execute(
+        select(Armazem.id, Armazem.codigo, Armazem.nome).where(Armazem.ativo == True).order_by(Armazem.codigo)
+    ).all())
+
+
+def buscar_armazem(db, armazem_id):
+    """Armazém ativo por id, ou None."""
+    return next((armazem for armazem in listar_armazens(db) if armazem.id == armazem_id), None)
+
+
+def calcular_indicadores_armazem(db, armazem_id):
+    """
+    Indicadores do relatório restritos a um armazém, em uma única consulta
+    agregada sobre os saldos dele: percorre só a faixa do armazém em
+    `estoque_armazens` e, para as movimentações do dia, em
+    `ix_movimentacoes_armazem_data`.
+    """
+    movimentacoes_hoje = (
+        select(func.count(Movimentacao.id))
+        .where(Movimentacao.armazem_id == armazem_id, Movimentacao.data_movimentacao >= inicio_do_dia())
+        .scalar_subquery()
+    )
+    consulta = (
+        select(
+            func.count(EstoqueArmazem.produto_id).label('total_produtos'),
+            func.coalesce(func.sum(Produto.preco * EstoqueArmazem.quantidade), 0.0).label('valor_estoque'),
+            func.count(case((EstoqueArmazem.quantidade <= Produto.quantidade_minima, 1))).label('estoque_baixo'),
+            movimentacoes_hoje.label('movimentacoes_hoje'),
+        )
+        .select_from(EstoqueArmazem)
+        .join(Produto, Produto.id == EstoqueArmazem.produto_id)
+        .where(EstoqueArmazem.armazem_id == armazem_id)
+    )
+    return dict(db.execute(consulta).one()._mapping)
+
+
+def calcular_totais_armazens(db):
+    """
+    Visão consolidada: produtos, unidades, valor, estoque baixo e
+    movimentações do dia de cada armazém ativo, com duas consultas
+    agrupadas por armazém (saldos e movimentações do dia).
+    """
+    totais = {
+        linha.armazem_id: linha
+        for linha in db.execute(
+            select(
+                EstoqueArmazem.armazem_id,
+                func.count(EstoqueArmazem.produto_id).label('total_produtos'),
+                func.coalesce(func.sum(EstoqueArmazem.quantidade), 0).label('unidades'),
+                func.coalesce(func.sum(Produto.preco * EstoqueArmazem.quantidade), 0.0).label('valor_estoque'),
+                func.count(case((EstoqueArmazem.quantidade <= Produto.quantidade_minima, 1))).label('estoque_baixo'),
+            )
+            .join(Produto, Produto.id == EstoqueArmazem.produto_id)
+            .group_by(EstoqueArmazem.armazem_id)
+        )
+    }
+    movimentacoes_hoje = dict(db.execute(
+        select(Movimentacao.armazem_id, func.count(Movimentacao.id))
+        .where(Movimentacao.data_movimentacao >= inicio_do_dia())
+        .group_by(Movimentacao.armazem_id)
+    ).all())
+
+    armazens = []
+    for armazem in listar_armazens(db):
+        linha = totais.get(armazem.id)
+        armazens.append({
+            'id': armazem.id,
+            'codigo': armazem.codigo,
+            'nome': armazem.nome,
+            'total_produtos': linha.total_produtos if linha else 0,
+            'unidades': linha.unidades if linha else 0,
+            'valor_estoque': linha.valor_estoque if linha else 0.0,
+            'estoque_baixo': linha.estoque_baixo if linha else 0,
+            'movimentacoes_hoje': movimentacoes_hoje.get(armazem.id, 0),
+        })
+    return armazens
+
+
+def saldos_por_armazem(db, produto_id):
+    """Saldo do produto em cada armazém ativo (0 onde ainda não houve movimento)."""
+    saldos = dict(db.execute(
+        select(EstoqueArmazem.armazem_id, EstoqueArmazem.quantidade).where(EstoqueArmazem.produto_id == produto_id)
+    ).all())
+    return [(armazem, saldos.get(armazem.id, 0)) for armazem in listar_armazens(db)]
+
+
+def codificar_cursor_movimentacao(data_movimentacao, movimentacao_id):
+    return f'{data_movimentacao.isoformat()}_{movimentacao_id}'
+
+
+def decodificar_cursor_movimentacao(cursor):
+    """
+    Converte o cursor da query string em (data, id); cursores inválidos, ou
+    com id fora da faixa do banco, viram None.
+    """
+    if not cursor:
+        return None
+    try:
+        data_texto, id_texto = cursor.rsplit('_', 1)
+        data_cursor, id_cursor = datetime.fromisoformat(data_texto), int(id_texto)
+    except ValueError:
+        return None
+    return (data_cursor, id_cursor) if abs(id_cursor) <= MAIOR_INTEIRO_BANCO else None
+
+
+def paginar_movimentacoes(db, antes=None, limite=TAMANHO_PAGINA_PADRAO, armazem_id=None):
+    """
+    Paginação por cursor sobre (data_movimentacao, id), da mais recente para
+    a mais antiga. Produto e usuário vêm no mesmo JOIN e cada linha traz só
+    as colunas exibidas, sem carregar objetos ORM nem relacionamentos.
+    Com `armazem_id`, percorre só as movimentações daquele armazém
+    (`ix_movimentacoes_armazem_data`).
+    """
+    consulta = (
+        select(
+            Movimentacao.id,
+            Movimentacao.data_movimentacao,
+            Movimentacao.armazem_id,
+            Movimentacao.tipo_movimentacao,
+            Movimentacao.quantidade,
+            Movimentacao.observacoes,
+            Produto.nome.label('produto_nome'),
+            Usuario.nome.label('usuario_nome'),
+        )
+        .join(Produto, Movimentacao.produto_id == Produto.id)
+        .join(Usuario, Movimentacao.usuario_id == Usuario.id)
+    )
+    if armazem_id:
+        consulta = consulta.where(Movimentacao.armazem_id == armazem_id)
+    if antes:
+        data_cursor, id_cursor = antes
+        consulta = consulta.where(or_(
+            Movimentacao.data_movimentacao < data_cursor,
+            and_(Movimentacao.data_movimentacao == data_cursor, Movimentacao.id < id_cursor),
+        ))
+
+    consulta = consulta.order_by(Movimentacao.data_movimentacao.desc(), Movimentacao.id.desc()).limit(limite + 1)
+    movs = db.execute(consulta).all()
+    proximo_cursor = None
+    if len(movs) > limite:
+        ultima = movs[limite - 1]
+        proximo_cursor = codificar_cursor_movimentacao(ultima.data_movimentacao, ultima.id)
+    return movs[:limite], proximo_cursor
+
+
+def _insert_dialeto(db):
+    """Retorna o `insert` com suporte a ON CONFLICT do banco em uso."""
+    if db.get_bind().dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+def _expr_dia(db, coluna):
+    """Expressão SQL que trunca um DateTime para a data, conforme o banco."""
+    if db.get_bind().dialect.name == 'sqlite':
+        return func.date(coluna)
+    return func.cast(coluna, Date)
+
+
+def _expr_mes(db, coluna):
+    """Expressão SQL com o primeiro dia do mês de um DateTime, conforme o banco."""
+    if db.get_bind().dialect.name == 'sqlite':
+        return func.date(coluna, 'start of month')
+    return func.cast(func.date_trunc('month', coluna), Date)
+
+
+def validar_produto(nome, preco, quantidade, quantidade_minima=5):
+    """
+    Regras de cadastro de produto, compartilhadas pelo formulário e pela
+    importação em massa. Retorna (dados, None) ou (None, mensagem de erro).
+    """
+    nome = (nome or '').strip()
+    if not nome:
+        return None, 'Nome do produto é obrigatório.'
+    if quantidade_minima in (None, ''):
+        quantidade_minima = 5
+    try:
+        preco = float(preco)
+        quantidade = int(quantidade)
+        quantidade_minima = int(quantidade_minima)
+    except (TypeError, ValueError):
+        return None, 'Por favor, insira valores válidos.'
+    if preco < 0 or quantidade < 0 or quantidade_minima < 0:
+        return None, 'Valores não podem ser negativos.'
+    return {
+        'nome': nome,
+        'preco': preco,
+        'quantidade': quantidade,
+        'quantidade_minima': quantidade_minima,
+    }, None
+
+
+TAMANHO_LOTE_IMPORTACAO = 1000
+LIMITE_ERROS_IMPORTACAO = 1000
+
+
+def ler_linhas_csv(fluxo):
+    """Lê um CSV (separado por vírgula ou ponto e vírgula) linha a linha, como dicionários."""
+    cabecalho = fluxo.readline()
+    delimitador = ';' if cabecalho.count(';') > cabecalho.count(',') else ','
+    campos = [campo.strip().lower() for campo in next(csv.reader([cabecalho], delimiter=delimitador), [])]
+    for numero, linha in enumerate(csv.DictReader(fluxo, fieldnames=campos, delimiter=delimitador), start=2):
+        yield numero, linha
+
+
+def ler_linhas_jsonl(fluxo):
+    """Lê um arquivo JSONL linha a linha; linhas inválidas viram um erro da própria linha."""
+    for numero, linha in enumerate(fluxo, start=1):
+        if not linha.strip():
+            continue
+        try:
+            dados = json.loads(linha)
+        except ValueError:
+            dados = None
+        yield numero, dados if isinstance(dados, dict) else None
+
+
+def importar_produtos(db, linhas, tamanho_lote=TAMANHO_LOTE_IMPORTACAO, limite_erros=LIMITE_ERROS_IMPORTACAO):
+    """
+    Importa produtos a partir de `linhas` (pares número da linha, dicionário)
+    em lotes de `tamanho_lote`, com um commit por lote. Linhas com `id` de um
+    produto existente atualizam nome, preço e quantidade mínima (o estoque
+    só muda por movimentações); as demais são inseridas.
+
+    Linhas inválidas não interrompem a importação: são contadas e as
+    primeiras `limite_erros` são devolvidas, mantendo a memória constante.
+    """
+    relatorio = {'processadas': 0, 'importadas': 0, 'erros': [], 'total_erros': 0}
+
+    def registrar_erro(numero, mensagem):
+        relatorio['total_erros'] += 1
+        if len(relatorio['erros']) < limite_erros:
+            relatorio['erros'].append((numero, mensagem))
+
+    lote = []
+    for numero, linha in linhas:
+        relatorio['processadas'] += 1
+        if linha is None:
+            registrar_erro(numero, 'Linha mal formatada.')
+            continue
+        dados, erro = validar_produto(
+            linha.get('nome'), linha.get('preco'), linha.get('quantidade'), linha.get('quantidade_minima')
+        )
+        if not erro and linha.get('id') not in (None, ''):
+            try:
+                dados['id'] = int(linha['id'])
+            except (TypeError, ValueError):
+                erro = 'Identificador de produto inválido.'
+        if erro:
+            registrar_erro(numero, erro)
+            continue
+        lote.append((numero, dados))
+        if len(lote) >= tamanho_lote:
+            _gravar_lote_importacao(db, lote, relatorio, registrar_erro)
+            lote = []
+    if lote:
+        _gravar_lote_importacao(db, lote, relatorio, registrar_erro)
+
+    reconstruir_totais_produtos(db)
+    db.commit()
+    return relatorio
+
+
+def _gravar_lote_importacao(db, lote, relatorio, registrar_erro):
+    try:
+        _upsert_produtos(db, [dados for _, dados in lote])
+        db.commit()
+        relatorio['importadas'] += len(lote)
+    except SQLAlchemyError:
+        # Um registro rejeitado pelo banco não derruba o lote: refaz linha a linha.
+        db.rollback()
+        for numero, dados in lote:
+            try:
+                _upsert_produtos(db, [dados])
+                db.commit()
+                relatorio['importadas'] += 1
+            except SQLAlchemyError as erro:
+                db.rollback()
+                registrar_erro(numero, f'Rejeitada pelo banco: {erro.__class__.__name__}.')
+
+
+def _upsert_produtos(db, registros):
+    """
+    Insere ou atualiza os produtos; os que ainda não têm saldo em nenhum
+    armazém (os inseridos) recebem o estoque informado no armazém principal.
+    """
+    agora = datetime.now()
+    novos = [dict(dados, criado_em=agora, atualizado_em=agora) for dados in registros if 'id' not in dados]
+    com_id = [dict(dados, criado_em=agora, atualizado_em=agora) for dados in registros if 'id' in dados]
+    produto_ids = [dados['id'] for dados in com_id]
+    if novos:
+        produto_ids += db.execute(Produto.__table__.insert().returning(Produto.__table__.c.id), novos).scalars().all()
+    if com_id:
+        comando = _insert_dialeto(db)(Produto.__table__)
+        comando = comando.on_conflict_do_update(
+            index_elements=[Produto.__table__.c.id],
+            set_={
+                'nome': comando.excluded.nome,
+                'preco': comando.excluded.preco,
+                'quantidade_minima': comando.excluded.quantidade_minima,
+                'atualizado_em': comando.excluded.atualizado_em,
+            },
+        )
+        db.execute(comando, com_id)
+
+    sem_saldo = ~select(EstoqueArmazem.produto_id).where(EstoqueArmazem.produto_id == Produto.id).exists()
+    db.execute(EstoqueArmazem.__table__.insert().from_select(
+        ['armazem_id', 'produto_id', 'quantidade', 'atualizado_em'],
+        select(literal(ARMAZEM_PRINCIPAL_ID), Produto.id, Produto.quantidade, literal(agora))
+        .where(Produto.id.in_(produto_ids), sem_saldo),
+    ))
+
+
+def _abrir_linhas_importacao(fluxo, formato):
+    return ler_linhas_jsonl(fluxo) if formato == 'jsonl' else ler_linhas_csv(fluxo)
+
+
+TAMANHO_LOTE_EXPORTACAO = 1000
+
+
+def consulta_exportacao_produtos():
+    return select(
+        Produto.id, Produto.nome, Produto.preco, Produto.quantidade, Produto.quantidade_minima,
+        Produto.criado_em, Produto.atualizado_em,
+    ).order_by(Produto.id)
+
+
+def consulta_exportacao_movimentacoes(inicio=None, fim=None, produto_id=None, armazem_id=None):
+    """
+    Movimentações para exportação, em ordem de id. `inicio` e `fim` são
+    datas inclusivas; `produto_id` e `armazem_id` restringem a um único
+    produto ou armazém.
+    """
+    consulta = (
+        select(
+            Movimentacao.id, Movimentacao.data_movimentacao, Movimentacao.armazem_id, Movimentacao.produto_id,
+            Produto.nome.label('produto_nome'), Movimentacao.usuario_id, Usuario.nome.label('usuario_nome'),
+            Movimentacao.tipo_movimentacao, Movimentacao.quantidade, Movimentacao.observacoes,
+        )
+        .join(Produto, Movimentacao.produto_id == Produto.id)
+        .join(Usuario, Movimentacao.usuario_id == Usuario.id)
+        .order_by(Movimentacao.id)
+    )
+    if inicio:
+        consulta = consulta.where(Movimentacao.data_movimentacao >= datetime.combine(inicio, datetime.min.time()))
+    if fim:
+        consulta = consulta.where(Movimentacao.data_movimentacao < datetime.combine(fim + timedelta(days=1), datetime.min.time()))
+    if produto_id:
+        consulta = consulta.where(Movimentacao.produto_id == produto_id)
+    if armazem_id:
+        consulta = consulta.where(Movimentacao.armazem_id == armazem_id)
+    return consulta
+
+
+def gerar_exportacao(consulta, formato='csv', tamanho_lote=TAMANHO_LOTE_EXPORTACAO):
+    """
+    Gera o resultado de `consulta` como CSV ou JSONL, em blocos de texto de
+    `tamanho_lote` linhas. Usa `yield_per` (cursor do lado do servidor quando o
+    banco suporta), então só um bloco fica em memória. A sessão é aberta e
+    fechada pelo próprio gerador, que pode ser consumido depois da requisição.
+    """
+    db = SessionLocal()
+    try:
+        resultado = db.execute(consulta.execution_options(yield_per=tamanho_lote))
+        colunas = list(resultado.keys())
+        buffer = io.StringIO()
+        escritor = csv.writer(buffer)
+        if formato == 'csv':
+            escritor.writerow(colunas)
+
+        for bloco in resultado.partitions():
+            for linha in bloco:
+                if formato == 'csv':
+                    escritor.writerow(linha)
+                else:
+                    buffer.write(json.dumps(dict(zip(colunas, linha)), default=_serializar_json, ensure_ascii=False))
+                    buffer.write('\n')
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+    finally:
+        db.close()
+
+
+def _serializar_json(valor):
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    raise TypeError(f'Tipo não serializável: {type(valor).__name__}')
+
+
+def _ler_data(texto):
+    """Converte YYYY-MM-DD em date; valores vazios ou inválidos viram None."""
+    try:
+        return date.fromisoformat(texto) if texto else None
+    except ValueError:
+        return None
+
+
+def contribuicao_resumo(preco, quantidade, quantidade_minima):
+    """Parcela de um produto nos totais do resumo: (valor em estoque, 1 se estoque baixo)."""
+    return preco * quantidade, 1 if quantidade <= quantidade_minima else 0
+
+
+def atualizar_resumo(db, antes=None, depois=None):
+    """
+    Aplica ao resumo a diferença entre dois estados de um produto.
+    `antes` e `depois` são tuplas (preco, quantidade, quantidade_minima);
+    `antes=None` indica um produto novo. Deve ser chamada dentro da mesma
+    transação que altera o produto.
+    """
+    valor_antes, baixo_antes = contribuicao_resumo(*antes) if antes else (0.0, 0)
+    valor_depois, baixo_depois = contribuicao_resumo(*depois) if depois else (0.0, 0)
+    aplicar_delta_resumo(
+        db,
+        produtos=(1 if antes is None else 0) - (1 if depois is None else 0),
+        valor=valor_depois - valor_antes,
+        baixo=baixo_depois - baixo_antes,
+    )
+
+
+def aplicar_delta_resumo(db, produtos=0, valor=0.0, baixo=0):
+    """Soma os deltas já calculados aos totais do resumo."""
+    resultado = db.execute(
+        update(ResumoEstoque)
+        .where(ResumoEstoque.id == 1)
+        .values(
+            total_produtos=ResumoEstoque.total_produtos + produtos,
+            valor_estoque=ResumoEstoque.valor_estoque + valor,
+            estoque_baixo=ResumoEstoque.estoque_baixo + baixo,
+            versao=ResumoEstoque.versao + 1,
+            atualizado_em=datetime.now(),
+        )
+    )
+    if resultado.rowcount == 0:
+        # Primeiro uso do resumo: reconstrói a partir das tabelas, já incluindo
+        # a alteração pendente desta transação.
+        db.flush()
+        reconstruir_resumo(db)
+
+
+def registrar_movimentacao_diaria(db, tipo_movimentacao, dia=None, total=1):
+    """Incrementa o contador diário de entradas ou saídas."""
+    coluna = 'entradas' if tipo_movimentacao == 'entrada' else 'saidas'
+    insert = _insert_dialeto(db)
+    valores = {'dia': dia or date.today(), 'entradas': 0, 'saidas': 0}
+    valores[coluna] = total
+    comando = insert(MovimentacaoDiaria).values(**valores)
+    comando = comando.on_conflict_do_update(
+        index_elements=[MovimentacaoDiaria.dia],
+        set_={coluna: getattr(MovimentacaoDiaria, coluna) + total},
+    )
+    db.execute(comando)
+
+
+def _comando_saldo_armazem(db, saida):
+    """
+    Comando que soma `delta` ao saldo (armazem, produto), para executar com
+    um ou vários conjuntos de parâmetros. Nas saídas é um UPDATE condicional
+    (`quantidade + delta >= 0`); nas entradas, um upsert que cria o saldo no
+    primeiro movimento e não insere nada se o produto não existe.
+    """
+    tabela = EstoqueArmazem.__table__
+    agora = datetime.now()
+    if saida:
+        return (
+            update(tabela)
+            .where(
+                tabela.c.armazem_id == bindparam('armazem'),
+                tabela.c.produto_id == bindparam('produto'),
+                tabela.c.quantidade + bindparam('delta') >= 0,
+            )
+            .values(quantidade=tabela.c.quantidade + bindparam('delta'), atualizado_em=agora)
+        )
+    comando = _insert_dialeto(db)(tabela).from_select(
+        ['armazem_id', 'produto_id', 'quantidade', 'atualizado_em'],
+        select(bindparam('armazem', type_=Integer), Produto.id, bindparam('delta', type_=Integer), literal(agora))
+        .where(Produto.id == bindparam('produto')),
+    )
+    return comando.on_conflict_do_update(
+        index_elements=[tabela.c.armazem_id, tabela.c.produto_id],
+        set_={'quantidade': tabela.c.quantidade + comando.excluded.quantidade, 'atualizado_em': agora},
+    )
+
+
+def movimentar_estoque(db, produto_id, tipo_movimentacao, quantidade, usuario_id, observacoes='',
+                       armazem_id=ARMAZEM_PRINCIPAL_ID):
+    """
+    Registra uma entrada ou saída no armazém sem ler-modificar-escrever: o
+    saldo do armazém é alterado por um único comando condicional (ver
+    `_comando_saldo_armazem`), então requisições simultâneas não vendem além
+    do estoque nem perdem atualizações, e o total consolidado do produto
+    acompanha. Saldo e produto são sempre alterados nessa ordem, para que
+    transações concorrentes não se bloqueiem mutuamente. Resumo, contador
+    diário e Movimentacao entram na mesma transação; o commit fica a cargo
+    de quem chama.
+
+    Retorna a linha atualizada do produto (id, nome, preco, quantidade total,
+    quantidade_minima) ou None se o produto não existe ou, na saída, o saldo
+    do armazém é insuficiente; nesse caso nada foi alterado.
+    """
+    delta = quantidade if tipo_movimentacao == 'entrada' else -quantidade
+    saldo = db.execute(
+        _comando_saldo_armazem(db, saida=delta < 0),
+        {'armazem': armazem_id, 'produto': produto_id, 'delta': delta},
+    )
+    if saldo.rowcount != 1:
+        return None
+
+    comando = (
+        update(Produto)
+        .where(Produto.id == produto_id)
+        .values(quantidade=Produto.quantidade + delta, atualizado_em=datetime.now())
+        .returning(Produto.id, Produto.nome, Produto.preco, Produto.quantidade, Produto.quantidade_minima)
+        .execution_options(synchronize_session=False)
+    )
+    produto = db.execute(comando).first()
+    if produto is None:
+        return None
+
+    atualizar_resumo(
+        db,
+        (produto.preco, produto.quantidade - delta, produto.quantidade_minima),
+        (produto.preco, produto.quantidade, produto.quantidade_minima),
+    )
+    registrar_movimentacao_diaria(db, tipo_movimentacao)
+    if produto.quantidade - delta > produto.quantidade_minima >= produto.quantidade:
+        enfileirar_alertas(db, [{
+            'produto_id': produto_id,
+            'quantidade': produto.quantidade,
+            'quantidade_minima': produto.quantidade_minima,
+        }])
+    db.add(Movimentacao(
+        produto_id=produto_id,
+        usuario_id=usuario_id,
+        armazem_id=armazem_id,
+        tipo_movimentacao=tipo_movimentacao,
+        quantidade=quantidade,
+        observacoes=observacoes
+    ))
+    return produto
+
+
+LIMITE_ITENS_LOTE = 1000
+
+
+def ler_itens_lote(texto):
+    """
+    Converte o texto do formulário de lote em itens. Cada linha não vazia tem
+    o formato `produto_id;tipo;quantidade[;observações]`.
+    """
+    itens = []
+    for linha in texto.splitlines():
+        if not linha.strip():
+            continue
+        partes = [parte.strip() for parte in linha.split(';', 3)]
+        partes += [''] * (4 - len(partes))
+        itens.append({
+            'produto_id': partes[0],
+            'tipo': partes[1].lower(),
+            'quantidade': partes[2],
+            'observacoes': partes[3],
+        })
+    return itens
+
+
+def validar_lote(db, itens, armazem_id=ARMAZEM_PRINCIPAL_ID):
+    """
+    Valida o lote inteiro antes de qualquer escrita, com as saídas
+    conferidas contra o saldo do armazém.
+    Retorna (movimentos, erros): movimentos normalizados prontos para
+    `movimentar_estoque_em_lote` e mensagens de erro por linha.
+    """
+    if not itens:
+        return [], ['O lote não contém itens.']
+    if len(itens) > LIMITE_ITENS_LOTE:
+        return [], [f'O lote excede o limite de {LIMITE_ITENS_LOTE} itens.']
+
+    movimentos, erros = [], []
+    for numero, item in enumerate(itens, start=1):
+        if not isinstance(item, dict):
+            erros.append(f'Linha {numero}: o item deve ser um objeto com produto_id, tipo e quantidade.')
+            continue
+        try:
+            produto_id = int(item.get('produto_id'))
+            quantidade = int(item.get('quantidade'))
+        except (TypeError, ValueError, OverflowError):
+            erros.append(f'Linha {numero}: produto e quantidade devem ser números inteiros.')
+            continue
+        if not (0 < produto_id <= MAIOR_INTEIRO_BANCO and quantidade <= MAIOR_INTEIRO_BANCO):
+            erros.append(f'Linha {numero}: produto e quantidade devem ser no máximo {MAIOR_INTEIRO_BANCO}.')
+            continue
+        tipo = str(item.get('tipo', '')).strip().lower().replace('í', 'i')
+        if tipo not in ('entrada', 'saida'):
+            erros.append(f'Linha {numero}: tipo deve ser "entrada" ou "saida".')
+        elif quantidade <= 0:
+            erros.append(f'Linha {numero}: quantidade deve ser maior que zero.')
+        else:
+            movimentos.append({
+                'produto_id': produto_id,
+                'tipo_movimentacao': tipo,
+                'quantidade': quantidade,
+                'observacoes': str(item.get('observacoes') or '').strip()[:255],
+            })
+    if erros:
+        return [], erros
+
+    deltas = _deltas_por_produto(movimentos)
+    estoques = dict(db.execute(
+        select(Produto.id, func.coalesce(EstoqueArmazem.quantidade, 0))
+        .outerjoin(EstoqueArmazem, and_(
+            EstoqueArmazem.armazem_id == armazem_id, EstoqueArmazem.produto_id == Produto.id,
+        ))
+        .where(Produto.id.in_(deltas))
+    ).all())
+    for produto_id, delta in deltas.items():
+        if produto_id not in estoques:
+            erros.append(f'Produto {produto_id} não encontrado.')
+        elif estoques[produto_id] + delta < 0:
+            erros.append(
+                f'Produto {produto_id}: estoque insuficiente '
+                f'(disponível {estoques[produto_id]}, saída líquida {-delta}).'
+            )
+        elif estoques[produto_id] + delta > MAIOR_INTEIRO_BANCO:
+            erros.append(f'Produto {produto_id}: o estoque resultante excede {MAIOR_INTEIRO_BANCO}.')
+    return (movimentos, []) if not erros else ([], erros)
+
+
+def _deltas_por_produto(movimentos):
+    deltas = {}
+    for movimento in movimentos:
+        sinal = 1 if movimento['tipo_movimentacao'] == 'entrada' else -1
+        deltas[movimento['produto_id']] = deltas.get(movimento['produto_id'], 0) + sinal * movimento['quantidade']
+    return deltas
+
+
+def _executar_contando(db, comando, parametros):
+    """Executa `comando` para cada conjunto de parâmetros e retorna quantas linhas foram afetadas."""
+    if not parametros:
+        return 0
+    if db.get_bind().dialect.supports_sane_multi_rowcount:
+        return db.execute(comando, parametros).rowcount
+    return sum(db.execute(comando, linha).rowcount for linha in parametros)
+
+
+def movimentar_estoque_em_lote(db, movimentos, usuario_id, armazem_id=ARMAZEM_PRINCIPAL_ID):
+    """
+    Aplica um lote já validado em uma única transação: os saldos do armazém
+    e depois os totais dos produtos, cada um com um comando por produto
+    (executemany, com o saldo líquido do lote), um INSERT em massa das
+    movimentações e um ajuste do resumo.
+
+    Saldos e produtos são travados em ordem crescente de produto, então dois
+    lotes simultâneos com os mesmos itens esperam um pelo outro em vez de se
+    bloquearem mutuamente; sequências de saídas ou de entradas consecutivas
+    nessa ordem compartilham um executemany.
+    Retorna as linhas atualizadas (id, preco, quantidade, quantidade_minima),
+    ou False, sem aplicar nada, se outra operação consumiu o estoque entre a
+    validação e a escrita ou se o banco abortou a transação por conflito de
+    travas; o commit fica a cargo de quem chama.
+    """
+    deltas = _deltas_por_produto(movimentos)
+    agora = datetime.now()
+    parametros = [
+        {'armazem': armazem_id, 'produto': produto_id, 'delta': delta} for produto_id, delta in sorted(deltas.items())
+    ]
+    tabela = Produto.__table__
+    try:
+        atualizados = sum(
+            _executar_contando(db, _comando_saldo_armazem(db, saida=saida), list(linhas))
+            for saida, linhas in groupby(parametros, key=lambda linha: linha['delta'] < 0)
+        )
+        if atualizados != len(parametros):
+            db.rollback()
+            return False
+
+        db.execute(
+            update(tabela)
+            .where(tabela.c.id == bindparam('produto'))
+            .values(quantidade=tabela.c.quantidade + bindparam('delta'), atualizado_em=agora),
+            [{'produto': linha['produto'], 'delta': linha['delta']} for linha in parametros],
+        )
+    except OperationalError:
+        # Deadlock ou timeout de trava (PostgreSQL): quem chama responde 409.
+        db.rollback()
+        return False
+
+    # Estado já atualizado dentro da transação: o anterior é o atual menos o delta.
+    valor = 0.0
+    baixo = 0
+    novos_alertas = []
+    produtos = db.execute(
+        select(Produto.id, Produto.preco, Produto.quantidade, Produto.quantidade_minima)
+        .where(Produto.id.in_(deltas))
+    ).all()
+    for produto in produtos:
+        valor_antes, baixo_antes = contribuicao_resumo(
+            produto.preco, produto.quantidade - deltas[produto.id], produto.quantidade_minima
+        )
+        valor_depois, baixo_depois = contribuicao_resumo(produto.preco, produto.quantidade, produto.quantidade_minima)
+        valor += valor_depois - valor_antes
+        baixo += baixo_depois - baixo_antes
+        if baixo_depois and not baixo_antes:
+            novos_alertas.append({
+                'produto_id': produto.id,
+                'quantidade': produto.quantidade,
+                'quantidade_minima': produto.quantidade_minima,
+            })
+    aplicar_delta_resumo(db, valor=valor, baixo=baixo)
+    enfileirar_alertas(db, novos_alertas)
+
+    for tipo in ('entrada', 'saida'):
+        total = sum(1 for movimento in movimentos if movimento['tipo_movimentacao'] == tipo)
+        if total:
+            registrar_movimentacao_diaria(db, tipo, total=total)
+
+    db.execute(insert(Movimentacao), [
+        dict(movimento, usuario_id=usuario_id, armazem_id=armazem_id, data_movimentacao=agora)
+        for movimento in movimentos
+    ])
+    return produtos
+
+
+TAMANHO_LOTE_ALERTAS = 200
+
+
+def enfileirar_alertas(db, alertas):
+    """
+    Grava eventos de estoque baixo (dicts com produto_id, quantidade e
+    quantidade_minima) na transação corrente. Nenhum envio acontece aqui.
+    """
+    if alertas:
+        db.execute(insert(EventoAlerta), alertas)
+
+
+def processar_alertas(db, transporte, janela=timedelta(minutes=ALERTA_JANELA_MINUTOS), limite=TAMANHO_LOTE_ALERTAS):
+    """
+    Entrega até `limite` eventos pendentes em um único resumo e faz o commit.
+
+    Só o evento mais recente de cada produto entra no resumo, e produtos já
+    alertados dentro de `janela` ficam de fora; os demais eventos são
+    marcados como duplicados. O envio acontece antes da marcação: se o
+    transporte falhar, os eventos continuam pendentes para a próxima rodada.
+    Retorna (enviados, duplicados).
+    """
+    agora = datetime.now()
+    eventos = db.execute(
+        select(
+            EventoAlerta.id, EventoAlerta.produto_id, EventoAlerta.quantidade,
+            EventoAlerta.quantidade_minima, Produto.nome,
+        )
+        .join(Produto, Produto.id == EventoAlerta.produto_id)
+        .where(EventoAlerta.situacao == 'pendente')
+        .order_by(EventoAlerta.id)
+        .limit(limite)
+    ).all()
+    if not eventos:
+        return 0, 0
+
+    alertados = set(db.execute(
+        select(EventoAlerta.produto_id).where(
+            EventoAlerta.situacao == 'enviado',
+            EventoAlerta.processado_em >= agora - janela,
+            EventoAlerta.produto_id.in_({evento.produto_id for evento in eventos}),
+        )
+    ).scalars())
+    ultimos = {evento.produto_id: evento for evento in eventos}
+    enviar = sorted(
+        (evento for produto_id, evento in ultimos.items() if produto_id not in alertados),
+        key=lambda evento: evento.id,
+    )
+    ids_enviados = [evento.id for evento in enviar]
+    ultimos_enviados = set(ids_enviados)
+    ids_duplicados = [evento.id for evento in eventos if evento.id not in ultimos_enviados]
+
+    if enviar:
+        transporte.enviar(*montar_resumo([dict(evento._mapping) for evento in enviar]))
+
+    for situacao, ids in (('enviado', ids_enviados), ('duplicado', ids_duplicados)):
+        if ids:
+            db.execute(
+                update(EventoAlerta)
+                .where(EventoAlerta.id.in_(ids))
+                .values(situacao=situacao, processado_em=agora)
+            )
+    db.commit()
+    return len(ids_enviados), len(ids_duplicados)
+
+
+def reconstruir_totais_produtos(db):
+    """
+    Recalcula os totais de produtos do resumo em um único comando, para que
+    movimentações simultâneas não sejam sobrescritas por uma leitura antiga.
+    """
+    totais = (
+        select(func.count(Produto.id)).scalar_subquery(),
+        select(func.coalesce(func.sum(Produto.preco * Produto.quantidade), 0.0)).scalar_subquery(),
+        select(func.count(Produto.id)).where(Produto.quantidade <= Produto.quantidade_minima).scalar_subquery(),
+    )
+    agora = datetime.now()
+    resultado = db.execute(
+        update(ResumoEstoque)
+        .where(ResumoEstoque.id == 1)
+        .values(
+            total_produtos=totais[0], valor_estoque=totais[1], estoque_baixo=totais[2],
+            versao=ResumoEstoque.versao + 1, atualizado_em=agora,
+        )
+    )
+    if resultado.rowcount == 0:
+        db.execute(ResumoEstoque.__table__.insert().from_select(
+            ['id', 'total_produtos', 'valor_estoque', 'estoque_baixo', 'atualizado_em'],
+            select(literal(1), *totais, literal(agora)),
+        ))
+
+
+def reconstruir_resumo(db):
+    """Recalcula o resumo e os contadores diários a partir das tabelas de origem."""
+    reconstruir_totais_produtos(db)
+
+    # Dias já arquivados não estão mais em movimentacoes: os contadores
+    # deles são mantidos como estão.
+    corte = obter_corte_arquivado(db)
+    dia = _expr_dia(db, Movimentacao.data_movimentacao)
+    consulta = select(
+        dia,
+        func.count(case((Movimentacao.tipo_movimentacao == 'entrada', 1))),
+        func.count(case((Movimentacao.tipo_movimentacao != 'entrada', 1))),
+    ).group_by(dia)
+    remocao = delete(MovimentacaoDiaria)
+    if corte:
+        consulta = consulta.where(Movimentacao.data_movimentacao >= corte)
+        remocao = remocao.where(MovimentacaoDiaria.dia >= corte.date())
+    db.execute(remocao)
+    db.execute(MovimentacaoDiaria.__table__.insert().from_select(['dia', 'entradas', 'saidas'], consulta))
+    db.flush()
+
+
+def verificar_resumo(db, tolerancia=0.01):
+    """
+    Compara o resumo materializado com as tabelas de origem.
+    Retorna a lista de divergências encontradas (vazia se estiver consistente).
+    """
+    resumo = db.get(ResumoEstoque, 1)
+    if resumo is None:
+        return ['Resumo ainda não foi gerado.']
+
+    divergencias = []
+    real = calcular_indicadores(db)
+    for campo, armazenado in (
+        ('total_produtos', resumo.total_produtos),
+        ('valor_estoque', resumo.valor_estoque),
+        ('estoque_baixo', resumo.estoque_baixo),
+    ):
+        if abs(armazenado - real[campo]) > tolerancia:
+            divergencias.append(f'{campo}: resumo={armazenado} real={real[campo]}')
+
+    saldos = (
+        select(EstoqueArmazem.produto_id, func.sum(EstoqueArmazem.quantidade).label('total'))
+        .group_by(EstoqueArmazem.produto_id)
+        .subquery()
+    )
+    for produto_id, quantidade, total in db.execute(
+        select(Produto.id, Produto.quantidade, func.coalesce(saldos.c.total, 0))
+        .outerjoin(saldos, saldos.c.produto_id == Produto.id)
+        .where(Produto.quantidade != func.coalesce(saldos.c.total, 0))
+        .order_by(Produto.id)
+        .limit(10)
+    ):
+        divergencias.append(f'produto {produto_id}: quantidade={quantidade} soma dos armazéns={total}')
+
+    corte = obter_corte_arquivado(db)
+    dia = _expr_dia(db, Movimentacao.data_movimentacao)
+    consulta_reais = select(
+        dia,
+        func.count(case((Movimentacao.tipo_movimentacao == 'entrada', 1))),
+        func.count(case((Movimentacao.tipo_movimentacao != 'entrada', 1))),
+    ).group_by(dia)
+    consulta_armazenados = select(MovimentacaoDiaria.dia, MovimentacaoDiaria.entradas, MovimentacaoDiaria.saidas)
+    if corte:
+        consulta_reais = consulta_reais.where(Movimentacao.data_movimentacao >= corte)
+        consulta_armazenados = consulta_armazenados.where(MovimentacaoDiaria.dia >= corte.date())
+    reais = {str(linha[0]): (linha[1], linha[2]) for linha in db.execute(consulta_reais)}
+    armazenados = {str(linha.dia): (linha.entradas, linha.saidas) for linha in db.execute(consulta_armazenados)}
+    for dia_texto in sorted(set(reais) | set(armazenados)):
+        if reais.get(dia_texto, (0, 0)) != armazenados.get(dia_texto, (0, 0)):
+            divergencias.append(
+                f'movimentações em {dia_texto}: resumo={armazenados.get(dia_texto, (0, 0))} '
+                f'real={reais.get(dia_texto, (0, 0))}'
+            )
+    return divergencias
+
+
+TAMANHO_LOTE_ARQUIVO = 5000
+
+
+def calcular_corte_arquivo(horizonte_dias=ARQUIVO_HORIZONTE_DIAS, hoje=None):
+    """Início do mês que contém `hoje - horizonte_dias`: só meses inteiros são arquivados."""
+    limite = (hoje or date.today()) - timedelta(days=horizonte_dias)
+    return datetime(limite.year, limite.month, 1)
+
+
+def obter_corte_arquivado(db):
+    """Maior corte já usado pelo arquivamento (ou None se nada foi arquivado)."""
+    return db.execute(select(func.max(ArquivoMovimentacoes.corte))).scalar()
+
+
+def arquivar_lote(db, corte, diretorio=ARQUIVO_DIRETORIO, tamanho_lote=TAMANHO_LOTE_ARQUIVO):
+    """
+    Move até `tamanho_lote` movimentações anteriores a `corte` para arquivos
+    `<diretorio>/<AAAA-MM>/movimentacoes-<primeiro_id>.jsonl.gz` e soma-as em
+    `movimentacoes_mensais`, em uma transação curta com commit.
+
+    O arquivo é gravado (e sincronizado em disco) antes do DELETE, que
+    incrementa a versão do resumo na mesma transação. Se o processo cair
+    no meio, as linhas continuam no banco e a próxima execução seleciona
+    o mesmo lote e regrava o mesmo arquivo.
+    Retorna quantas movimentações foram arquivadas (0 quando não resta nada).
+    """
+    tabela = Movimentacao.__table__
+    linhas = db.execute(
+        select(tabela)
+        .where(tabela.c.data_movimentacao < corte)
+        .order_by(tabela.c.data_movimentacao, tabela.c.id)
+        .limit(tamanho_lote)
+    ).all()
+    if not linhas:
+        return 0
+
+    por_mes = {}
+    for linha in linhas:
+        por_mes.setdefault(linha.data_movimentacao.date().replace(day=1), []).append(linha)
+
+    totais = {}
+    for mes, linhas_mes in por_mes.items():
+        caminho = _gravar_arquivo_movimentacoes(diretorio, mes, linhas_mes)
+        db.add(ArquivoMovimentacoes(
+            caminho=caminho, mes=mes, primeiro_id=linhas_mes[0].id,
+            ultimo_id=max(linha.id for linha in linhas_mes), linhas=len(linhas_mes), corte=corte,
+        ))
+        for linha in linhas_mes:
+            total = totais.setdefault((linha.produto_id, mes), {
+                'produto_id': linha.produto_id, 'mes': mes,
+                'entradas': 0, 'saidas': 0, 'quantidade_entrada': 0, 'quantidade_saida': 0,
+            })
+            sufixo = 'entrada' if linha.tipo_movimentacao == 'entrada' else 'saida'
+            total[sufixo + 's'] += 1
+            total['quantidade_' + sufixo] += linha.quantidade
+
+    insert = _insert_dialeto(db)
+    comando = insert(MovimentacaoMensal)
+    campos = ('entradas', 'saidas', 'quantidade_entrada', 'quantidade_saida')
+    db.execute(
+        comando.on_conflict_do_update(
+            index_elements=[MovimentacaoMensal.produto_id, MovimentacaoMensal.mes],
+            set_={campo: getattr(MovimentacaoMensal, campo) + getattr(comando.excluded, campo) for campo in campos},
+        ),
+        list(totais.values()),
+    )
+    db.execute(delete(Movimentacao).where(Movimentacao.id.in_([linha.id for linha in linhas])))
+    # As páginas de movimentações mudaram: nova versão para os ETags da API.
+    db.execute(
+        update(ResumoEstoque)
+        .where(ResumoEstoque.id == 1)
+        .values(versao=ResumoEstoque.versao + 1, atualizado_em=datetime.now())
+    )
+    db.commit()
+    cache_consultas.invalidar_grupo('indicadores')
+    cache_analises.limpar()
+    return len(linhas)
+
+
+def _gravar_arquivo_movimentacoes(diretorio, mes, linhas):
+    pasta = os.path.join(diretorio, f'{mes:%Y-%m}')
+    os.makedirs(pasta, exist_ok=True)
+    caminho = os.path.join(pasta, f'movimentacoes-{linhas[0].id}.jsonl.gz')
+    temporario = caminho + '.tmp'
+    with open(temporario, 'wb') as bruto:
+        with gzip.GzipFile(fileobj=bruto, mode='wb') as arquivo:
+            for linha in linhas:
+                registro = json.dumps(dict(linha._mapping), default=_serializar_json, ensure_ascii=False)
+                arquivo.write(registro.encode('utf-8') + b'\n')
+        bruto.flush()
+        os.fsync(bruto.fileno())
+    os.replace(temporario, caminho)
+    return caminho
+
+
+def historico_mensal(db, produto_id):
+    """
+    Totais mensais de um produto: meses arquivados vêm de
+    `movimentacoes_mensais`, os demais são agregados de `movimentacoes`.
+    """
+    campos = ('entradas', 'saidas', 'quantidade_entrada', 'quantidade_saida')
+    meses = {}
+
+    def somar(mes, valores):
+        total = meses.setdefault(str(mes)[:7], dict.fromkeys(campos, 0))
+        for campo, valor in zip(campos, valores):
+            total[campo] += valor or 0
+
+    for linha in db.execute(
+        select(MovimentacaoMensal.mes, *(getattr(MovimentacaoMensal, campo) for campo in campos))
+        .where(MovimentacaoMensal.produto_id == produto_id)
+    ):
+        somar(linha[0], linha[1:])
+
+    mes = _expr_mes(db, Movimentacao.data_movimentacao)
+    entrada = Movimentacao.tipo_movimentacao == 'entrada'
+    for linha in db.execute(
+        select(
+            mes,
+            func.count(case((entrada, 1))),
+            func.count(case((~entrada, 1))),
+            func.sum(case((entrada, Movimentacao.quantidade), else_=0)),
+            func.sum(case((~entrada, Movimentacao.quantidade), else_=0)),
+        )
+        .where(Movimentacao.produto_id == produto_id)
+        .group_by(mes)
+    ):
+        somar(linha[0], linha[1:])
+
+    return [dict(total, mes=chave) for chave, total in sorted(meses.items())]
+
+
+def registrar_snapshot(db):
+    """
+    Grava a quantidade e o preço de todos os produtos e faz o commit.
+    O cabeçalho é inserido primeiro para que, no SQLite, o lock de escrita
+    já esteja tomado quando as quantidades e a última movimentação são lidas.
+    """
+    snapshot = SnapshotEstoque(momento=datetime.now(), ultima_movimentacao_id=0)
+    db.add(snapshot)
+    db.flush()
+    db.execute(
+        update(SnapshotEstoque)
+        .where(SnapshotEstoque.id == snapshot.id)
+        .values(ultima_movimentacao_id=select(func.coalesce(func.max(Movimentacao.id), 0)).scalar_subquery())
+    )
+    db.execute(SnapshotProduto.__table__.insert().from_select(
+        ['snapshot_id', 'produto_id', 'quantidade', 'preco'],
+        select(literal(snapshot.id), Produto.id, Produto.quantidade, Produto.preco),
+    ))
+    db.commit()
+    return snapshot.id
+
+
+TAMANHO_BLOCO_VALORACAO = 5000
+
+
+def _saldo_movimentacoes():
+    return func.sum(case(
+        (Movimentacao.tipo_movimentacao == 'entrada', Movimentacao.quantidade),
+        else_=-Movimentacao.quantidade,
+    ))
+
+
+def _saldos(db, produto_ids, *condicoes):
+    """Saldo líquido (entradas - saídas) por produto das movimentações que atendem às condições."""
+    return dict(db.execute(
+        select(Movimentacao.produto_id, _saldo_movimentacoes())
+        .where(Movimentacao.produto_id.in_(produto_ids), *condicoes)
+        .group_by(Movimentacao.produto_id)
+    ).all())
+
+
+def _saldos_arquivados(db, produto_ids, momento, corte):
+    """Saldo dos meses arquivados entre `momento` (início de mês) e o corte."""
+    if not corte or momento >= corte:
+        return {}
+    return dict(db.execute(
+        select(
+            MovimentacaoMensal.produto_id,
+            func.sum(MovimentacaoMensal.quantidade_entrada - MovimentacaoMensal.quantidade_saida),
+        )
+        .where(
+            MovimentacaoMensal.produto_id.in_(produto_ids),
+            MovimentacaoMensal.mes >= momento.date(),
+            MovimentacaoMensal.mes < corte.date(),
+        )
+        .group_by(MovimentacaoMensal.produto_id)
+    ).all())
+
+
+def escolher_snapshot(db, momento, corte=None):
+    """
+    Ponto de partida mais próximo de `momento`: o snapshot anterior, o
+    posterior ou o estado atual (None), o que estiver mais perto no tempo.
+    Snapshots anteriores ao corte do arquivamento não servem, pois parte das
+    movimentações entre eles e `momento` já saiu da tabela.
+    """
+    anterior = None
+    if not corte or momento >= corte:
+        consulta = select(SnapshotEstoque).where(SnapshotEstoque.momento <= momento)
+        if corte:
+            consulta = consulta.where(SnapshotEstoque.momento >= corte)
+        anterior = db.execute(consulta.order_by(SnapshotEstoque.momento.desc()).limit(1)).scalar()
+    posterior = db.execute(
+        select(SnapshotEstoque)
+        .where(SnapshotEstoque.momento > (max(momento, corte) if corte else momento))
+        .order_by(SnapshotEstoque.momento)
+        .limit(1)
+    ).scalar()
+
+    escolhido, distancia = None, abs(datetime.now() - momento)
+    for candidato in (anterior, posterior):
+        if candidato is not None and abs(candidato.momento - momento) < distancia:
+            escolhido, distancia = candidato, abs(candidato.momento - momento)
+    return escolhido
+
+
+def validar_momento_historico(db, momento):
+    """
+    Retorna o corte do arquivamento, ou levanta ValueError se `momento` cai
+    no meio de um mês já arquivado (lá só há totais mensais).
+    """
+    corte = obter_corte_arquivado(db)
+    if corte and momento < corte and momento != datetime(momento.year, momento.month, 1):
+        raise ValueError(
+            f'As movimentações anteriores a {corte:%d/%m/%Y} estão arquivadas; '
+            'consulte o fechamento de um mês (último dia do mês).'
+        )
+    return corte
+
+
+def estoque_em(db, momento, apos=None, limite=TAMANHO_PAGINA_PADRAO):
+    """
+    Estoque de cada produto imediatamente antes de `momento`, paginado por id.
+
+    Parte do snapshot mais próximo e aplica apenas as movimentações entre ele
+    e `momento` (para frente ou para trás); produtos sem snapshot partem do
+    estado atual. Meses arquivados entram pelos totais mensais.
+    Retorna (linhas, proximo_cursor); cada linha traz produto_id, nome,
+    quantidade, preco e valor. Levanta ValueError (ver `validar_momento_historico`).
+    """
+    corte = validar_momento_historico(db, momento)
+    snapshot = escolher_snapshot(db, momento, corte)
+
+    consulta = (
+        select(Produto.id, Produto.nome, Produto.quantidade, Produto.preco)
+        .where(or_(Produto.criado_em.is_(None), Produto.criado_em < momento))
+        .order_by(Produto.id)
+    )
+    if apos:
+        consulta = consulta.where(Produto.id > apos)
+    if limite is not None:
+        consulta = consulta.limit(limite + 1)
+    produtos = db.execute(consulta).all()
+    proximo_cursor = None
+    if limite is not None and len(produtos) > limite:
+        produtos = produtos[:limite]
+        proximo_cursor = produtos[-1].id
+    if not produtos:
+        return [], None
+
+    ids = [produto.id for produto in produtos]
+    fotografados, saldos_snapshot, sinal = {}, {}, 1
+    if snapshot is not None:
+        fotografados = {
+            linha.produto_id: linha
+            for linha in db.execute(
+                select(SnapshotProduto.produto_id, SnapshotProduto.quantidade, SnapshotProduto.preco)
+                .where(SnapshotProduto.snapshot_id == snapshot.id, SnapshotProduto.produto_id.in_(ids))
+            )
+        }
+        if snapshot.momento <= momento:
+            saldos_snapshot = _saldos(
+                db, list(fotografados),
+                Movimentacao.id > snapshot.ultima_movimentacao_id, Movimentacao.data_movimentacao < momento,
+            )
+        else:
+            saldos_snapshot = _saldos(
+                db, list(fotografados),
+                Movimentacao.id <= snapshot.ultima_movimentacao_id, Movimentacao.data_movimentacao >= momento,
+            )
+            sinal = -1
+    # Os demais partem do estado atual, voltando tudo o que veio depois de `momento`.
+    atuais = [produto_id for produto_id in ids if produto_id not in fotografados]
+    saldos_atuais = _saldos(db, atuais, Movimentacao.data_movimentacao >= momento) if atuais else {}
+    arquivados = _saldos_arquivados(db, ids, momento, corte)
+
+    linhas = []
+    for produto in produtos:
+        base = fotografados.get(produto.id)
+        if base is not None:
+            quantidade = base.quantidade + sinal * saldos_snapshot.get(produto.id, 0)
+            preco = base.preco
+        else:
+            quantidade = produto.quantidade - saldos_atuais.get(produto.id, 0)
+            preco = produto.preco
+        quantidade -= arquivados.get(produto.id, 0)
+        linhas.append({
+            'produto_id': produto.id,
+            'nome': produto.nome,
+            'quantidade': quantidade,
+            'preco': preco,
+            'valor': quantidade * preco,
+        })
+    return linhas, proximo_cursor
+
+
+def fim_do_dia(dia):
+    """Instante de fechamento de `dia` (meia-noite do dia seguinte)."""
+    return datetime.combine(dia + timedelta(days=1), datetime.min.time())
+
+
+def valor_estoque_em(db, momento):
+    """Valor total do estoque antes de `momento`, somado em blocos de produtos."""
+    total, apos = 0.0, None
+    while True:
+        linhas, apos = estoque_em(db, momento, apos=apos, limite=TAMANHO_BLOCO_VALORACAO)
+        total += sum(linha['valor'] for linha in linhas)
+        if apos is None:
+            return total
+
+
+def carregar_demanda(db, janela_dias=DEMANDA_JANELA_DIAS, agora=None):
+    """
+    Lê em bloco os produtos e as saídas da janela já somadas por produto e
+    dia, e calcula a demanda de todos os produtos de uma vez.
+    """
+    # NumPy só é carregado quando a análise roda, e não na inicialização.
+    import numpy as np
+    from analise_demanda import calcular_demanda
+
+    agora = agora or datetime.now()
+    inicio = inicio_do_dia(agora) - timedelta(days=janela_dias - 1)
+
+    produtos = db.execute(select(Produto.id, Produto.quantidade, Produto.criado_em).order_by(Produto.id)).all()
+    produto_ids = np.fromiter((produto.id for produto in produtos), dtype=np.int64, count=len(produtos))
+    quantidades = np.fromiter((produto.quantidade for produto in produtos), dtype=np.int64, count=len(produtos))
+    criados = np.array([produto.criado_em or inicio for produto in produtos], dtype='datetime64[s]')
+    # Produtos mais novos que a janela têm a média calculada sobre a própria idade.
+    idade_dias = np.ceil((np.datetime64(agora, 's') - criados) / np.timedelta64(1, 'D'))
+    dias_observados = np.clip(idade_dias, 1, janela_dias)
+
+    dia = _expr_dia(db, Movimentacao.data_movimentacao)
+    saidas = np.array(db.execute(
+        select(Movimentacao.produto_id, func.sum(Movimentacao.quantidade))
+        .where(Movimentacao.tipo_movimentacao == 'saida', Movimentacao.data_movimentacao >= inicio)
+        .group_by(Movimentacao.produto_id, dia)
+    ).all(), dtype=np.int64).reshape(-1, 2)
+
+    return calcular_demanda(
+        produto_ids, quantidades, dias_observados, saidas[:, 0], saidas[:, 1],
+        prazo_reposicao=DEMANDA_PRAZO_REPOSICAO_DIAS, fator_seguranca=DEMANDA_FATOR_SEGURANCA,
+    )
+
+
+def obter_demanda(db):
+    return cache_analises.obter(('demanda', DEMANDA_JANELA_DIAS, date.today()), lambda: carregar_demanda(db))
+
+
+LIMITE_RANKING_RUPTURA = 20
+# Além deste horizonte a data de ruptura não tem significado (e estouraria
+# `date` para estoques enormes com consumo quase nulo): fica sem previsão.
+HORIZONTE_RUPTURA_DIAS = 3650
+
+
+def listar_previsao_ruptura(db, limite=LIMITE_RANKING_RUPTURA):
+    """Produtos com ruptura prevista mais próxima, com o ponto de pedido sugerido."""
+    from analise_demanda import ranking_ruptura
+
+    demanda = obter_demanda(db)
+    indices = ranking_ruptura(demanda, limite)
+    if not len(indices):
+        return []
+    ids = demanda['produto_id'][indices].tolist()
+    produtos = {
+        linha.id: linha
+        for linha in db.execute(select(Produto.id, Produto.nome, Produto.quantidade_minima).where(Produto.id.in_(ids)))
+    }
+    hoje = date.today()
+    previsao = []
+    for indice, produto_id in zip(indices.tolist(), ids):
+        if produto_id not in produtos:
+            continue
+        cobertura = float(demanda['dias_cobertura'][indice])
+        previsao.append({
+            'produto_id': produto_id,
+            'nome': produtos[produto_id].nome,
+            'quantidade': int(demanda['quantidade'][indice]),
+            'consumo_diario': float(demanda['consumo_diario'][indice]),
+            'dias_cobertura': cobertura,
+            'data_ruptura': hoje + timedelta(days=int(cobertura)) if cobertura <= HORIZONTE_RUPTURA_DIAS else None,
+            'quantidade_minima': produtos[produto_id].quantidade_minima,
+            'ponto_pedido': int(demanda['ponto_pedido'][indice]),
+        })
+    return previsao
+
+
+def aplicar_pontos_pedido(db, demanda):
+    """
+    Grava o ponto de pedido sugerido como quantidade_minima dos produtos com
+    consumo na janela (os demais mantêm o valor manual) e recalcula o
+    resumo. O commit fica a cargo de quem chama. Retorna quantos mudaram.
+    """
+    tabela = Produto.__table__
+    alterar = (demanda['consumo_diario'] > 0).nonzero()[0]
+    parametros = [
+        {'produto': produto_id, 'minimo': minimo}
+        for produto_id, minimo in zip(
+            demanda['produto_id'][alterar].tolist(), demanda['ponto_pedido'][alterar].tolist()
+        )
+    ]
+    if not parametros:
+        return 0
+    # Só conta as linhas cujo mínimo de fato mudou (as demais não casam o WHERE).
+    alterados = _executar_contando(
+        db,
+        update(tabela)
+        .where(tabela.c.id == bindparam('produto'), tabela.c.quantidade_minima != bindparam('minimo'))
+        .values(quantidade_minima=bindparam('minimo'), atualizado_em=datetime.now()),
+        parametros,
+    )
+    if alterados:
+        reconstruir_totais_produtos(db)
+    return alterados
+
+
+def obter_indicadores(db):
+    """
+    Lê os indicadores do resumo materializado em tempo constante.
+    Gera o resumo na primeira chamada, caso ainda não exista.
+    """
+    resumo = db.get(ResumoEstoque, 1)
+    if resumo is None:
+        reconstruir_resumo(db)
+        db.commit()
+        resumo = db.get(ResumoEstoque, 1)
+    hoje = db.get(MovimentacaoDiaria, date.today())
+    return {
+        'total_produtos': resumo.total_produtos,
+        'valor_estoque': resumo.valor_estoque,
+        'estoque_baixo': resumo.estoque_baixo,
+        'movimentacoes_hoje': (hoje.entradas + hoje.saidas) if hoje else 0,
+    }
+
+
+def obter_indicadores_em_cache(db, armazem_id=None, versao=None):
+    # A data faz parte da chave porque "movimentações hoje" zera na virada do
+    # dia; `versao`, como em `paginar_produtos_em_cache`, prende o valor ao ETag.
+    if armazem_id:
+        return cache_consultas.obter(
+            ('indicadores', date.today(), armazem_id, versao), lambda: calcular_indicadores_armazem(db, armazem_id),
+        )
+    return cache_consultas.obter(('indicadores', date.today(), versao), lambda: obter_indicadores(db))
+
+
+def obter_totais_armazens_em_cache(db, versao=None):
+    """
+    Totais de cada armazém e o consolidado. No consolidado, produtos e
+    estoque baixo contam cada produto uma vez (pelo seu total, como no
+    resumo), e não uma vez por armazém em que ele tem saldo.
+    """
+    armazens = cache_consultas.obter(
+        ('indicadores', date.today(), 'armazens', versao), lambda: calcular_totais_armazens(db),
+    )
+    consolidado = dict(
+        obter_indicadores_em_cache(db, versao=versao), unidades=sum(armazem['unidades'] for armazem in armazens),
+    )
+    return armazens, consolidado
+
+
+def obter_versao_dados(db):
+    """
+    Identificador barato do estado atual dos dados: contador global de
+    alterações e instante da última alteração, lidos da linha do resumo.
+    """
+    resumo = db.execute(select(ResumoEstoque.versao, ResumoEstoque.atualizado_em).where(ResumoEstoque.id == 1)).first()
+    if resumo is None:
+        obter_indicadores(db)
+        resumo = db.execute(select(ResumoEstoque.versao, ResumoEstoque.atualizado_em).where(ResumoEstoque.id == 1)).first()
+    return f'{resumo.versao}.{resumo.atualizado_em.timestamp():.6f}'
+
+
+@principal.cli.group()
+def banco():
+    """Manutenção do schema do banco de dados."""
+
+
+@banco.command('migrar')
+def banco_migrar():
+    """Aplica as migrações pendentes ao banco configurado."""
+    novas = migrar_banco(obter_engine())
+    if novas:
+        click.echo(f'Migrações aplicadas: {", ".join(str(versao) for versao in novas)}')
+    else:
+        click.echo('Banco já está atualizado.')
+
+
+@banco.command('status')
+def banco_status():
+    """Lista as migrações e indica quais já foram aplicadas."""
+    with obter_engine().connect() as conexao:
+        aplicadas = set(conexao.execute(select(VersaoSchema.versao)).scalars())
+    for versao, descricao, _ in MIGRACOES:
+        click.echo(f'[{"x" if versao in aplicadas else " "}] {versao:03d} {descricao}')
+
+
+@principal.cli.group()
+def produtos():
+    """Operações em massa sobre o catálogo de produtos."""
+
+
+@produtos.command('importar')
+@click.argument('arquivo', type=click.Path(exists=True, dir_okay=False))
+@click.option('--formato', type=click.Choice(['csv', 'jsonl']), help='Padrão: deduzido pela extensão.')
+@click.option('--lote', default=TAMANHO_LOTE_IMPORTACAO, show_default=True, help='Linhas gravadas por transação.')
+def produtos_importar(arquivo, formato, lote):
+    """Importa produtos de um arquivo CSV ou JSONL sem carregá-lo na memória."""
+    formato = formato or ('jsonl' if arquivo.lower().endswith(('.jsonl', '.ndjson')) else 'csv')
+    db = SessionLocal()
+    try:
+        with open(arquivo, encoding='utf-8-sig', newline='') as fluxo:
+            relatorio = importar_produtos(db, _abrir_linhas_importacao(fluxo, formato), tamanho_lote=lote)
+    finally:
+        db.close()
+
+    for numero, mensagem in relatorio['erros']:
+        click.echo(f'Linha {numero}: {mensagem}', err=True)
+    click.echo(
+        f"{relatorio['importadas']} produtos importados de {relatorio['processadas']} linhas; "
+        f"{relatorio['total_erros']} com erro."
+    )
+
+
+@principal.cli.group()
+def exportar():
+    """Exportação do catálogo e do histórico para ferramentas externas."""
+
+
+def _escrever_exportacao(blocos, saida):
+    with click.open_file(saida, 'w', encoding='utf-8') as arquivo:
+        for bloco in blocos:
+            arquivo.write(bloco)
+
+
+@exportar.command('produtos')
+@click.option('--formato', type=click.Choice(['csv', 'jsonl']), default='csv', show_default=True)
+@click.option('--saida', default='-', help='Arquivo de destino (padrão: saída padrão).')
+def exportar_produtos(formato, saida):
+    """Exporta o catálogo de produtos."""
+    _escrever_exportacao(gerar_exportacao(consulta_exportacao_produtos(), formato), saida)
+
+
+@exportar.command('movimentacoes')
+@click.option('--formato', type=click.Choice(['csv', 'jsonl']), default='csv', show_default=True)
+@click.option('--saida', default='-', help='Arquivo de destino (padrão: saída padrão).')
+@click.option('--inicio', type=click.DateTime(['%Y-%m-%d']), help='Data inicial (inclusiva).')
+@click.option('--fim', type=click.DateTime(['%Y-%m-%d']), help='Data final (inclusiva).')
+@click.option('--produto', 'produto_id', type=int, help='Exporta só as movimentações deste produto.')
+@click.option('--armazem', 'armazem_id', type=int, help='Exporta só as movimentações deste armazém.')
+def exportar_movimentacoes(formato, saida, inicio, fim, produto_id, armazem_id):
+    """Exporta o histórico de movimentações."""
+    consulta = consulta_exportacao_movimentacoes(
+        inicio.date() if inicio else None, fim.date() if fim else None, produto_id, armazem_id
+    )
+    _escrever_exportacao(gerar_exportacao(consulta, formato), saida)
+
+
+@principal.cli.group()
+def resumo():
+    """Manutenção do resumo materializado do estoque."""
+
+
+@resumo.command('reconstruir')
+def resumo_reconstruir():
+    """Recalcula o resumo a partir das tabelas de produtos e movimentações."""
+    db = SessionLocal()
+    try:
+        reconstruir_resumo(db)
+        db.commit()
+    finally:
+        db.close()
+    click.echo('Resumo reconstruído com sucesso.')
+
+
+@resumo.command('verificar')
+@click.option('--corrigir', is_flag=True, help='Reconstrói o resumo se houver divergências.')
+def resumo_verificar(corrigir):
+    """Compara o resumo com as tabelas de origem."""
+    db = SessionLocal()
+    try:
+        divergencias = verificar_resumo(db)
+        for divergencia in divergencias:
+            click.echo(f'DIVERGÊNCIA: {divergencia}')
+        if divergencias and corrigir:
+            reconstruir_resumo(db)
+            db.commit()
+            click.echo('Resumo reconstruído.')
+    finally:
+        db.close()
+    if not divergencias:
+        click.echo('Resumo consistente.')
+    elif not corrigir:
+        raise SystemExit(1)
+
+
+@principal.cli.group()
+def arquivo():
+    """Arquivamento de movimentações antigas."""
+
+
+@arquivo.command('executar')
+@click.option('--horizonte-dias', default=ARQUIVO_HORIZONTE_DIAS, show_default=True,
+              help='Mantém na tabela as movimentações mais novas que isso (arredondado para o início do mês).')
+@click.option('--diretorio', default=ARQUIVO_DIRETORIO, show_default=True, help='Destino dos arquivos compactados.')
+@click.option('--lote', default=TAMANHO_LOTE_ARQUIVO, show_default=True, help='Movimentações por transação.')
+@click.option('--pausa', default=0.0, show_default=True, help='Segundos entre lotes, para aliviar o banco.')
+def arquivo_executar(horizonte_dias, diretorio, lote, pausa):
+    """Arquiva em lotes curtos as movimentações anteriores ao horizonte."""
+    corte = calcular_corte_arquivo(horizonte_dias)
+    total = 0
+    db = SessionLocal()
+    try:
+        while True:
+            arquivadas = arquivar_lote(db, corte, diretorio, lote)
+            if not arquivadas:
+                break
+            total += arquivadas
+            if pausa:
+                time.sleep(pausa)
+    finally:
+        db.close()
+    click.echo(f'{total} movimentações anteriores a {corte:%d/%m/%Y} arquivadas em {diretorio}.')
+
+
+@arquivo.command('status')
+def arquivo_status():
+    """Lista os meses arquivados."""
+    db = SessionLocal()
+    try:
+        meses = db.execute(
+            select(ArquivoMovimentacoes.mes, func.count(), func.sum(ArquivoMovimentacoes.linhas))
+            .group_by(ArquivoMovimentacoes.mes)
+            .order_by(ArquivoMovimentacoes.mes)
+        ).all()
+    finally:
+        db.close()
+    for mes, arquivos, linhas in meses:
+        click.echo(f'{mes:%Y-%m}: {linhas} movimentações em {arquivos} arquivo(s)')
+    if not meses:
+        click.echo('Nenhuma movimentação arquivada.')
+
+
+@principal.cli.group()
+def snapshot():
+    """Fotografias periódicas do estoque para consultas históricas."""
+
+
+@snapshot.command('registrar')
+def snapshot_registrar():
+    """Grava o estoque atual de todos os produtos (agende, por exemplo, diariamente)."""
+    db = SessionLocal()
+    try:
+        snapshot_id = registrar_snapshot(db)
+    finally:
+        db.close()
+    click.echo(f'Snapshot {snapshot_id} registrado.')
+
+
+@principal.cli.group()
+def demanda():
+    """Análise de demanda e pontos de pedido."""
+
+
+@demanda.command('sugerir')
+@click.option('--aplicar', is_flag=True, help='Grava os pontos sugeridos como estoque mínimo.')
+@click.option('--limite', default=LIMITE_RANKING_RUPTURA, show_default=True, help='Produtos listados.')
+def demanda_sugerir(aplicar, limite):
+    """Lista as rupturas mais próximas e, opcionalmente, atualiza os estoques mínimos."""
+    from analise_demanda import ranking_ruptura
+
+    db = SessionLocal()
+    try:
+        inicio = time.perf_counter()
+        resultado = carregar_demanda(db)
+        click.echo(f'{len(resultado["produto_id"])} produtos analisados em {time.perf_counter() - inicio:.2f}s.')
+        indices = ranking_ruptura(resultado, limite)
+        for indice in indices.tolist():
+            click.echo(
+                f'#{resultado["produto_id"][indice]}: {resultado["dias_cobertura"][indice]:.1f} dias de cobertura, '
+                f'consumo {resultado["consumo_diario"][indice]:.2f}/dia, ponto de pedido {resultado["ponto_pedido"][indice]}'
+            )
+        if aplicar:
+            alterados = aplicar_pontos_pedido(db, resultado)
+            db.commit()
+            click.echo(f'Estoque mínimo recalculado para {alterados} produtos com consumo.')
     finally:
         db.close()
 
 
+@principal.cli.group()
+def alertas():
+    """Fila de alertas de estoque baixo."""
 
 
+@alertas.command('processar')
+@click.option('--continuo', is_flag=True, help='Continua drenando a fila a cada intervalo.')
+@click.option('--intervalo', default=30, show_default=True, help='Segundos entre rodadas no modo contínuo.')
+def alertas_processar(continuo, intervalo):
+    """Entrega os alertas pendentes pelo transporte configurado."""
+    transporte = criar_transporte(ALERTA_TRANSPORTE, ALERTA_DESTINATARIOS, ALERTA_REMETENTE)
+    while True:
+        total_enviados = total_duplicados = 0
+        db = SessionLocal()
+        try:
+            while True:
+                enviados, duplicados = processar_alertas(db, transporte)
+                if not enviados and not duplicados:
+                    break
+                total_enviados += enviados
+                total_duplicados += duplicados
+        finally:
+            db.close()
+        if total_enviados or total_duplicados or not continuo:
+            click.echo(f'{total_enviados} alerta(s) enviado(s), {total_duplicados} duplicado(s) descartado(s).')
+        if not continuo:
+            break
+        time.sleep(intervalo)
 
 
-def enviar_notificacao_estoque_baixo(produto):
+def precompilar_templates(app):
     """
-    Simula o envio de e-mail para o administrador quando o estoque está baixo.
-    Esta função seria chamada por um agendador ou job assíncrono.
+    Compila todos os templates de uma vez, para que a primeira requisição de
+    cada página não pague a compilação. O cache do Jinja mantém o resultado.
     """
-    if produto.quantidade <= produto.quantidade_minima:
-        print(f"ALERTA [EMAIL]: O produto '{produto.nome}' está com estoque CRÍTICO!")
-        print(f"Estoque Atual: {produto.quantidade} | Mínimo: {produto.quantidade_minima}")
-        # Simulação de envio SMTP
-        # server = smtplib.SMTP('smtp.gmail.com', 587)
-        # server.sendmail(...)
-        return True
-    return False
+    for nome in app.jinja_env.list_templates(extensions=['html']):
+        app.jinja_env.get_template(nome)
+
+
+def obter_permissao(usuario_id):
+    """
+    Registro de permissão do usuário (ativo, eh_administrador,
+    versao_permissao), ou None se ele não existe, através do cache.
+    """
+    def carregar():
+        db = SessionLocal()
+        try:
+            return db.execute(
+                select(Usuario.ativo, Usuario.eh_administrador, Usuario.versao_permissao)
+                .where(Usuario.id == usuario_id)
+            ).first()
+        finally:
+            db.close()
+
+    return cache_consultas.obter(('permissao', usuario_id), carregar)
+
+
+def alterar_permissoes(db, usuario_id, **valores):
+    """
+    Altera `eh_administrador` e/ou `ativo` e incrementa `versao_permissao`
+    no mesmo UPDATE. Retorna False se o usuário não existe. Depois do
+    commit, chame `invalidar_permissao` para que a mudança valha já.
+    """
+    comando = (
+        update(Usuario)
+        .where(Usuario.id == usuario_id)
+        .values(versao_permissao=Usuario.versao_permissao + 1, **valores)
+        .returning(Usuario.id)
+    )
+    return db.execute(comando).first() is not None
+
+
+def invalidar_permissao(usuario_id):
+    cache_consultas.invalidar(('permissao', usuario_id))
+
+
+def verificar_sessao():
+    """
+    Confere a sessão contra o registro de permissão em memória.
+    Encerra a sessão de usuários removidos ou desativados e, se a versão
+    mudou desde o login, atualiza `is_admin` na sessão.
+    Retorna o registro, ou None se o acesso foi revogado.
+    """
+    permissao = obter_permissao(session['user_id'])
+    if permissao is None or not permissao.ativo:
+        session.clear()
+        return None
+    if session.get('versao_permissao') != permissao.versao_permissao:
+        session['is_admin'] = permissao.eh_administrador
+        session['versao_permissao'] = permissao.versao_permissao
+    return permissao
 
 
 def login_required(f):
     def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
+        if 'user_id' not in session or verificar_sessao() is None:
             flash('Você precisa fazer login para acessar esta página.', 'error')
-            return redirect(url_for('login'))
+            return redirect(url_for('principal.login'))
+        return f(*args, **kwargs)
+
+    decorated_function.__name__ = f.__name__
+    return decorated_function
+
+
+def api_login_required(f):
+    """Como `login_required`, mas responde 401 em JSON em vez de redirecionar."""
+    def decorated_function(*args, **kwargs):
+        if 'user_id' not in session or verificar_sessao() is None:
+            return jsonify({'erro': 'Autenticação necessária.'}), 401
         return f(*args, **kwargs)
 
     decorated_function.__name__ = f.__name__
@@ -115,107 +2625,212 @@ def admin_required(f):
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
             flash('Acesso negado.', 'error')
-            return redirect(url_for('login'))
+            return redirect(url_for('principal.login'))
 
-        db = SessionLocal()
-        try:
-            user = db.query(Usuario).filter(Usuario.id == session['user_id']).first()
-            if not user or not user.eh_administrador:
-                flash('Acesso restrito para administradores.', 'error')
-                return redirect(url_for('dashboard'))
-        finally:
-            db.close()
+        permissao = verificar_sessao()
+        if permissao is None:
+            flash('Acesso negado.', 'error')
+            return redirect(url_for('principal.login'))
+        if not permissao.eh_administrador:
+            flash('Acesso restrito para administradores.', 'error')
+            return redirect(url_for('principal.dashboard'))
         return f(*args, **kwargs)
 
     decorated_function.__name__ = f.__name__
     return decorated_function
 
 
-def get_base_template(content, active_page=''):
-    return f'''
-<!DOCTYPE html>
-<html lang="pt-BR">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>LogiFlow</title>
-    <style>
-        * {{ margin: 0; padding: 0; box-sizing: border-box; }}
-        body {{ font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; background: #f8f9fa; }}
-        .container {{ max-width: 1200px; margin: 0 auto; padding: 20px; }}
-        .header {{ background: #fff; padding: 20px; border-radius: 8px; margin-bottom: 20px; 
-                 box-shadow: 0 2px 4px rgba(0,0,0,0.1); display: flex; justify-content: space-between; align-items: center; }}
-        .nav {{ display: flex; gap: 15px; margin: 20px 0; }}
-        .nav a {{ background: #007bff; color: white; padding: 12px 20px; text-decoration: none; 
-                border-radius: 6px; transition: background 0.3s; }}
-        .nav a:hover {{ background: #0056b3; }}
-        .nav a.active {{ background: #28a745; }}
-        .card {{ background: white; padding: 25px; border-radius: 8px; margin: 15px 0; 
-               box-shadow: 0 2px 4px rgba(0,0,0,0.1); }}
-        .btn {{ display: inline-block; padding: 10px 20px; margin: 5px; text-decoration: none; 
-              border-radius: 5px; cursor: pointer; border: none; font-size: 14px; }}
-        .btn-primary {{ background: #007bff; color: white; }}
-        .btn-success {{ background: #28a745; color: white; }}
-        .btn-warning {{ background: #ffc107; color: #212529; }}
-        .btn-danger {{ background: #dc3545; color: white; }}
-        .btn:hover {{ opacity: 0.9; }}
-        table {{ width: 100%; border-collapse: collapse; margin-top: 15px; }}
-        th, td {{ padding: 12px; text-align: left; border-bottom: 1px solid #dee2e6; }}
-        th {{ background: #f8f9fa; font-weight: 600; }}
-        tr:hover {{ background: #f8f9fa; }}
-        .form-group {{ margin: 15px 0; }}
-        .form-group label {{ display: block; margin-bottom: 5px; font-weight: 600; }}
-        .form-group input, .form-group select {{ width: 100%; padding: 10px; border: 1px solid #ced4da; 
-                                               border-radius: 4px; font-size: 14px; }}
-        .alert {{ padding: 12px; margin: 15px 0; border-radius: 4px; }}
-        .alert-success {{ background: #d4edda; color: #155724; border: 1px solid #c3e6cb; }}
-        .alert-error {{ background: #f8d7da; color: #721c24; border: 1px solid #f5c6cb; }}
-        .alert-warning {{ background: #fff3cd; color: #856404; border: 1px solid #ffeaa7; }}
-        .estoque-baixo {{ background: #fff3cd !important; }}
-        .stats-grid {{ display: grid; grid-template-columns: repeat(auto-fit, minmax(200px, 1fr)); 
-                     gap: 20px; margin: 20px 0; }}
-        .stat-card {{ background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; 
-                    padding: 20px; border-radius: 8px; text-align: center; }}
-        .stat-number {{ font-size: 2em; font-weight: bold; margin-bottom: 5px; }}
-    </style>
-</head>
-<body>
-    <div class="container">
-        ''' + ("" if "user_id" not in session else f'''
-        <div class="header">
-            <h1>Sistema de Controle de Estoque</h1>
-            <div>
-                Usuário: <strong>{session.get("user_name", "")}</strong>
-                ''' + ('<span style="color: #28a745;">(Admin)</span>' if session.get("is_admin") else "") + f'''
-                <a href="{url_for("logout")}" class="btn btn-danger">Sair</a>
-            </div>
-        </div>
-
-        <div class="nav">
-            <a href="{url_for("dashboard")}" ''' + ('class="active"' if active_page == "dashboard" else "") + f'''>Produtos</a>
-            <a href="{url_for("movimentacoes")}" ''' + ('class="active"' if active_page == "movimentacoes" else "") + f'''>Movimentações</a>
-            ''' + (f'<a href="{url_for("usuarios")}" ' + ('class="active"' if active_page == "usuarios" else "") + '>Usuários</a>' if session.get("is_admin") else "") + f'''
-            <a href="{url_for("relatorio")}" ''' + ('class="active"' if active_page == "relatorio" else "") + f'''>Relatórios</a>
-        </div>
-        ''') + '''
-
-        ''' + "".join([f'<div class="alert alert-{"error" if category == "error" else "success"}">{message}</div>' for category, message in get_flashed_messages(with_categories=True)]) + f'''
-
-        {content}
-    </div>
-</body>
-</html>
-    '''
-
-
-@app.route('/')
+@principal.before_app_request
+def iniciar_medicao():
+    limite_instrucoes = METRICAS_INSTRUCOES_LENTA if METRICAS_LENTA_MS > 0 else 0
+    g.coleta_sql, g.token_coleta = iniciar_coleta(limite_instrucoes)
+    g.inicio_requisicao = time.perf_counter()
+
+
+@principal.after_app_request
+def guardar_status(resposta):
+    g.status_resposta = resposta.status_code
+    return resposta
+
+
+@principal.teardown_app_request
+def encerrar_medicao(_erro=None):
+    """
+    Acumula a requisição nas métricas da rota e, se passou do limite,
+    registra no log as instruções SQL executadas. Roda mesmo quando a view
+    levanta exceção (nesse caso o status é 500).
+    """
+    coleta = g.pop('coleta_sql', None)
+    if coleta is None:
+        return
+    encerrar_coleta(g.pop('token_coleta'))
+    duracao = time.perf_counter() - g.pop('inicio_requisicao')
+    rota = request.endpoint or 'desconhecida'
+    registro_metricas.observar(rota, request.method, g.get('status_resposta', 500), duracao, coleta)
+
+    if METRICAS_LENTA_MS > 0 and duracao * 1000 >= METRICAS_LENTA_MS:
+        linhas = [
+            f'{request.method} {request.path} ({rota}) levou {duracao * 1000:.1f} ms; '
+            f'{coleta.consultas} instrução(ões) SQL em {coleta.tempo_sql * 1000:.1f} ms, {coleta.linhas} linha(s)'
+        ]
+        for instrucao, duracao_sql in coleta.instrucoes:
+            linhas.append(f'  {duracao_sql * 1000:8.1f} ms  {" ".join(instrucao.split())}')
+        if coleta.consultas > len(coleta.instrucoes):
+            linhas.append(f'  ... e mais {coleta.consultas - len(coleta.instrucoes)} instrução(ões)')
+        log_lentas.warning('\n'.join(linhas))
+
+
+@registro_metricas.adicionar_coletor
+def _metricas_cache():
+    amostras = []
+    for nome, cache in (('consultas', cache_consultas), ('analises', cache_analises)):
+        estatisticas = cache.estatisticas()
+        for campo in ('acertos', 'falhas', 'despejos', 'expiracoes', 'invalidacoes'):
+            amostras.append(({'cache': nome, 'evento': campo}, estatisticas[campo]))
+    return 'logiflow_cache_eventos_total', 'counter', 'Acertos, falhas e remoções dos caches de leitura.', amostras
+
+
+@registro_metricas.adicionar_coletor
+def _metricas_tamanho_cache():
+    amostras = [
+        ({'cache': nome}, cache.estatisticas()['tamanho'])
+        for nome, cache in (('consultas', cache_consultas), ('analises', cache_analises))
+    ]
+    return 'logiflow_cache_entradas', 'gauge', 'Entradas ocupadas em cada cache de leitura.', amostras
+
+
+@registro_metricas.adicionar_coletor
+def _metricas_pool_hash():
+    estatisticas = pool_hash.estatisticas()
+    return 'logiflow_hash_tarefas', 'gauge', 'Tarefas de hashing de senha admitidas no pool.', [
+        ({'estado': 'em_uso'}, estatisticas['em_uso']),
+        ({'estado': 'capacidade'}, estatisticas['capacidade']),
+    ]
+
+
+@registro_metricas.adicionar_coletor
+def _metricas_hash_rejeitadas():
+    return 'logiflow_hash_rejeitadas_total', 'counter', 'Hashings recusados com o pool saturado.', [
+        ({}, pool_hash.estatisticas()['rejeitadas']),
+    ]
+
+
+@registro_metricas.adicionar_coletor
+def _metricas_alertas_pendentes():
+    db = SessionLocal()
+    try:
+        pendentes = db.execute(
+            select(func.count()).select_from(EventoAlerta).where(EventoAlerta.situacao == 'pendente')
+        ).scalar()
+    finally:
+        db.close()
+    return 'logiflow_alertas_pendentes', 'gauge', 'Alertas de estoque baixo aguardando o worker.', [({}, pendentes)]
+
+
+@registro_metricas.adicionar_coletor
+def _metricas_eventos_assinantes():
+    return 'logiflow_eventos_assinantes', 'gauge', 'Conexões abertas do dashboard ao vivo.', [
+        ({}, central_eventos.estatisticas()['assinantes']),
+    ]
+
+
+@registro_metricas.adicionar_coletor
+def _metricas_eventos_publicados():
+    return 'logiflow_eventos_publicados_total', 'counter', 'Deltas de estoque publicados ao dashboard ao vivo.', [
+        ({}, central_eventos.estatisticas()['publicados']),
+    ]
+
+
+@principal.route('/metrics')
+def metricas():
+    """
+    Métricas deste processo no formato de exposição do Prometheus. Com
+    LOGIFLOW_METRICAS_TOKEN, exige `Authorization: Bearer <token>`; sem ele,
+    uma sessão de administrador.
+    """
+    if METRICAS_TOKEN:
+        esperado = f'Bearer {METRICAS_TOKEN}'.encode()
+        if not hmac.compare_digest(request.headers.get('Authorization', '').encode(), esperado):
+            return Response('Token inválido.\n', 401, {'WWW-Authenticate': 'Bearer'}, mimetype='text/plain')
+    else:
+        permissao = verificar_sessao() if 'user_id' in session else None
+        if permissao is None or not permissao.eh_administrador:
+            return Response('Acesso restrito para administradores.\n', 403, mimetype='text/plain')
+    return Response(registro_metricas.exportar(), mimetype='text/plain; version=0.0.4')
+
+
+def _evento_sse(deltas):
+    return f"event: estoque\ndata: {json.dumps(deltas, separators=(',', ':'))}\n\n"
+
+
+@principal.route('/eventos/estoque')
+@api_login_required
+def eventos_estoque():
+    """
+    Fluxo Server-Sent Events com os deltas de estoque dos produtos em `?ids=`
+    (os da página aberta). Começa com o estado atual desses produtos, para
+    cobrir o que mudou entre o carregamento da página e a conexão (ou uma
+    reconexão), e termina após LOGIFLOW_EVENTOS_DURACAO_SEGUNDOS; o
+    navegador reconecta sozinho.
+    """
+    produto_ids = []
+    for valor in request.args.get('ids', '').split(','):
+        if valor.strip().isdigit():
+            produto_ids.append(int(valor))
+    produto_ids = produto_ids[:TAMANHO_PAGINA_MAXIMO]
+
+    try:
+        assinatura = central_eventos.assinar(produto_ids)
+    except LimiteAssinantes:
+        resposta = jsonify({'erro': 'Muitas conexões de eventos abertas.'})
+        resposta.status_code = 503
+        resposta.headers['Retry-After'] = str(EVENTOS_PING_SEGUNDOS)
+        return resposta
+
+    # Lido depois de assinar: nada publicado entre a leitura e a assinatura se perde.
+    db = SessionLocal()
+    try:
+        atuais = [
+            delta_estoque(linha.id, linha.quantidade, linha.quantidade_minima)
+            for linha in db.execute(
+                select(Produto.id, Produto.quantidade, Produto.quantidade_minima).where(Produto.id.in_(produto_ids))
+            )
+        ] if produto_ids else []
+    except Exception:
+        central_eventos.cancelar(assinatura)
+        raise
+    finally:
+        db.close()
+
+    def fluxo():
+        yield f'retry: {int(EVENTOS_INTERVALO_SEGUNDOS * 1000)}\n\n'
+        yield _evento_sse(atuais)
+        fim = time.monotonic() + EVENTOS_DURACAO_SEGUNDOS
+        while True:
+            restante = fim - time.monotonic()
+            if restante <= 0:
+                return
+            deltas = assinatura.aguardar(min(EVENTOS_PING_SEGUNDOS, restante))
+            yield _evento_sse(deltas) if deltas else ': ping\n\n'
+
+    resposta = Response(fluxo(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+    # O servidor fecha a resposta no fim do fluxo e quando o cliente desconecta
+    # (a escrita seguinte, no máximo um ping depois, falha).
+    resposta.call_on_close(lambda: central_eventos.cancelar(assinatura))
+    return resposta
+
+
+@principal.route('/')
 def index():
     if 'user_id' in session:
-        return redirect(url_for('dashboard'))
-    return redirect(url_for('login'))
+        return redirect(url_for('principal.dashboard'))
+    return redirect(url_for('principal.login'))
 
 
-@app.route('/login', methods=['GET', 'POST'])
+@principal.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         email = request.form['email'].strip()
@@ -227,174 +2842,131 @@ def login():
             db = SessionLocal()
             try:
                 user = db.query(Usuario).filter(Usuario.email == email, Usuario.ativo == True).first()
-                if user and verify_password(senha, user.senha_hash):
+                valida, novo_hash = verify_and_update_password(senha, user.senha_hash) if user else (False, None)
+                if valida:
+                    if novo_hash:
+                        user.senha_hash = novo_hash
+                        db.commit()
                     session['user_id'] = user.id
                     session['user_name'] = user.nome
                     session['is_admin'] = user.eh_administrador
+                    session['versao_permissao'] = user.versao_permissao
                     flash('Login realizado com sucesso!', 'success')
-                    return redirect(url_for('dashboard'))
+                    return redirect(url_for('principal.dashboard'))
                 else:
                     flash('Email ou senha incorretos.', 'error')
+            except PoolSaturado as erro:
+                return resposta_pool_saturado(erro, 'login.html')
             finally:
                 db.close()
 
-    content = '''
-    <div class="card" style="max-width: 400px; margin: 100px auto;">
-        <h2 style="text-align: center; margin-bottom: 30px; color: #333;">Login no Sistema</h2>
-        <form method="POST">
-            <div class="form-group">
-                <label>Email:</label>
-                <input type="email" name="email" required>
-            </div>
-            <div class="form-group">
-                <label>Senha:</label>
-                <input type="password" name="senha" required>
-            </div>
-            <button type="submit" class="btn btn-primary" style="width: 100%;">Entrar</button>
-        </form>
-        <div style="text-align: center; margin-top: 20px; color: #666; font-size: 12px;">
-            Credenciais padrão: admin@sistema.com / admin123
-        </div>
-    </div>
-    '''
-
-    return render_template_string(get_base_template(content))
-
-
-@app.route('/logout')
+    return render_template('login.html')
+
+
+@principal.route('/logout')
 def logout():
     session.clear()
     flash('Logout realizado com sucesso!', 'success')
-    return redirect(url_for('login'))
+    return redirect(url_for('principal.login'))
 
 
-@app.route('/dashboard')
+@principal.route('/dashboard')
 @login_required
 def dashboard():
+    filtros = ler_filtros_produtos(request.args)
+    apos = ler_cursor_id(request.args)
+    limite = ler_tamanho_pagina(request.args)
+
     db = SessionLocal()
     try:
-        produtos = db.query(Produto).all()
+        indicadores = obter_indicadores_em_cache(db, filtros['armazem'])
+        produtos, proximo_cursor = paginar_produtos_em_cache(db, filtros, apos=apos, limite=limite)
+        armazens = listar_armazens(db)
     finally:
         db.close()
 
-    produtos_html = ''.join([f'''
-        <tr {'class="estoque-baixo"' if produto.quantidade <= produto.quantidade_minima else ""}>
-            <td>{produto.id}</td>
-            <td>{produto.nome}</td>
-            <td>R$ {produto.preco:.2f}</td>
-            <td>{produto.quantidade}</td>
-            <td>{produto.quantidade_minima}</td>
-            <td>
-                {'<span style="color: #856404; font-weight: bold;">BAIXO</span>' if produto.quantidade <= produto.quantidade_minima else '<span style="color: #28a745; font-weight: bold;">OK</span>'}
-            </td>
-            <td>
-                <a href="{url_for("entrada_estoque", produto_id=produto.id)}" class="btn btn-success">Entrada</a>
-                <a href="{url_for("saida_estoque", produto_id=produto.id)}" class="btn btn-warning">Saída</a>
-                {f'<a href="{url_for("produto_editar", produto_id=produto.id)}" class="btn btn-primary">Editar</a>' if session.get("is_admin") else ""}
-            </td>
-        </tr>
-    ''' for produto in produtos])
-
-    content = f'''
-    <div class="card">
-        <div style="display: flex; justify-content: space-between; align-items: center; margin-bottom: 20px;">
-            <h2>Gerenciar Produtos</h2>
-            <a href="{url_for('produto_novo')}" class="btn btn-primary">Novo Produto</a>
-        </div>
-
-        <table>
-            <thead>
-                <tr>
-                    <th>ID</th><th>Nome</th><th>Preço</th><th>Estoque</th><th>Mín.</th><th>Status</th><th>Ações</th>
-                </tr>
-            </thead>
-            <tbody>
-                {produtos_html}
-            </tbody>
-        </table>
-    </div>
-    '''
-
-    return render_template_string(get_base_template(content, 'dashboard'))
-
-
-@app.route('/produto/novo', methods=['GET', 'POST'])
+    # Os links de paginação preservam os filtros ativos.
+    parametros = {chave: valor for chave, valor in filtros.items() if valor not in (None, False, '')}
+    if filtros['baixo']:
+        parametros['baixo'] = 1
+    if limite != TAMANHO_PAGINA_PADRAO:
+        parametros['limite'] = limite
+
+    return render_template(
+        'dashboard.html',
+        pagina_ativa='dashboard',
+        produtos=produtos,
+        indicadores=indicadores,
+        armazens=armazens,
+        filtros=filtros,
+        parametros=parametros,
+        limite=limite,
+        tamanho_pagina_maximo=TAMANHO_PAGINA_MAXIMO,
+        apos=apos,
+        proximo_cursor=proximo_cursor,
+    )
+
+
+@principal.route('/produto/novo', methods=['GET', 'POST'])
 @login_required
 def produto_novo():
     if request.method == 'POST':
-        nome = request.form['nome'].strip()
-        preco = request.form['preco']
-        quantidade = request.form['quantidade']
-        quantidade_minima = request.form.get('quantidade_minima', 5)
+        dados, erro = validar_produto(
+            request.form['nome'],
+            request.form['preco'],
+            request.form['quantidade'],
+            request.form.get('quantidade_minima', 5),
+        )
+
+        if erro:
+            flash(erro, 'error')
+        else:
+            db = SessionLocal()
+            try:
+                produto = Produto(**dados)
+                db.add(produto)
+                atualizar_resumo(db, depois=(dados['preco'], dados['quantidade'], dados['quantidade_minima']))
+                db.commit()
+                invalidar_cache_produtos(produto.id)
+                flash('Produto cadastrado com sucesso!', 'success')
+                return redirect(url_for('principal.dashboard'))
+            finally:
+                db.close()
+
+    return render_template('produto_novo.html', pagina_ativa='dashboard')
 
-        if not nome:
-            flash('Nome do produto é obrigatório.', 'error')
+
+@principal.route('/produtos/importar', methods=['GET', 'POST'])
+@admin_required
+def produtos_importar_arquivo():
+    relatorio = None
+    if request.method == 'POST':
+        arquivo = request.files.get('arquivo')
+        if not arquivo or not arquivo.filename:
+            flash('Selecione um arquivo CSV ou JSONL.', 'error')
         else:
+            formato = 'jsonl' if arquivo.filename.lower().endswith(('.jsonl', '.ndjson')) else 'csv'
+            fluxo = io.TextIOWrapper(arquivo.stream, encoding='utf-8-sig', newline='')
+            db = SessionLocal()
             try:
-                preco = float(preco)
-                quantidade = int(quantidade)
-                quantidade_minima = int(quantidade_minima)
+                relatorio = importar_produtos(db, _abrir_linhas_importacao(fluxo, formato))
+            finally:
+                db.close()
+                cache_consultas.limpar()
+            flash(f"{relatorio['importadas']} produtos importados de {relatorio['processadas']} linhas.", 'success')
 
-                if preco < 0 or quantidade < 0 or quantidade_minima < 0:
-                    flash('Valores não podem ser negativos.', 'error')
-                else:
-                    db = SessionLocal()
-                    try:
-                        produto = Produto(
-                            nome=nome,
-                            preco=preco,
-                            quantidade=quantidade,
-                            quantidade_minima=quantidade_minima
-                        )
-                        db.add(produto)
-                        db.commit()
-                        flash('Produto cadastrado com sucesso!', 'success')
-                        return redirect(url_for('dashboard'))
-                    finally:
-                        db.close()
-            except ValueError:
-                flash('Por favor, insira valores válidos.', 'error')
-
-    content = f'''
-    <div class="card">
-        <h2>Cadastrar Novo Produto</h2>
-        <form method="POST">
-            <div class="form-group">
-                <label>Nome do Produto *:</label>
-                <input type="text" name="nome" required>
-            </div>
-            <div class="form-group">
-                <label>Preço (R$) *:</label>
-                <input type="number" step="0.01" name="preco" min="0" required>
-            </div>
-            <div class="form-group">
-                <label>Quantidade Inicial *:</label>
-                <input type="number" name="quantidade" min="0" required>
-            </div>
-            <div class="form-group">
-                <label>Quantidade Mínima:</label>
-                <input type="number" name="quantidade_minima" value="5" min="0">
-            </div>
-            <div style="margin-top: 20px;">
-                <button type="submit" class="btn btn-success">Cadastrar</button>
-                <a href="{url_for('dashboard')}" class="btn btn-danger">Cancelar</a>
-            </div>
-        </form>
-    </div>
-    '''
-
-    return render_template_string(get_base_template(content, 'dashboard'))
-
-
-@app.route('/produto/editar/<int:produto_id>', methods=['GET', 'POST'])
+    return render_template('produtos_importar.html', pagina_ativa='dashboard', relatorio=relatorio)
+
+
+@principal.route('/produto/editar/<int:produto_id>', methods=['GET', 'POST'])
 @admin_required
 def produto_editar(produto_id):
     db = SessionLocal()
     try:
-        produto = db.query(Produto).filter(Produto.id == produto_id).first()
+        produto = buscar_produto(db, produto_id)
         if not produto:
             flash('Produto não encontrado.', 'error')
-            return redirect(url_for('dashboard'))
+            return redirect(url_for('principal.dashboard'))
 
         if request.method == 'POST':
             nome = request.form['nome'].strip()
@@ -411,58 +2983,46 @@ def produto_editar(produto_id):
                     if preco < 0 or quantidade_minima < 0:
                         flash('Valores não podem ser negativos.', 'error')
                     else:
-                        produto.nome = nome
-                        produto.preco = preco
-                        produto.quantidade_minima = quantidade_minima
-                        produto.atualizado_em = datetime.now()
+                        # A escrita parte do estado atual no banco, não da cópia em cache.
+                        atual = db.get(Produto, produto_id)
+                        antes = (atual.preco, atual.quantidade, atual.quantidade_minima)
+                        atual.nome = nome
+                        atual.preco = preco
+                        atual.quantidade_minima = quantidade_minima
+                        atual.atualizado_em = datetime.now()
+                        atualizar_resumo(db, antes, (atual.preco, atual.quantidade, atual.quantidade_minima))
                         db.commit()
+                        invalidar_cache_produtos(produto_id)
+                        publicar_estoque([atual])
                         flash('Produto atualizado com sucesso!', 'success')
-                        return redirect(url_for('dashboard'))
+                        return redirect(url_for('principal.dashboard'))
                 except ValueError:
                     flash('Por favor, insira valores válidos.', 'error')
     finally:
         db.close()
 
-    content = f'''
-    <div class="card">
-        <h2>Editar Produto</h2>
-        <form method="POST">
-            <div class="form-group">
-                <label>Nome do Produto:</label>
-                <input type="text" name="nome" value="{produto.nome}" required>
-            </div>
-            <div class="form-group">
-                <label>Preço (R$):</label>
-                <input type="number" step="0.01" name="preco" value="{produto.preco}" min="0" required>
-            </div>
-            <div class="form-group">
-                <label>Estoque Atual (somente leitura):</label>
-                <input type="number" value="{produto.quantidade}" disabled>
-            </div>
-            <div class="form-group">
-                <label>Quantidade Mínima:</label>
-                <input type="number" name="quantidade_minima" value="{produto.quantidade_minima}" min="0">
-            </div>
-            <div style="margin-top: 20px;">
-                <button type="submit" class="btn btn-success">Salvar</button>
-                <a href="{url_for('dashboard')}" class="btn btn-danger">Cancelar</a>
-            </div>
-        </form>
-    </div>
-    '''
-
-    return render_template_string(get_base_template(content, 'dashboard'))
-
-
-@app.route('/entrada/<int:produto_id>', methods=['GET', 'POST'])
+    return render_template('produto_editar.html', pagina_ativa='dashboard', produto=produto)
+
+
+def _ler_armazem_movimento(db):
+    """
+    Armazém de uma movimentação: campo `armazem_id` do formulário ou
+    `armazem` da URL, com o principal como padrão. None se não existe.
+    """
+    armazem_id = request.values.get('armazem_id', type=int) or request.args.get('armazem', type=int)
+    return buscar_armazem(db, armazem_id or ARMAZEM_PRINCIPAL_ID)
+
+
+@principal.route('/entrada/<int:produto_id>', methods=['GET', 'POST'])
 @login_required
 def entrada_estoque(produto_id):
     db = SessionLocal()
     try:
-        produto = db.query(Produto).filter(Produto.id == produto_id).first()
+        produto = buscar_produto(db, produto_id)
         if not produto:
             flash('Produto não encontrado.', 'error')
-            return redirect(url_for('dashboard'))
+            return redirect(url_for('principal.dashboard'))
+        armazem = _ler_armazem_movimento(db)
 
         if request.method == 'POST':
             quantidade = request.form['quantidade']
@@ -470,66 +3030,45 @@ def entrada_estoque(produto_id):
 
             try:
                 quantidade = int(quantidade)
-                if quantidade <= 0:
+                if armazem is None:
+                    flash('Armazém não encontrado.', 'error')
+                elif quantidade <= 0:
                     flash('Quantidade deve ser maior que zero.', 'error')
+                elif (atualizado := movimentar_estoque(
+                    db, produto_id, 'entrada', quantidade, session['user_id'], observacoes, armazem.id
+                )) is None:
+                    invalidar_cache_produtos(produto_id)
+                    flash('Produto não encontrado.', 'error')
+                    return redirect(url_for('principal.dashboard'))
                 else:
-                    produto.quantidade += quantidade
-                    produto.atualizado_em = datetime.now()
-
-                    mov = Movimentacao(
-                        produto_id=produto_id,
-                        usuario_id=session['user_id'],
-                        tipo_movimentacao='entrada',
-                        quantidade=quantidade,
-                        observacoes=observacoes
-                    )
-                    db.add(mov)
                     db.commit()
+                    invalidar_cache_produtos(produto_id)
+                    publicar_estoque([atualizado])
 
-                    flash(f'Entrada de {quantidade} unidades registrada com sucesso!', 'success')
-                    return redirect(url_for('dashboard'))
+                    flash(f'Entrada de {quantidade} unidades registrada com sucesso em {armazem.nome}!', 'success')
+                    return redirect(url_for('principal.dashboard'))
             except ValueError:
                 flash('Por favor, insira uma quantidade válida.', 'error')
+        saldos = saldos_por_armazem(db, produto_id)
     finally:
         db.close()
 
-    content = f'''
-    <div class="card">
-        <h2>Entrada de Estoque</h2>
-        <div class="alert alert-warning">
-            <strong>Produto:</strong> {produto.nome}<br>
-            <strong>Estoque Atual:</strong> {produto.quantidade} unidades
-        </div>
-
-        <form method="POST">
-            <div class="form-group">
-                <label>Quantidade a Adicionar *:</label>
-                <input type="number" name="quantidade" min="1" required>
-            </div>
-            <div class="form-group">
-                <label>Observações:</label>
-                <input type="text" name="observacoes" placeholder="Ex: Compra, devolução, etc.">
-            </div>
-            <div style="margin-top: 20px;">
-                <button type="submit" class="btn btn-success">Confirmar Entrada</button>
-                <a href="{url_for('dashboard')}" class="btn btn-danger">Cancelar</a>
-            </div>
-        </form>
-    </div>
-    '''
-
-    return render_template_string(get_base_template(content, 'dashboard'))
-
-
-@app.route('/saida/<int:produto_id>', methods=['GET', 'POST'])
+    return render_template(
+        'entrada.html', pagina_ativa='dashboard', produto=produto, saldos=saldos,
+        armazem_id=armazem.id if armazem else ARMAZEM_PRINCIPAL_ID,
+    )
+
+
+@principal.route('/saida/<int:produto_id>', methods=['GET', 'POST'])
 @login_required
 def saida_estoque(produto_id):
     db = SessionLocal()
     try:
-        produto = db.query(Produto).filter(Produto.id == produto_id).first()
+        produto = buscar_produto(db, produto_id)
         if not produto:
             flash('Produto não encontrado.', 'error')
-            return redirect(url_for('dashboard'))
+            return redirect(url_for('principal.dashboard'))
+        armazem = _ler_armazem_movimento(db)
 
         if request.method == 'POST':
             quantidade = request.form['quantidade']
@@ -537,105 +3076,353 @@ def saida_estoque(produto_id):
 
             try:
                 quantidade = int(quantidade)
-                if quantidade <= 0:
+                if armazem is None:
+                    flash('Armazém não encontrado.', 'error')
+                elif quantidade <= 0:
                     flash('Quantidade deve ser maior que zero.', 'error')
-                elif quantidade > produto.quantidade:
-                    flash('Estoque insuficiente para esta saída.', 'error')
+                elif (atualizado := movimentar_estoque(
+                    db, produto_id, 'saida', quantidade, session['user_id'], observacoes, armazem.id
+                )) is None:
+                    # Outra saída pode ter consumido o estoque desde a leitura
+                    # acima (ou o cache estava defasado): relê o saldo atual.
+                    invalidar_cache_produtos(produto_id)
+                    produto = buscar_produto(db, produto_id)
+                    if not produto:
+                        flash('Produto não encontrado.', 'error')
+                        return redirect(url_for('principal.dashboard'))
+                    flash(f'Estoque insuficiente em {armazem.nome} para esta saída.', 'error')
                 else:
-                    produto.quantidade -= quantidade
-                    produto.atualizado_em = datetime.now()
-
-                    mov = Movimentacao(
-                        produto_id=produto_id,
-                        usuario_id=session['user_id'],
-                        tipo_movimentacao='saida',
-                        quantidade=quantidade,
-                        observacoes=observacoes
-                    )
-                    db.add(mov)
                     db.commit()
+                    invalidar_cache_produtos(produto_id)
+                    publicar_estoque([atualizado])
 
-                    flash(f'Saída de {quantidade} unidades registrada com sucesso!', 'success')
-                    return redirect(url_for('dashboard'))
+                    flash(f'Saída de {quantidade} unidades registrada com sucesso em {armazem.nome}!', 'success')
+                    return redirect(url_for('principal.dashboard'))
             except ValueError:
                 flash('Por favor, insira uma quantidade válida.', 'error')
+        saldos = saldos_por_armazem(db, produto_id)
+    finally:
+        db.close()
+
+    return render_template(
+        'saida.html', pagina_ativa='dashboard', produto=produto, saldos=saldos,
+        armazem_id=armazem.id if armazem else ARMAZEM_PRINCIPAL_ID,
+    )
+
+
+@principal.route('/movimentacao/lote', methods=['GET', 'POST'])
+@login_required
+def movimentacao_lote():
+    """
+    Entradas e saídas de vários produtos de um armazém em uma única
+    transação (formulário ou JSON, com `armazem_id` opcional).
+    """
+    texto_itens = ''
+    armazem_id = request.args.get('armazem', ARMAZEM_PRINCIPAL_ID, type=int)
+    if request.method == 'POST':
+        if request.is_json:
+            dados = request.get_json(silent=True)
+            if not isinstance(dados, dict):
+                return jsonify({'erros': ['O corpo deve ser um objeto JSON com a lista "itens".']}), 422
+            itens = dados.get('itens') if isinstance(dados.get('itens'), list) else []
+            try:
+                armazem_id = int(dados.get('armazem_id', ARMAZEM_PRINCIPAL_ID))
+            except (TypeError, ValueError):
+                return jsonify({'erros': ['armazem_id deve ser o número inteiro de um armazém.']}), 422
+        else:
+            texto_itens = request.form.get('itens', '')
+            itens = ler_itens_lote(texto_itens)
+            armazem_id = request.form.get('armazem_id', ARMAZEM_PRINCIPAL_ID, type=int)
+
+        db = SessionLocal()
+        try:
+            armazem = buscar_armazem(db, armazem_id)
+            if armazem is None:
+                movimentos, erros = [], ['Armazém não encontrado.']
+            else:
+                movimentos, erros = validar_lote(db, itens, armazem.id)
+            status = 422
+            if not erros:
+                atualizados = movimentar_estoque_em_lote(db, movimentos, session['user_id'], armazem.id)
+                if atualizados:
+                    db.commit()
+                    invalidar_cache_produtos(*_deltas_por_produto(movimentos))
+                    publicar_estoque(atualizados)
+                else:
+                    erros = ['O estoque foi alterado por outra operação durante o lote. Tente novamente.']
+                    status = 409
+        finally:
+            db.close()
+
+        if request.is_json:
+            if erros:
+                return jsonify({'erros': erros}), status
+            return jsonify({'movimentacoes': len(movimentos)})
+
+        if not erros:
+            flash(f'Lote com {len(movimentos)} movimentações registrado com sucesso!', 'success')
+            return redirect(url_for('principal.movimentacoes'))
+        for erro in erros:
+            flash(erro, 'error')
+
+    db = SessionLocal()
+    try:
+        armazens = listar_armazens(db)
     finally:
         db.close()
+    return render_template(
+        'movimentacao_lote.html', pagina_ativa='movimentacoes', texto_itens=texto_itens,
+        armazens=armazens, armazem_id=armazem_id,
+    )
 
-    content = f'''
-    <div class="card">
-        <h2>Saída de Estoque</h2>
-        <div class="alert alert-warning">
-            <strong>Produto:</strong> {produto.nome}<br>
-            <strong>Estoque Disponível:</strong> {produto.quantidade} unidades
-        </div>
-
-        <form method="POST">
-            <div class="form-group">
-                <label>Quantidade a Retirar *:</label>
-                <input type="number" name="quantidade" min="1" max="{produto.quantidade}" required>
-            </div>
-            <div class="form-group">
-                <label>Observações:</label>
-                <input type="text" name="observacoes" placeholder="Ex: Venda, uso interno, etc.">
-            </div>
-            <div style="margin-top: 20px;">
-                <button type="submit" class="btn btn-warning">Confirmar Saída</button>
-                <a href="{url_for('dashboard')}" class="btn btn-danger">Cancelar</a>
-            </div>
-        </form>
-    </div>
-    '''
-
-    return render_template_string(get_base_template(content, 'dashboard'))
-
-
-@app.route('/movimentacoes')
+
+@principal.route('/movimentacoes')
 @login_required
 def movimentacoes():
+    antes = decodificar_cursor_movimentacao(request.args.get('antes'))
+    limite = ler_tamanho_pagina(request.args)
+    armazem_id = request.args.get('armazem', type=int)
+
+    db = SessionLocal()
+    try:
+        movs, proximo_cursor = paginar_movimentacoes(db, antes=antes, limite=limite, armazem_id=armazem_id)
+        armazens = listar_armazens(db)
+    finally:
+        db.close()
+
+    parametros = {'limite': limite} if limite != TAMANHO_PAGINA_PADRAO else {}
+    if armazem_id:
+        parametros['armazem'] = armazem_id
+    return render_template(
+        'movimentacoes.html',
+        pagina_ativa='movimentacoes',
+        movs=movs,
+        armazens={armazem.id: armazem for armazem in armazens},
+        armazem_id=armazem_id,
+        parametros=parametros,
+        antes=antes,
+        proximo_cursor=proximo_cursor,
+    )
+
+
+def _resposta_exportacao(consulta, nome_arquivo):
+    formato = 'jsonl' if request.args.get('formato') == 'jsonl' else 'csv'
+    tipo = 'application/x-ndjson' if formato == 'jsonl' else 'text/csv'
+    return Response(
+        gerar_exportacao(consulta, formato),
+        mimetype=tipo,
+        headers={'Content-Disposition': f'attachment; filename={nome_arquivo}.{formato}'},
+    )
+
+
+@principal.route('/exportar/produtos')
+@login_required
+def exportar_produtos_arquivo():
+    return _resposta_exportacao(consulta_exportacao_produtos(), 'produtos')
+
+
+@principal.route('/exportar/movimentacoes')
+@login_required
+def exportar_movimentacoes_arquivo():
+    consulta = consulta_exportacao_movimentacoes(
+        _ler_data(request.args.get('inicio')),
+        _ler_data(request.args.get('fim')),
+        request.args.get('produto_id', type=int),
+        request.args.get('armazem', type=int),
+    )
+    return _resposta_exportacao(consulta, 'movimentacoes')
+
+
+def _etag_requisicao(*partes):
+    """ETag fraco a partir do estado dos dados e da query string da requisição."""
+    chave = '|'.join(str(parte) for parte in partes) + '|' + request.query_string.decode()
+    return hashlib.sha1(chave.encode()).hexdigest()
+
+
+def _resposta_condicional(etag, gerar_corpo):
+    """
+    Responde 304 sem executar `gerar_corpo` quando o cliente já tem a versão
+    atual; caso contrário, serializa o corpo e anexa o ETag.
+    """
+    if request.if_none_match.contains_weak(etag):
+        resposta = Response(status=304)
+    else:
+        resposta = jsonify(gerar_corpo())
+    resposta.set_etag(etag, weak=True)
+    resposta.headers['Cache-Control'] = 'private, no-cache'
+    return resposta
+
+
+def _produto_json(produto):
+    return {
+        'id': produto.id,
+        'nome': produto.nome,
+        'preco': produto.preco,
+        'quantidade': produto.quantidade,
+        'quantidade_minima': produto.quantidade_minima,
+        'estoque_baixo': produto.quantidade <= produto.quantidade_minima,
+        'atualizado_em': produto.atualizado_em.isoformat() if produto.atualizado_em else None,
+    }
+
+
+@principal.route('/api/v1/produtos')
+@api_login_required
+def api_produtos():
+    filtros = ler_filtros_produtos(request.args)
+    apos = ler_cursor_id(request.args)
+    limite = ler_tamanho_pagina(request.args)
+
+    db = SessionLocal()
+    try:
+        # O corpo é lido na mesma versão do ETag: escritas de outro processo
+        # não invalidam o cache deste, mas mudam a versão e portanto a chave.
+        versao = obter_versao_dados(db)
+        etag = _etag_requisicao('produtos', versao)
+
+        def corpo():
+            produtos, proximo_cursor = paginar_produtos_em_cache(db, filtros, apos=apos, limite=limite, versao=versao)
+            return {'produtos': [_produto_json(produto) for produto in produtos], 'proximo_cursor': proximo_cursor}
+
+        return _resposta_condicional(etag, corpo)
+    finally:
+        db.close()
+
+
+@principal.route('/api/v1/produtos/<int:produto_id>')
+@api_login_required
+def api_produto(produto_id):
+    db = SessionLocal()
+    try:
+        produto = buscar_produto(db, produto_id)
+        if produto is None:
+            return jsonify({'erro': 'Produto não encontrado.'}), 404
+        etag = _etag_requisicao('produto', produto.id, produto.quantidade, produto.atualizado_em)
+        return _resposta_condicional(etag, lambda: _produto_json(produto))
+    finally:
+        db.close()
+
+
+@principal.route('/api/v1/produtos/<int:produto_id>/historico')
+@api_login_required
+def api_produto_historico(produto_id):
+    """Entradas e saídas mensais do produto, incluindo meses já arquivados."""
+    db = SessionLocal()
+    try:
+        if buscar_produto(db, produto_id) is None:
+            return jsonify({'erro': 'Produto não encontrado.'}), 404
+        etag = _etag_requisicao('historico', produto_id, obter_versao_dados(db))
+        return _resposta_condicional(etag, lambda: {'meses': historico_mensal(db, produto_id)})
+    finally:
+        db.close()
+
+
+def _ler_fechamento(args):
+    """Lê `data` (AAAA-MM-DD) da query string; retorna (dia, momento de fechamento) ou (None, None)."""
+    dia = _ler_data(args.get('data'))
+    return (dia, fim_do_dia(dia)) if dia else (None, None)
+
+
+@principal.route('/api/v1/estoque')
+@api_login_required
+def api_estoque_historico():
+    """Estoque e valoração por produto no fechamento de uma data, paginados por id."""
+    dia, momento = _ler_fechamento(request.args)
+    if dia is None:
+        return jsonify({'erro': 'Informe data no formato AAAA-MM-DD.'}), 400
+    apos = ler_cursor_id(request.args)
+    limite = ler_tamanho_pagina(request.args)
+
+    db = SessionLocal()
+    try:
+        etag = _etag_requisicao('estoque', obter_versao_dados(db))
+
+        def corpo():
+            linhas, proximo_cursor = estoque_em(db, momento, apos=apos, limite=limite)
+            return {'data': dia.isoformat(), 'produtos': linhas, 'proximo_cursor': proximo_cursor}
+
+        return _resposta_condicional(etag, corpo)
+    except ValueError as erro:
+        return jsonify({'erro': str(erro)}), 422
+    finally:
+        db.close()
+
+
+@principal.route('/api/v1/estoque/valor')
+@api_login_required
+def api_estoque_valor():
+    """Valor total do estoque no fechamento de uma data."""
+    dia, momento = _ler_fechamento(request.args)
+    if dia is None:
+        return jsonify({'erro': 'Informe data no formato AAAA-MM-DD.'}), 400
+
+    db = SessionLocal()
+    try:
+        etag = _etag_requisicao('estoque_valor', obter_versao_dados(db))
+        return _resposta_condicional(etag, lambda: {'data': dia.isoformat(), 'valor_estoque': valor_estoque_em(db, momento)})
+    except ValueError as erro:
+        return jsonify({'erro': str(erro)}), 422
+    finally:
+        db.close()
+
+
+@principal.route('/api/v1/movimentacoes')
+@api_login_required
+def api_movimentacoes():
+    antes = decodificar_cursor_movimentacao(request.args.get('antes'))
+    limite = ler_tamanho_pagina(request.args)
+    armazem_id = request.args.get('armazem', type=int)
+
+    db = SessionLocal()
+    try:
+        etag = _etag_requisicao('movimentacoes', obter_versao_dados(db))
+
+        def corpo():
+            movs, proximo_cursor = paginar_movimentacoes(db, antes=antes, limite=limite, armazem_id=armazem_id)
+            return {
+                'movimentacoes': [
+                    dict(mov._mapping, data_movimentacao=mov.data_movimentacao.isoformat()) for mov in movs
+                ],
+                'proximo_cursor': proximo_cursor,
+            }
+
+        return _resposta_condicional(etag, corpo)
+    finally:
+        db.close()
+
+
+@principal.route('/api/v1/relatorio')
+@api_login_required
+def api_relatorio():
+    armazem_id = request.args.get('armazem', type=int)
+    db = SessionLocal()
+    try:
+        # A data entra no ETag porque "movimentações hoje" muda na virada do dia.
+        versao = obter_versao_dados(db)
+        etag = _etag_requisicao('relatorio', versao, date.today())
+        return _resposta_condicional(etag, lambda: obter_indicadores_em_cache(db, armazem_id, versao))
+    finally:
+        db.close()
+
+
+@principal.route('/api/v1/armazens')
+@api_login_required
+def api_armazens():
+    """Totais de cada armazém ativo e o consolidado de todos."""
     db = SessionLocal()
     try:
-        movs = db.query(Movimentacao).order_by(Movimentacao.data_movimentacao.desc()).limit(100).all()
+        versao = obter_versao_dados(db)
+        etag = _etag_requisicao('armazens', versao, date.today())
+
+        def corpo():
+            armazens, consolidado = obter_totais_armazens_em_cache(db, versao)
+            return {'armazens': armazens, 'consolidado': consolidado}
+
+        return _resposta_condicional(etag, corpo)
     finally:
         db.close()
 
-    movs_html = ''.join([f'''
-        <tr>
-            <td>{mov.data_movimentacao.strftime('%d/%m/%Y %H:%M')}</td>
-            <td>{mov.produto.nome}</td>
-            <td>
-                <span style="color: {'#28a745' if mov.tipo_movimentacao == 'entrada' else '#ffc107'}; font-weight: bold;">
-                    {mov.tipo_movimentacao.upper()}
-                </span>
-            </td>
-            <td>{mov.quantidade}</td>
-            <td>{mov.usuario.nome}</td>
-            <td>{mov.observacoes or '-'}</td>
-        </tr>
-    ''' for mov in movs])
-
-    content = f'''
-    <div class="card">
-        <h2>Histórico de Movimentações</h2>
-        <p style="color: #666; margin-bottom: 20px;">Últimas 100 movimentações</p>
-
-        <table>
-            <thead>
-                <tr>
-                    <th>Data/Hora</th><th>Produto</th><th>Tipo</th><th>Quantidade</th><th>Usuário</th><th>Observações</th>
-                </tr>
-            </thead>
-            <tbody>
-                {movs_html}
-            </tbody>
-        </table>
-    </div>
-    '''
-
-    return render_template_string(get_base_template(content, 'movimentacoes'))
-
-
-@app.route('/usuarios')
+
+@principal.route('/usuarios')
 @admin_required
 def usuarios():
     db = SessionLocal()
@@ -644,44 +3431,10 @@ def usuarios():
     finally:
         db.close()
 
-    users_html = ''.join([f'''
-        <tr>
-            <td>{user.id}</td>
-            <td>{user.nome}</td>
-            <td>{user.email}</td>
-            <td>
-                <span style="color: {'#28a745' if user.eh_administrador else '#007bff'}; font-weight: bold;">
-                    {'ADMIN' if user.eh_administrador else 'COMUM'}
-                </span>
-            </td>
-            <td>{user.criado_em.strftime('%d/%m/%Y')}</td>
-        </tr>
-    ''' for user in users])
-
-    content = f'''
-    <div class="card">
-        <div style="display: flex; justify-content: space-between; align-items: center; margin-bottom: 20px;">
-            <h2>Gerenciar Usuários</h2>
-            <a href="{url_for('usuario_novo')}" class="btn btn-primary">Novo Usuário</a>
-        </div>
-
-        <table>
-            <thead>
-                <tr>
-                    <th>ID</th><th>Nome</th><th>Email</th><th>Tipo</th><th>Criado em</th>
-                </tr>
-            </thead>
-            <tbody>
-                {users_html}
-            </tbody>
-        </table>
-    </div>
-    '''
-
-    return render_template_string(get_base_template(content, 'usuarios'))
-
-
-@app.route('/usuario/novo', methods=['GET', 'POST'])
+    return render_template('usuarios.html', pagina_ativa='usuarios', users=users)
+
+
+@principal.route('/usuario/novo', methods=['GET', 'POST'])
 @admin_required
 def usuario_novo():
     if request.method == 'POST':
@@ -708,142 +3461,172 @@ def usuario_novo():
                     db.add(user)
                     db.commit()
                     flash('Usuário cadastrado com sucesso!', 'success')
-                    return redirect(url_for('usuarios'))
+                    return redirect(url_for('principal.usuarios'))
+            except PoolSaturado as erro:
+                return resposta_pool_saturado(erro, 'usuario_novo.html', pagina_ativa='usuarios')
             finally:
                 db.close()
 
-    content = f'''
-    <div class="card">
-        <h2>Cadastrar Novo Usuário</h2>
-        <form method="POST">
-            <div class="form-group">
-                <label>Nome Completo *:</label>
-                <input type="text" name="nome" required>
-            </div>
-            <div class="form-group">
-                <label>Email *:</label>
-                <input type="email" name="email" required>
-            </div>
-            <div class="form-group">
-                <label>Senha *:</label>
-                <input type="password" name="senha" required>
-            </div>
-            <div class="form-group">
-                <label>
-                    <input type="checkbox" name="eh_administrador" style="width: auto; margin-right: 8px;">
-                    Usuário Administrador
-                </label>
-            </div>
-            <div style="margin-top: 20px;">
-                <button type="submit" class="btn btn-success">Cadastrar</button>
-                <a href="{url_for('usuarios')}" class="btn btn-danger">Cancelar</a>
-            </div>
-        </form>
-    </div>
-    '''
-
-    return render_template_string(get_base_template(content, 'usuarios'))
-
-
-@app.route('/relatorio')
+    return render_template('usuario_novo.html', pagina_ativa='usuarios')
+
+
+@principal.route('/usuario/<int:usuario_id>/permissoes', methods=['POST'])
+@admin_required
+def usuario_permissoes(usuario_id):
+    """Promove, rebaixa ou desativa um usuário; a mudança vale na próxima requisição dele."""
+    acao = request.form.get('acao')
+    valores = {
+        'promover': {'eh_administrador': True},
+        'rebaixar': {'eh_administrador': False},
+        'desativar': {'ativo': False},
+    }.get(acao)
+
+    if valores is None:
+        flash('Ação inválida.', 'error')
+    elif usuario_id == session['user_id'] and acao != 'promover':
+        flash('Você não pode remover o próprio acesso de administrador.', 'error')
+    else:
+        db = SessionLocal()
+        try:
+            if alterar_permissoes(db, usuario_id, **valores):
+                db.commit()
+                invalidar_permissao(usuario_id)
+                flash('Permissões atualizadas com sucesso!', 'success')
+            else:
+                flash('Usuário não encontrado.', 'error')
+        finally:
+            db.close()
+    return redirect(url_for('principal.usuarios'))
+
+
+@principal.route('/armazens')
 @login_required
-def relatorio():
+def armazens():
+    """Visão consolidada: totais de cada armazém lado a lado e de todos juntos."""
     db = SessionLocal()
     try:
-        total_produtos = db.query(Produto).count()
-        produtos_baixo = db.query(Produto).filter(
-            Produto.quantidade <= Produto.quantidade_minima
-        ).all()
+        totais, consolidado = obter_totais_armazens_em_cache(db)
+    finally:
+        db.close()
 
-        todos_produtos = db.query(Produto).all()
-        valor_total_estoque = sum([p.preco * p.quantidade for p in todos_produtos])
+    return render_template('armazens.html', pagina_ativa='armazens', armazens=totais, consolidado=consolidado)
 
-        movs_hoje = db.query(Movimentacao).filter(
-            Movimentacao.data_movimentacao >= datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        ).count()
+
+@principal.route('/armazem/novo', methods=['GET', 'POST'])
+@admin_required
+def armazem_novo():
+    if request.method == 'POST':
+        codigo = request.form['codigo'].strip().upper()
+        nome = request.form['nome'].strip()
+
+        if not codigo or not nome:
+            flash('Código e nome são obrigatórios.', 'error')
+        elif len(codigo) > 20:
+            flash('O código deve ter no máximo 20 caracteres.', 'error')
+        else:
+            db = SessionLocal()
+            try:
+                if db.query(Armazem).filter(Armazem.codigo == codigo).first():
+                    flash('Já existe um armazém com este código.', 'error')
+                else:
+                    db.add(Armazem(codigo=codigo, nome=nome))
+                    # A lista de armazéns faz parte dos dados versionados (ETag da API).
+                    aplicar_delta_resumo(db)
+                    db.commit()
+                    cache_consultas.invalidar(('armazens',))
+                    cache_consultas.invalidar_grupo('indicadores')
+                    flash('Armazém cadastrado com sucesso!', 'success')
+                    return redirect(url_for('principal.armazens'))
+            finally:
+                db.close()
+
+    return render_template('armazem_novo.html', pagina_ativa='armazens')
+
+
+@principal.route('/relatorio/estoque')
+@login_required
+def relatorio_estoque():
+    """Inventário valorado no fechamento de uma data (padrão: fim do mês anterior)."""
+    dia, momento = _ler_fechamento(request.args)
+    if dia is None:
+        dia = date.today().replace(day=1) - timedelta(days=1)
+        momento = fim_do_dia(dia)
+    apos = ler_cursor_id(request.args)
+    limite = ler_tamanho_pagina(request.args)
+
+    linhas, proximo_cursor, valor_total = [], None, None
+    db = SessionLocal()
+    try:
+        linhas, proximo_cursor = estoque_em(db, momento, apos=apos, limite=limite)
+        valor_total = valor_estoque_em(db, momento)
+    except ValueError as erro:
+        flash(str(erro), 'error')
+    finally:
+        db.close()
+
+    parametros = {'data': dia.isoformat()}
+    if limite != TAMANHO_PAGINA_PADRAO:
+        parametros['limite'] = limite
+    return render_template(
+        'relatorio_estoque.html',
+        pagina_ativa='relatorio',
+        dia=dia,
+        linhas=linhas,
+        valor_total=valor_total,
+        parametros=parametros,
+        apos=apos,
+        proximo_cursor=proximo_cursor,
+    )
+
+
+@principal.route('/cache/estatisticas')
+@admin_required
+def cache_estatisticas():
+    """Acertos, falhas, despejos e ocupação do cache de leituras deste processo."""
+    return jsonify(cache_consultas.estatisticas())
+
+
+@principal.route('/relatorio')
+@login_required
+def relatorio():
+    armazem_id = request.args.get('armazem', type=int)
+    db = SessionLocal()
+    try:
+        indicadores = obter_indicadores_em_cache(db, armazem_id)
+        produtos_baixo = listar_estoque_baixo_em_cache(db, armazem_id=armazem_id)
+        # A previsão de demanda é do estoque consolidado.
+        previsao_ruptura = [] if armazem_id else listar_previsao_ruptura(db)
+        armazens = listar_armazens(db)
     finally:
         db.close()
 
-    produtos_baixo_html = ''.join([f'''
-        <tr class="estoque-baixo">
-            <td><strong>{produto.nome}</strong></td>
-            <td>{produto.quantidade}</td>
-            <td>{produto.quantidade_minima}</td>
-            <td style="color: #dc3545; font-weight: bold;">
-                {produto.quantidade_minima - produto.quantidade} unidades
-            </td>
-            <td>
-                <a href="{url_for('entrada_estoque', produto_id=produto.id)}" class="btn btn-success">Repor</a>
-            </td>
-        </tr>
-    ''' for produto in produtos_baixo])
-
-    produtos_baixo_section = f'''
-        <div style="margin-top: 30px;">
-            <h3 style="color: #856404;">⚠️ Produtos com Estoque Baixo</h3>
-            <table>
-                <thead>
-                    <tr>
-                        <th>Produto</th><th>Estoque Atual</th><th>Estoque Mínimo</th><th>Diferença</th><th>Ação</th>
-                    </tr>
-                </thead>
-                <tbody>
-                    {produtos_baixo_html}
-                </tbody>
-            </table>
-        </div>
-    ''' if produtos_baixo else '''
-        <div class="alert alert-success" style="margin-top: 20px;">
-            <strong>✅ Parabéns!</strong> Todos os produtos estão com estoque adequado.
-        </div>
-    '''
-
-    content = f'''
-    <div class="card">
-        <h2>Relatório do Sistema</h2>
-
-        <div class="stats-grid">
-            <div class="stat-card">
-                <div class="stat-number">{total_produtos}</div>
-                <div>Total de Produtos</div>
-            </div>
-            <div class="stat-card" style="background: linear-gradient(135deg, #11998e 0%, #38ef7d 100%);">
-                <div class="stat-number">R$ {valor_total_estoque:.2f}</div>
-                <div>Valor do Estoque</div>
-            </div>
-            <div class="stat-card" style="background: linear-gradient(135deg, #ffecd2 0%, #fcb69f 100%); color: #333;">
-                <div class="stat-number">{len(produtos_baixo)}</div>
-                <div>Estoque Baixo</div>
-            </div>
-            <div class="stat-card" style="background: linear-gradient(135deg, #a8edea 0%, #fed6e3 100%); color: #333;">
-                <div class="stat-number">{movs_hoje}</div>
-                <div>Movimentações Hoje</div>
-            </div>
-        </div>
-
-        {produtos_baixo_section}
-
-        <div style="margin-top: 30px;">
-            <h3>Resumo por Status</h3>
-            <div style="display: grid; grid-template-columns: 1fr 1fr; gap: 20px; margin-top: 15px;">
-                <div class="card" style="background: #d4edda; border: 1px solid #c3e6cb;">
-                    <h4 style="color: #155724; margin-bottom: 10px;">Produtos com Estoque OK</h4>
-                    <div style="font-size: 2em; font-weight: bold; color: #155724;">
-                        {total_produtos - len(produtos_baixo)}
-                    </div>
-                </div>
-                <div class="card" style="background: #fff3cd; border: 1px solid #ffeaa7;">
-                    <h4 style="color: #856404; margin-bottom: 10px;">Produtos com Estoque Baixo</h4>
-                    <div style="font-size: 2em; font-weight: bold; color: #856404;">
-                        {len(produtos_baixo)}
-                    </div>
-                </div>
-            </div>
-        </div>
-    </div>
-    '''
-
-    return render_template_string(get_base_template(content, 'relatorio'))
+    return render_template(
+        'relatorio.html',
+        pagina_ativa='relatorio',
+        armazens=armazens,
+        armazem_id=armazem_id,
+        indicadores=indicadores,
+        produtos_baixo=produtos_baixo,
+        previsao_ruptura=previsao_ruptura,
+        janela_demanda=DEMANDA_JANELA_DIAS,
+    )
+
+
+def create_app(config=None):
+    """
+    Monta a aplicação. `config` sobrepõe as chaves padrão: DATABASE_URL
+    (LOGIFLOW_DATABASE_URL), SECRET_KEY (LOGIFLOW_SECRET_KEY) e MIGRAR_BANCO
+    (migra o schema no primeiro acesso ao banco). Nada é conectado aqui: a
+    engine e o schema só são preparados na primeira consulta. O banco é
+    único por processo; os demais parâmetros vêm das variáveis LOGIFLOW_*.
+    """
+    app = Flask(__name__)
+    app.config.update(DATABASE_URL=URL_BANCO_DADOS, SECRET_KEY=CHAVE_SECRETA, MIGRAR_BANCO=True)
+    if config:
+        app.config.update(config)
+    configurar_banco(app.config['DATABASE_URL'], migrar=app.config['MIGRAR_BANCO'])
+    app.register_blueprint(principal)
+    return app
 
 
 if __name__ == '__main__':
@@ -855,7 +3638,10 @@ if __name__ == '__main__':
     print("🔑 Senha padrão: admin123")
     print("=" * 60)
     print("✅ Sistema iniciado com sucesso!")
+    print("⚙️  Servidor de desenvolvimento; em produção use: python src/servidor.py")
     print("=" * 60)
 
+    app = create_app()
     create_admin_user()
+    precompilar_templates(app)
     app.run(debug=True, host='0.0.0.0', port=1531)
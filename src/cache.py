@@ -0,0 +1,105 @@
+"""
+Cache em memória para as leituras mais frequentes do LogiFlow.
+
+Cada processo mantém o seu próprio cache. As chaves são tuplas cujo primeiro
+elemento é o grupo da consulta (por exemplo `('produto', 42)`), o que permite
+invalidar um grupo inteiro ou só as entradas afetadas por uma escrita.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheTTL:
+    """
+    Cache LRU com expiração por tempo, seguro para uso entre threads.
+
+    Entradas podem declarar uma faixa `(inicio, fim]` de ids que cobrem; uma
+    escrita no id X invalida só as entradas do grupo cuja faixa contém X
+    (`fim=None` indica faixa aberta, como a última página de uma listagem).
+    """
+
+    def __init__(self, capacidade=2048, ttl=10.0, relogio=time.monotonic):
+        self.capacidade = capacidade
+        self.ttl = ttl
+        self._relogio = relogio
+        self._entradas = OrderedDict()
+        self._trava = threading.Lock()
+        # Incrementada a cada invalidação: um valor carregado antes dela não é
+        # armazenado, pois pode ter sido lido antes da escrita ser confirmada.
+        self._geracao = 0
+        self._estatisticas = {'acertos': 0, 'falhas': 0, 'despejos': 0, 'expiracoes': 0, 'invalidacoes': 0}
+
+    def obter(self, chave, carregar, faixa=None):
+        """
+        Retorna o valor em cache para `chave` ou o carrega com `carregar()`.
+        `faixa`, se informada, é uma função que recebe o valor carregado e
+        devolve a faixa de ids `(inicio, fim)` que ele cobre.
+        """
+        agora = self._relogio()
+        with self._trava:
+            entrada = self._entradas.get(chave)
+            if entrada is not None:
+                valor, expira_em, _ = entrada
+                if expira_em > agora:
+                    self._entradas.move_to_end(chave)
+                    self._estatisticas['acertos'] += 1
+                    return valor
+                del self._entradas[chave]
+                self._estatisticas['expiracoes'] += 1
+            self._estatisticas['falhas'] += 1
+            geracao = self._geracao
+
+        valor = carregar()
+        faixa_valor = faixa(valor) if faixa else None
+
+        with self._trava:
+            if geracao == self._geracao and self.capacidade > 0 and self.ttl > 0:
+                self._entradas[chave] = (valor, agora + self.ttl, faixa_valor)
+                self._entradas.move_to_end(chave)
+                while len(self._entradas) > self.capacidade:
+                    self._entradas.popitem(last=False)
+                    self._estatisticas['despejos'] += 1
+        return valor
+
+    def invalidar(self, chave):
+        with self._trava:
+            self._geracao += 1
+            if self._entradas.pop(chave, None) is not None:
+                self._estatisticas['invalidacoes'] += 1
+
+    def invalidar_grupo(self, grupo):
+        self._remover(lambda chave, faixa: chave[0] == grupo)
+
+    def invalidar_faixa(self, grupo, identificador):
+        """Remove as entradas do grupo cuja faixa contém `identificador`."""
+        def afetada(chave, faixa):
+            if chave[0] != grupo:
+                return False
+            if faixa is None:
+                return True
+            inicio, fim = faixa
+            return (inicio is None or identificador > inicio) and (fim is None or identificador <= fim)
+        self._remover(afetada)
+
+    def limpar(self):
+        self._remover(lambda chave, faixa: True)
+
+    def estatisticas(self):
+        with self._trava:
+            dados = dict(self._estatisticas)
+            dados['tamanho'] = len(self._entradas)
+        dados['capacidade'] = self.capacidade
+        dados['ttl'] = self.ttl
+        consultas = dados['acertos'] + dados['falhas']
+        dados['taxa_acerto'] = round(dados['acertos'] / consultas, 4) if consultas else 0.0
+        return dados
+
+    def _remover(self, criterio):
+        with self._trava:
+            self._geracao += 1
+            removidas = [chave for chave, (_, _, faixa) in self._entradas.items() if criterio(chave, faixa)]
+            for chave in removidas:
+                del self._entradas[chave]
+            self._estatisticas['invalidacoes'] += len(removidas)
@@ -0,0 +1,137 @@
+"""
+Central de eventos em processo para o dashboard ao vivo (Server-Sent Events).
+
+As rotas de movimentação publicam, depois do commit, deltas compactos
+`{"id", "quantidade", "minimo", "baixo"}`. Cada assinante (uma conexão SSE)
+guarda só o estado mais recente de cada produto alterado desde a última
+entrega, então uma rajada de movimentações no mesmo item vira um único
+evento, e um cliente lento nunca acumula mais do que um delta por produto.
+
+Escritas feitas em outros processos chegam pelo vigia: enquanto houver
+assinantes, uma thread consulta periodicamente os produtos alterados desde
+a última verificação e publica o que ainda não foi publicado.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class LimiteAssinantes(Exception):
+    """O processo já atende o número máximo de conexões de eventos."""
+
+
+class Assinatura:
+    """
+    Fila de uma conexão: deltas pendentes por produto, o mais recente vence.
+    Com `produto_ids`, só recebe os deltas desses produtos (os visíveis na página).
+    """
+
+    def __init__(self, produto_ids=None):
+        self.produto_ids = frozenset(produto_ids) if produto_ids is not None else None
+        self._pendentes = OrderedDict()
+        self._condicao = threading.Condition()
+
+    def entregar(self, deltas):
+        if self.produto_ids is not None:
+            deltas = [delta for delta in deltas if delta['id'] in self.produto_ids]
+            if not deltas:
+                return
+        with self._condicao:
+            for delta in deltas:
+                self._pendentes[delta['id']] = delta
+                self._pendentes.move_to_end(delta['id'])
+            self._condicao.notify()
+
+    def aguardar(self, timeout):
+        """Retorna os deltas pendentes, esperando até `timeout` segundos por algum."""
+        with self._condicao:
+            if not self._pendentes:
+                self._condicao.wait(timeout)
+            deltas = list(self._pendentes.values())
+            self._pendentes.clear()
+        return deltas
+
+
+class CentralEventos:
+    """
+    Distribui deltas de estoque às assinaturas deste processo.
+
+    `consultar_alteracoes(marca)` é chamada pelo vigia a cada `intervalo`
+    segundos e deve retornar `(deltas, nova_marca)`; com `None`, o vigia não
+    é usado e só as publicações deste processo chegam aos assinantes.
+    """
+
+    def __init__(self, max_assinantes=200, consultar_alteracoes=None, intervalo=2.0, memoria=10000):
+        self.max_assinantes = max_assinantes
+        self.intervalo = intervalo
+        self._consultar_alteracoes = consultar_alteracoes
+        self._trava = threading.Lock()
+        self._assinaturas = set()
+        # Último estado publicado por produto, para não repetir o que o vigia
+        # relê e que este processo já publicou.
+        self._ultimos = OrderedDict()
+        self._memoria = memoria
+        self._vigia = None
+        self._pid = None
+        self._publicados = 0
+
+    def assinar(self, produto_ids=None):
+        with self._trava:
+            if self._pid != os.getpid():
+                # Depois de um fork, assinaturas e vigia pertencem ao processo pai.
+                self._assinaturas, self._vigia, self._pid = set(), None, os.getpid()
+            if len(self._assinaturas) >= self.max_assinantes:
+                raise LimiteAssinantes()
+            assinatura = Assinatura(produto_ids)
+            self._assinaturas.add(assinatura)
+            if self._consultar_alteracoes and (self._vigia is None or not self._vigia.is_alive()):
+                self._vigia = threading.Thread(target=self._vigiar, name='logiflow-eventos', daemon=True)
+                self._vigia.start()
+        return assinatura
+
+    def cancelar(self, assinatura):
+        with self._trava:
+            self._assinaturas.discard(assinatura)
+
+    def publicar(self, deltas):
+        """Envia aos assinantes os deltas que mudam o último estado publicado."""
+        with self._trava:
+            novos = []
+            for delta in deltas:
+                if self._ultimos.get(delta['id']) == delta:
+                    continue
+                self._ultimos[delta['id']] = delta
+                self._ultimos.move_to_end(delta['id'])
+                novos.append(delta)
+            while len(self._ultimos) > self._memoria:
+                self._ultimos.popitem(last=False)
+            if not novos:
+                return
+            self._publicados += len(novos)
+            assinaturas = list(self._assinaturas)
+        for assinatura in assinaturas:
+            assinatura.entregar(novos)
+
+    def estatisticas(self):
+        with self._trava:
+            return {'assinantes': len(self._assinaturas), 'publicados': self._publicados}
+
+    def _vigiar(self):
+        marca = None
+        while True:
+            with self._trava:
+                if not self._assinaturas:
+                    self._vigia = None
+                    return
+            try:
+                deltas, marca = self._consultar_alteracoes(marca)
+            except Exception:
+                # Uma falha do banco não derruba o vigia; tenta no próximo ciclo.
+                logging.getLogger('logiflow.eventos').exception('Falha ao consultar alterações de estoque')
+                deltas = []
+            if deltas:
+                self.publicar(deltas)
+            time.sleep(self.intervalo)
@@ -0,0 +1,234 @@
+"""
+Métricas de requisições e de SQL no formato de exposição do Prometheus.
+
+Cada requisição abre uma coleta (em uma ContextVar, isolada por thread); os
+eventos da engine somam nela as instruções executadas, o tempo gasto no
+banco e as linhas lidas ou afetadas. Ao final da requisição a coleta é
+acumulada no registro, agrupada pela rota (o endpoint do Flask, e não a URL,
+para que ids não criem séries novas).
+"""
+
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+
+from sqlalchemy import event
+# Classe interna do SQLAlchemy, sem equivalente público para contar as linhas
+# lidas; a faixa de versões em requirements.txt é a verificada com ela, e os
+# testes de métricas falham se a interface mudar.
+from sqlalchemy.engine.cursor import CursorFetchStrategy
+
+BALDES_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_coleta_atual = contextvars.ContextVar('logiflow_coleta', default=None)
+
+
+class Coleta:
+    """Totais de SQL de uma requisição; guarda as instruções só se pedido."""
+
+    __slots__ = ('consultas', 'tempo_sql', 'linhas', 'instrucoes', 'limite_instrucoes', 'inicio_sql')
+
+    def __init__(self, limite_instrucoes=0):
+        self.consultas = 0
+        self.tempo_sql = 0.0
+        self.linhas = 0
+        self.instrucoes = []
+        self.limite_instrucoes = limite_instrucoes
+        self.inicio_sql = None
+
+    def registrar(self, instrucao, duracao):
+        self.consultas += 1
+        self.tempo_sql += duracao
+        if len(self.instrucoes) < self.limite_instrucoes:
+            self.instrucoes.append((instrucao, duracao))
+
+
+def iniciar_coleta(limite_instrucoes=0):
+    """Abre uma coleta no contexto atual; retorna (coleta, token)."""
+    coleta = Coleta(limite_instrucoes)
+    return coleta, _coleta_atual.set(coleta)
+
+
+def encerrar_coleta(token):
+    _coleta_atual.reset(token)
+
+
+def coleta_atual():
+    return _coleta_atual.get()
+
+
+class _BuscaContada(CursorFetchStrategy):
+    """Estratégia de leitura do cursor que soma as linhas entregues à coleta."""
+
+    __slots__ = ('coleta',)
+
+    def __init__(self, coleta):
+        self.coleta = coleta
+
+    def fetchone(self, result, dbapi_cursor, hard_close=False):
+        linha = super().fetchone(result, dbapi_cursor, hard_close)
+        if linha is not None:
+            self.coleta.linhas += 1
+        return linha
+
+    def fetchmany(self, result, dbapi_cursor, size=None):
+        linhas = super().fetchmany(result, dbapi_cursor, size)
+        self.coleta.linhas += len(linhas or ())
+        return linhas
+
+    def fetchall(self, result, dbapi_cursor):
+        linhas = super().fetchall(result, dbapi_cursor)
+        self.coleta.linhas += len(linhas or ())
+        return linhas
+
+
+def _antes_da_execucao(conexao, cursor, instrucao, parametros, contexto, executemany):
+    coleta = _coleta_atual.get()
+    if coleta is not None:
+        # Instruções de uma mesma requisição são sequenciais (mesma thread).
+        coleta.inicio_sql = time.perf_counter()
+
+
+def _depois_da_execucao(conexao, cursor, instrucao, parametros, contexto, executemany):
+    coleta = _coleta_atual.get()
+    if coleta is None or coleta.inicio_sql is None:
+        return
+    coleta.registrar(instrucao, time.perf_counter() - coleta.inicio_sql)
+    coleta.inicio_sql = None
+
+    if contexto is None:
+        return
+    if contexto.isinsert or contexto.isupdate or contexto.isdelete:
+        # Sem RETURNING, as linhas da escrita são as afetadas; com RETURNING
+        # elas também são lidas, e a contagem fica com a estratégia abaixo.
+        if cursor.description is None and cursor.rowcount > 0:
+            coleta.linhas += cursor.rowcount
+        if cursor.description is None:
+            return
+    # Só substitui a estratégia padrão: dialetos que já bufferizam o
+    # resultado (cursores do servidor, INSERT em massa) ficam como estão.
+    if type(contexto.cursor_fetch_strategy) is CursorFetchStrategy:
+        contexto.cursor_fetch_strategy = _BuscaContada(coleta)
+
+
+def instrumentar_engine(engine):
+    """Registra os eventos de cursor que alimentam a coleta da requisição."""
+    event.listen(engine, 'before_cursor_execute', _antes_da_execucao)
+    event.listen(engine, 'after_cursor_execute', _depois_da_execucao)
+
+
+class Histograma:
+    def __init__(self, baldes=BALDES_LATENCIA):
+        self.baldes = baldes
+        self.contagens = [0] * (len(baldes) + 1)
+        self.soma = 0.0
+
+    def observar(self, valor):
+        self.contagens[bisect_left(self.baldes, valor)] += 1
+        self.soma += valor
+
+
+def _rotulos(**valores):
+    pares = []
+    for nome, valor in valores.items():
+        valor = str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pares.append(f'{nome}="{valor}"')
+    return '{' + ','.join(pares) + '}'
+
+
+def _numero(valor):
+    if valor == float('inf'):
+        return '+Inf'
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class RegistroMetricas:
+    """
+    Acumula as métricas do processo. Coletores adicionais (funções sem
+    argumentos que retornam `(nome, tipo, ajuda, [(rotulos, valor)])`) são
+    chamados a cada exportação, para medidores lidos na hora, como o cache.
+    """
+
+    def __init__(self, baldes=BALDES_LATENCIA):
+        self.baldes = baldes
+        self._trava = threading.Lock()
+        self._requisicoes = {}
+        self._latencias = {}
+        self._sql = {}
+        self._coletores = []
+
+    def adicionar_coletor(self, coletor):
+        self._coletores.append(coletor)
+        return coletor
+
+    def observar(self, rota, metodo, status, duracao, coleta):
+        with self._trava:
+            chave_status = (rota, metodo, str(status))
+            self._requisicoes[chave_status] = self._requisicoes.get(chave_status, 0) + 1
+
+            histograma = self._latencias.get((rota, metodo))
+            if histograma is None:
+                histograma = self._latencias[(rota, metodo)] = Histograma(self.baldes)
+            histograma.observar(duracao)
+
+            consultas, tempo, linhas = self._sql.get(rota, (0, 0.0, 0))
+            self._sql[rota] = (consultas + coleta.consultas, tempo + coleta.tempo_sql, linhas + coleta.linhas)
+
+    def totais_sql(self):
+        """Totais acumulados por rota: {rota: (instrucoes, tempo_sql, linhas)}."""
+        with self._trava:
+            return dict(self._sql)
+
+    def limpar(self):
+        with self._trava:
+            self._requisicoes.clear()
+            self._latencias.clear()
+            self._sql.clear()
+
+    def exportar(self):
+        """Texto no formato de exposição do Prometheus (versão 0.0.4)."""
+        with self._trava:
+            requisicoes = sorted(self._requisicoes.items())
+            latencias = sorted(
+                (chave, list(h.contagens), h.soma) for chave, h in self._latencias.items()
+            )
+            sql = sorted(self._sql.items())
+
+        linhas = [
+            '# HELP logiflow_http_requisicoes_total Requisições atendidas por rota, método e status.',
+            '# TYPE logiflow_http_requisicoes_total counter',
+        ]
+        for (rota, metodo, status), total in requisicoes:
+            linhas.append(f'logiflow_http_requisicoes_total{_rotulos(rota=rota, metodo=metodo, status=status)} {total}')
+
+        linhas += [
+            '# HELP logiflow_http_duracao_segundos Latência das requisições por rota e método.',
+            '# TYPE logiflow_http_duracao_segundos histogram',
+        ]
+        for (rota, metodo), contagens, soma in latencias:
+            acumulado = 0
+            for limite, contagem in zip(self.baldes + (float('inf'),), contagens):
+                acumulado += contagem
+                rotulos = _rotulos(rota=rota, metodo=metodo, le=_numero(limite))
+                linhas.append(f'logiflow_http_duracao_segundos_bucket{rotulos} {acumulado}')
+            rotulos = _rotulos(rota=rota, metodo=metodo)
+            linhas.append(f'logiflow_http_duracao_segundos_sum{rotulos} {_numero(soma)}')
+            linhas.append(f'logiflow_http_duracao_segundos_count{rotulos} {acumulado}')
+
+        for indice, (nome, ajuda) in enumerate((
+            ('logiflow_sql_instrucoes_total', 'Instruções SQL executadas por rota.'),
+            ('logiflow_sql_duracao_segundos_total', 'Tempo gasto no banco por rota.'),
+            ('logiflow_sql_linhas_total', 'Linhas lidas ou afetadas pelas instruções SQL por rota.'),
+        )):
+            linhas += [f'# HELP {nome} {ajuda}', f'# TYPE {nome} counter']
+            for rota, valores in sql:
+                linhas.append(f'{nome}{_rotulos(rota=rota)} {_numero(valores[indice])}')
+
+        for coletor in self._coletores:
+            nome, tipo, ajuda, amostras = coletor()
+            linhas += [f'# HELP {nome} {ajuda}', f'# TYPE {nome} {tipo}']
+            for rotulos, valor in amostras:
+                linhas.append(f'{nome}{_rotulos(**rotulos) if rotulos else ""} {_numero(valor)}')
+
+        return '\n'.join(linhas) + '\n'
@@ -0,0 +1,74 @@
+"""
+Execução de hashing de senhas fora da thread da requisição.
+
+O bcrypt é deliberadamente lento e libera o GIL enquanto calcula, então um
+pool de threads pequeno basta para que logins simultâneos não travem as
+demais requisições. A fila é limitada: com o pool cheio, a chamada falha na
+hora com `PoolSaturado` em vez de acumular latência.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PoolSaturado(Exception):
+    """Todas as vagas do pool estão ocupadas; tente novamente após `retry_after` segundos."""
+
+    def __init__(self, retry_after):
+        super().__init__(f'Pool de hashing saturado; tente novamente em {retry_after}s.')
+        self.retry_after = retry_after
+
+
+class PoolHash:
+    """
+    Pool de threads com no máximo `trabalhadores + fila_maxima` tarefas
+    admitidas ao mesmo tempo. O executor é criado sob demanda e recriado
+    se o processo foi bifurcado (fork), pois threads não sobrevivem ao fork.
+    """
+
+    def __init__(self, trabalhadores=2, fila_maxima=16, retry_after=2):
+        self.trabalhadores = max(1, trabalhadores)
+        self.fila_maxima = max(0, fila_maxima)
+        self.retry_after = retry_after
+        self._trava = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._em_uso = 0
+        self._rejeitadas = 0
+
+    @property
+    def capacidade(self):
+        return self.trabalhadores + self.fila_maxima
+
+    def _preparar(self):
+        if self._executor is not None and self._pid == os.getpid():
+            return
+        with self._trava:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(self.trabalhadores, thread_name_prefix='logiflow-hash')
+                self._pid = os.getpid()
+                self._em_uso = 0
+
+    def executar(self, funcao, *args):
+        """Executa `funcao(*args)` no pool e aguarda o resultado."""
+        self._preparar()
+        with self._trava:
+            if self._em_uso >= self.capacidade:
+                self._rejeitadas += 1
+                raise PoolSaturado(self.retry_after)
+            self._em_uso += 1
+        try:
+            return self._executor.submit(funcao, *args).result()
+        finally:
+            with self._trava:
+                self._em_uso -= 1
+
+    def estatisticas(self):
+        with self._trava:
+            return {
+                'trabalhadores': self.trabalhadores,
+                'capacidade': self.capacidade,
+                'em_uso': self._em_uso,
+                'rejeitadas': self._rejeitadas,
+            }
@@ -0,0 +1,119 @@
+"""
+Servidor de produção do LogiFlow: um processo mestre e vários workers.
+
+O mestre monta a aplicação, prepara o schema, compila os templates e abre o
+socket uma única vez; depois faz fork dos workers, que herdam tudo isso já
+pronto (cópia sob demanda da memória) e aceitam conexões do mesmo socket,
+com o kernel distribuindo as conexões entre eles. Cada worker atende com
+várias threads e abre o próprio pool de conexões com o banco (as herdadas
+do mestre são descartadas no fork, ver `_descartar_conexoes_herdadas`).
+Workers que morrem são substituídos; SIGTERM ou SIGINT encerra todos.
+
+Uso:
+    python src/servidor.py [--host 0.0.0.0] [--porta 1531] [--workers N]
+"""
+
+import argparse
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+
+from werkzeug.serving import make_server
+
+from app import create_app, create_admin_user, obter_engine, precompilar_templates
+
+WORKERS_PADRAO = int(os.environ.get('LOGIFLOW_WORKERS', os.cpu_count() or 1))
+
+
+def preparar_aplicacao():
+    """Trabalho feito uma vez no mestre, antes do fork."""
+    app = create_app()
+    create_admin_user()
+    precompilar_templates(app)
+    # As conexões usadas na preparação não devem atravessar o fork.
+    obter_engine().dispose()
+    return app
+
+
+def _trabalhar(app, soquete, host, porta):
+    """Laço de um worker: atende o socket herdado até receber SIGTERM."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    servidor = make_server(host, porta, app, threaded=True, fd=soquete.fileno())
+
+    def encerrar(_sinal, _quadro):
+        # shutdown() espera o laço terminar, então não pode rodar na thread dele.
+        threading.Thread(target=servidor.shutdown).start()
+
+    signal.signal(signal.SIGTERM, encerrar)
+    servidor.serve_forever()
+    servidor.server_close()
+
+
+def servir(host, porta, workers):
+    app = preparar_aplicacao()
+    soquete = socket.create_server((host, porta), backlog=2048)
+    soquete.set_inheritable(True)
+    filhos = set()
+    encerrando = False
+
+    def iniciar_worker():
+        pid = os.fork()
+        if pid == 0:
+            codigo = 0
+            try:
+                _trabalhar(app, soquete, host, porta)
+            except BaseException:
+                traceback.print_exc()
+                codigo = 1
+            finally:
+                os._exit(codigo)
+        filhos.add(pid)
+
+    def parar(_sinal, _quadro):
+        nonlocal encerrando
+        encerrando = True
+        for pid in list(filhos):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    for _ in range(workers):
+        iniciar_worker()
+    signal.signal(signal.SIGTERM, parar)
+    signal.signal(signal.SIGINT, parar)
+    print(f'LogiFlow atendendo em http://{host}:{porta} com {workers} worker(s) (mestre {os.getpid()})')
+
+    while filhos:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        filhos.discard(pid)
+        if not encerrando:
+            print(f'Worker {pid} terminou (status {status}); iniciando outro.', file=sys.stderr)
+            # Evita um laço de reinícios se o worker morre logo ao subir.
+            time.sleep(1)
+            if not encerrando:
+                iniciar_worker()
+    soquete.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--porta', type=int, default=1531)
+    parser.add_argument('--workers', type=int, default=WORKERS_PADRAO,
+                        help='processos atendendo (padrão: LOGIFLOW_WORKERS ou o número de CPUs)')
+    args = parser.parse_args()
+    servir(args.host, args.porta, max(1, args.workers))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+// Atualiza estoque, mínimo e status das linhas visíveis do dashboard a partir
+// dos eventos do servidor, sem recarregar a página.
+(function () {
+    var tabela = document.querySelector('table[data-eventos-estoque]');
+    if (!tabela || !window.EventSource) {
+        return;
+    }
+
+    var linhas = {};
+    tabela.querySelectorAll('tr[data-produto-id]').forEach(function (linha) {
+        linhas[linha.dataset.produtoId] = linha;
+    });
+    var ids = Object.keys(linhas);
+    if (!ids.length) {
+        return;
+    }
+
+    function aplicar(delta) {
+        var linha = linhas[delta.id];
+        if (!linha) {
+            return;
+        }
+        linha.querySelector('[data-campo="quantidade"]').textContent = delta.quantidade;
+        linha.querySelector('[data-campo="minimo"]').textContent = delta.minimo;
+        linha.classList.toggle('estoque-baixo', delta.baixo);
+        var status = linha.querySelector('[data-campo="status"] span');
+        status.className = delta.baixo ? 'status-baixo' : 'status-ok';
+        status.textContent = delta.baixo ? 'BAIXO' : 'OK';
+    }
+
+    var fonte = new EventSource(tabela.dataset.eventosEstoque + '?ids=' + ids.join(','));
+    fonte.addEventListener('estoque', function (evento) {
+        JSON.parse(evento.data).forEach(aplicar);
+    });
+    window.addEventListener('pagehide', function () {
+        fonte.close();
+    });
+})();